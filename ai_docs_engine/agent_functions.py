@@ -1,6 +1,6 @@
 # This file contains the agent functions that are used by the AI Docs Engine.
 
-from ai_docs_engine.docstring_schema import ClassDocstringData, FunctionDocstringData
+from ai_docs_engine.docstring_schema import BatchDocstringData, ChunkSummaryData, ClassDocstringData, FunctionDocstringData
 
 
 # TODO: Add more agent functions here
@@ -15,4 +15,16 @@ RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_FUNCTION = {
 RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_CLASS = {
   "name": "respond_with_structured_docstring_data_for_class",
   "parameters": ClassDocstringData.schema(),
-}
\ No newline at end of file
+}
+
+# This agent function generates the summary of one part of a function which is too large to document at once.
+RESPOND_WITH_CHUNK_SUMMARY = {
+  "name": "respond_with_chunk_summary",
+  "parameters": ChunkSummaryData.schema(),
+}
+
+# This agent function generates the structured data for the docstrings of several definitions at once.
+RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_DEFINITIONS = {
+  "name": "respond_with_structured_docstring_data_for_definitions",
+  "parameters": BatchDocstringData.schema(),
+}
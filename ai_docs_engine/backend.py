@@ -0,0 +1,247 @@
+from typing import Any, Callable, Dict, Optional, Tuple
+import concurrent.futures
+import functools
+import inspect
+import asyncio
+
+from ai_docs_engine.docstring_schema import ClassDocstringData, FunctionDocstringData
+from ai_docs_engine.cache import get_cache_fingerprint
+from ai_docs_engine.errors import AIDocsEngineError
+
+
+def with_bulk_format(
+  render_request: Callable[..., dict],
+  parse_response: Callable[..., FunctionDocstringData | ClassDocstringData],
+):
+  """
+  Attaches the functions which render requests for, and parse responses
+  from, offline bulk runs to a `GenerateDocstringFunc`, see
+  `BaseDocstringBackend.render_request` and `BaseDocstringBackend.parse_response`.
+  """
+  def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+    func.render_request = render_request
+    func.parse_response = parse_response
+    return func
+  return decorator
+
+
+class BaseDocstringBackend:
+  """
+  Asynchronous docstring generation backend. Unlike a `GenerateDocstringFunc`,
+  a backend doesn't need a thread per request, so a single event loop can
+  keep thousands of requests in flight.
+
+  Backends are used from one event loop at a time, and `aclose` is awaited
+  on that loop once a run is done with it; backends which hold loop-bound
+  resources (e.g. HTTP connection pools) should create them lazily, so that
+  they can be reused by later runs.
+  """
+
+  async def generate(
+    self,
+    language: str,
+    definition: str,
+    definition_type: str,
+    temperature: float,
+  ) -> FunctionDocstringData | ClassDocstringData:
+    raise NotImplementedError()
+
+
+  async def generate_many(
+    self,
+    language: str,
+    definitions: Dict[str, Tuple[str, str]],
+    temperature: float,
+  ) -> Dict[str, FunctionDocstringData | ClassDocstringData]:
+    """
+    Generates docstrings for several definitions, given as
+    `(definition, definition_type)` keyed by definition ID, in one request.
+    Only called if `supports_batching` is true.
+    """
+    raise NotImplementedError()
+
+
+  async def summarize_chunk(
+    self,
+    language: str,
+    definition: str,
+    temperature: float,
+  ) -> str:
+    """
+    Summarizes one part of a function which is too large to document at
+    once, given as its signature followed by that part of its body, see
+    `ai_docs_engine.chunking`. By default, this is the description of the
+    docstring `generate` comes up with for it.
+    """
+    docstring_data = await self.generate(
+      language=language,
+      definition=definition,
+      definition_type="function",
+      temperature=temperature,
+    )
+    return docstring_data.description
+
+
+  @property
+  def supports_batching(self) -> bool:
+    return False
+
+
+  def render_request(
+    self,
+    language: str,
+    definition: str,
+    definition_type: str,
+    temperature: float,
+  ) -> dict:
+    """
+    Renders the request `generate` would send as a JSON object with
+    `method`, `url` and `body`, for offline bulk runs.
+    """
+    raise NotImplementedError()
+
+
+  def parse_response(
+    self,
+    response: dict,
+    language: str,
+    definition: str,
+    definition_type: str,
+  ) -> FunctionDocstringData | ClassDocstringData:
+    """Parses the response body to a request rendered by `render_request`."""
+    raise NotImplementedError()
+
+
+  def cache_fingerprint(self) -> str:
+    # Should change whenever anything that affects the output of the backend changes, see `with_cache_fingerprint`
+    return f"{type(self).__module__}.{type(self).__qualname__}"
+
+
+  async def aclose(self) -> None:
+    pass
+
+
+class CallableDocstringBackend(BaseDocstringBackend):
+  """
+  Adapts a `GenerateDocstringFunc` and an optional `BatchGenerateDocstringFunc`
+  to the backend protocol. Coroutine functions are awaited directly, while
+  blocking functions are run on a thread pool with `max_threads` threads.
+  """
+
+  def __init__(
+    self,
+    generate_docstring_func: Callable[..., Any],
+    batch_generate_docstring_func: Optional[Callable[..., Any]] = None,
+    max_threads: int = 32,
+  ) -> None:
+    assert callable(generate_docstring_func), "Expected generate_docstring_func to be callable"
+    assert batch_generate_docstring_func is None or callable(batch_generate_docstring_func), "Expected batch_generate_docstring_func to be callable"
+
+    self._generate_docstring_func = generate_docstring_func
+    self._batch_generate_docstring_func = batch_generate_docstring_func
+    self._max_threads = max_threads
+    self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+  def __getstate__(self) -> dict:
+    # Thread pools never cross a process boundary
+    return {**self.__dict__, "_executor": None}
+
+
+  async def _call(self, func: Callable[..., Any], **kwargs) -> Any:
+    if inspect.iscoroutinefunction(func):
+      return await func(**kwargs)
+
+    # Blocking functions each occupy a thread for as long as their request is in flight
+    if self._executor is None:
+      self._executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=self._max_threads,
+        thread_name_prefix="ai_docs_engine_request",
+      )
+    return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, **kwargs))
+
+
+  async def generate(
+    self,
+    language: str,
+    definition: str,
+    definition_type: str,
+    temperature: float,
+  ) -> FunctionDocstringData | ClassDocstringData:
+    return await self._call(
+      self._generate_docstring_func,
+      language=language,
+      definition=definition,
+      definition_type=definition_type,
+      temperature=temperature,
+    )
+
+
+  async def generate_many(
+    self,
+    language: str,
+    definitions: Dict[str, Tuple[str, str]],
+    temperature: float,
+  ) -> Dict[str, FunctionDocstringData | ClassDocstringData]:
+    return await self._call(
+      self._batch_generate_docstring_func,
+      language=language,
+      definitions=definitions,
+      temperature=temperature,
+    )
+
+
+  @property
+  def supports_batching(self) -> bool:
+    return self._batch_generate_docstring_func is not None
+
+
+  def _get_bulk_format_func(self, name: str) -> Callable[..., Any]:
+    func = getattr(self._generate_docstring_func, name, None)
+    if func is None:
+      raise AIDocsEngineError("Docstring generation function does not support bulk runs (see `with_bulk_format`)")
+    return func
+
+
+  def render_request(
+    self,
+    language: str,
+    definition: str,
+    definition_type: str,
+    temperature: float,
+  ) -> dict:
+    return self._get_bulk_format_func("render_request")(
+      language=language,
+      definition=definition,
+      definition_type=definition_type,
+      temperature=temperature,
+    )
+
+
+  def parse_response(
+    self,
+    response: dict,
+    language: str,
+    definition: str,
+    definition_type: str,
+  ) -> FunctionDocstringData | ClassDocstringData:
+    return self._get_bulk_format_func("parse_response")(
+      response=response,
+      language=language,
+      definition=definition,
+      definition_type=definition_type,
+    )
+
+
+  def cache_fingerprint(self) -> str:
+    # Batched responses are cached per definition too, so the batched function must be part of the fingerprint
+    fingerprint = get_cache_fingerprint(self._generate_docstring_func)
+    if self._batch_generate_docstring_func is not None:
+      fingerprint += "+" + get_cache_fingerprint(self._batch_generate_docstring_func)
+    return fingerprint
+
+
+  async def aclose(self) -> None:
+    if self._executor is not None:
+      self._executor.shutdown(wait=True)
+      self._executor = None
@@ -0,0 +1,126 @@
+##
+## Offline bulk runs: instead of calling the backend, every pending request is exported as a JSONL line, to be
+## run later by a provider's batch endpoint or any other offline runner. Its results are then imported by a
+## second run over the same tree, which validates them, fills the cache and applies the docstrings.
+##
+## Each line is keyed by a `custom_id`, which is the request's cache key, so that it is stable across runs and
+## identical definitions share a single line. Result lines are either in the output format of OpenAI's batch API,
+## i.e. `{"custom_id": ..., "response": {"status_code": ..., "body": ...}}`, or hold the structured docstring
+## data directly, i.e. `{"custom_id": ..., "docstring": {...}}`.
+##
+
+from typing import Dict
+import threading
+import json
+
+from ai_docs_engine.docstring_schema import ClassDocstringData, FunctionDocstringData
+from ai_docs_engine.docstring_request import DocstringRequest
+from ai_docs_engine.backend import BaseDocstringBackend
+from ai_docs_engine.errors import AIDocsEngineError
+from ai_docs_engine.logger import logger
+
+
+class BulkRequestWriter:
+  """Writes rendered requests to a JSONL file, once per `custom_id`."""
+
+  def __init__(
+    self,
+    path: str,
+    backend: BaseDocstringBackend,
+    temperature: float,
+  ) -> None:
+    assert isinstance(path, str), "Expected path to be a string"
+
+    self._path = path
+    self._backend = backend
+    self._temperature = temperature
+    self._lock = threading.Lock()
+    self._custom_ids = set()
+    self._file = open(path, "w")
+
+
+  @property
+  def count(self) -> int:
+    return len(self._custom_ids)
+
+
+  def write(
+    self,
+    request: DocstringRequest,
+    custom_id: str,
+  ) -> None:
+    with self._lock:
+      if custom_id in self._custom_ids:
+        return
+      self._custom_ids.add(custom_id)
+
+    rendered_request = self._backend.render_request(
+      language=request.language,
+      definition=request.definition,
+      definition_type=request.definition_type,
+      temperature=self._temperature,
+    )
+    line = json.dumps({"custom_id": custom_id, **rendered_request})
+
+    with self._lock:
+      self._file.write(line + "\n")
+
+
+  def close(self) -> None:
+    self._file.close()
+    logger.info(f"Exported {self.count} requests to `{self._path}`")
+
+
+class BulkResults:
+  """Results of an offline bulk run, read from a JSONL file."""
+
+  def __init__(
+    self,
+    path: str,
+    backend: BaseDocstringBackend,
+  ) -> None:
+    assert isinstance(path, str), "Expected path to be a string"
+
+    self._backend = backend
+    self._results: Dict[str, dict] = {}
+
+    with open(path) as file:
+      for (line_number, line) in enumerate(file, start=1):
+        if not line.strip():
+          continue
+
+        # Skip malformed lines, so that one bad line doesn't throw away the whole run
+        try:
+          result = json.loads(line)
+          self._results[result["custom_id"]] = result
+        except (ValueError, TypeError, KeyError) as exception:
+          logger.warning(f"Skipping malformed line {line_number} of `{path}` ({exception = })")
+
+    logger.info(f"Loaded {len(self._results)} results from `{path}`")
+
+
+  def get(
+    self,
+    request: DocstringRequest,
+    custom_id: str,
+  ) -> FunctionDocstringData | ClassDocstringData:
+    result = self._results.get(custom_id)
+    if result is None:
+      raise AIDocsEngineError(f"No result for request `{custom_id}`")
+
+    # Structured docstring data is validated directly
+    if "docstring" in result:
+      response_type = FunctionDocstringData if request.definition_type == "function" else ClassDocstringData
+      return response_type.parse_obj(result["docstring"])
+
+    # Responses are validated by the backend which rendered the request
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code", 200) != 200 or "body" not in response:
+      raise AIDocsEngineError(f"Request `{custom_id}` failed: {result.get('error') or response}")
+
+    return self._backend.parse_response(
+      response=response["body"],
+      language=request.language,
+      definition=request.definition,
+      definition_type=request.definition_type,
+    )
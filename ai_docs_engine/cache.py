@@ -0,0 +1,165 @@
+from typing import Any, Callable, Dict, Optional
+import diskcache
+import hashlib
+import json
+
+from ai_docs_engine.docstring_schema import ClassDocstringData, FunctionDocstringData
+from ai_docs_engine.docstring_request import DocstringRequest
+from ai_docs_engine.remote_cache import BaseRemoteCache, RemoteCacheTier
+from ai_docs_engine.metrics import metrics
+
+
+# Bump this whenever the layout of cached values changes
+CACHE_FORMAT_VERSION = 1
+
+
+def hash_text(text: str) -> str:
+  return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def normalize_definition(definition: str) -> str:
+  assert isinstance(definition, str), "Expected definition to be a string"
+
+  # Collapse all runs of whitespace so that re-indented or re-formatted copies share a key
+  return " ".join(definition.split())
+
+
+def with_cache_fingerprint(fingerprint: Callable[[], str]):
+  """
+  Attaches a fingerprint to a `GenerateDocstringFunc`, which should change
+  whenever anything that affects its output changes (e.g. prompts, agent
+  function schemas or models), so that stale cache entries are not reused.
+  """
+  def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+    func.cache_fingerprint = fingerprint
+    return func
+  return decorator
+
+
+def get_cache_fingerprint(func: Callable[..., Any]) -> str:
+  fingerprint = getattr(func, "cache_fingerprint", None)
+  if fingerprint is not None:
+    return fingerprint()
+
+  # Fall back to the identity of the function for backends without a fingerprint
+  return f"{getattr(func, '__module__', '')}.{getattr(func, '__qualname__', type(func).__qualname__)}"
+
+
+class DocstringCache:
+  """
+  Content-addressed cache of generated docstring data, stored in a
+  size-capped `diskcache` database with least-recently-used eviction. Safe to
+  share between threads and processes.
+
+  With a `remote_cache`, `get_many` reads through to it for keys which are
+  missing locally, and `set` writes to it in the background as well.
+  """
+
+  def __init__(
+    self,
+    directory: str,
+    size_limit: int,
+    remote_cache: Optional[BaseRemoteCache] = None,
+  ) -> None:
+    assert isinstance(directory, str), "Expected directory to be a string"
+    assert isinstance(size_limit, int), "Expected size_limit to be an integer"
+
+    self._cache = diskcache.Cache(
+      directory,
+      size_limit=size_limit,
+      eviction_policy="least-recently-used",
+    )
+    self._remote = RemoteCacheTier(remote_cache) if remote_cache is not None else None
+
+
+  def close(self) -> None:
+    if self._remote is not None:
+      self._remote.close()
+    self._cache.close()
+
+
+  @staticmethod
+  def make_key(
+    request: DocstringRequest,
+    temperature: float,
+    fingerprint: str,
+  ) -> str:
+    key_parts = {
+      "version":         CACHE_FORMAT_VERSION,
+      "definition":      hash_text(normalize_definition(request.definition)),
+      "definition_type": request.definition_type,
+      "language":        request.language,
+      "temperature":     temperature,
+      "fingerprint":     hash_text(fingerprint),
+    }
+    return hash_text(json.dumps(key_parts, sort_keys=True))
+
+
+  @staticmethod
+  def _parse(
+    value: str,
+    definition_type: str,
+  ) -> Optional[FunctionDocstringData | ClassDocstringData]:
+    # Rebuild structured docstring data from the cached JSON value
+    response_type = FunctionDocstringData if definition_type == "function" else ClassDocstringData
+    try:
+      return response_type.parse_raw(value)
+    except Exception:
+      # Treat corrupt or outdated entries as misses
+      return None
+
+
+  def get(
+    self,
+    key: str,
+    definition_type: str,
+  ) -> Optional[FunctionDocstringData | ClassDocstringData]:
+    # Only looks at the local cache, see `get_many`
+    value = self._cache.get(key)
+    if value is None:
+      return None
+    return self._parse(value, definition_type)
+
+
+  def get_many(
+    self,
+    definition_types: Dict[str, str],
+  ) -> Dict[str, FunctionDocstringData | ClassDocstringData]:
+    """
+    Looks up several keys at once, given as their definition types keyed by
+    cache key, and returns the docstring data of those which are present.
+    Keys which are missing locally are looked up in the remote cache (if
+    any) in one batch, and stored locally when found.
+    """
+    results = {}
+    missing_keys = []
+    for (key, definition_type) in definition_types.items():
+      docstring_data = self.get(key, definition_type)
+      if docstring_data is not None:
+        results[key] = docstring_data
+      else:
+        missing_keys.append(key)
+
+    if self._remote is None or not missing_keys:
+      return results
+
+    # Read through to the remote cache, ignoring anything it returns which was not asked for or is not valid
+    for (key, value) in self._remote.get_many(missing_keys).items():
+      docstring_data = self._parse(value, definition_types[key]) if key in definition_types else None
+      if docstring_data is not None:
+        self._cache.set(key, value)
+        results[key] = docstring_data
+        metrics.increment("remote_cache_hits")
+
+    return results
+
+
+  def set(
+    self,
+    key: str,
+    docstring_data: FunctionDocstringData | ClassDocstringData,
+  ) -> None:
+    value = docstring_data.json()
+    self._cache.set(key, value)
+    if self._remote is not None:
+      self._remote.set(key, value)
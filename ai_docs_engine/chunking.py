@@ -0,0 +1,107 @@
+##
+## Map-reduce for functions too large for any model's context window: the body is split into token-bounded chunks at
+## statement boundaries, each chunk is summarized on its own (map), then the docstring is generated from the signature
+## and the chunk summaries (reduce).
+##
+
+from typing import List, Optional
+import ast
+
+from ai_docs_engine.prescan import parse_code
+from ai_docs_engine.tokens import count_tokens
+
+
+# Stands in for the rest of the body in the definition a chunk is summarized as part of
+OMITTED_LINES_COMMENT = "# ... (part {part} of {num_parts}, other parts omitted)"
+
+
+class FunctionChunks:
+  """Header (i.e. decorators and signature) of a function, and its body split into chunks."""
+
+  def __init__(
+    self,
+    header: str,
+    indent: str,
+    chunks: List[str],
+  ) -> None:
+    self.header = header
+    self.indent = indent
+    self.chunks = chunks
+
+
+  def get_chunk_definition(self, part: int) -> str:
+    # Each chunk is presented as a part of the function, so that the model knows what it is looking at
+    comment = OMITTED_LINES_COMMENT.format(part=part + 1, num_parts=len(self.chunks))
+    return "\n".join([self.header, self.indent + comment, self.chunks[part]])
+
+
+  def get_reduced_definition(self, summaries: List[str]) -> str:
+    # The body is replaced by one comment per chunk, in order, so that it reads like an outline of the function
+    assert len(summaries) == len(self.chunks), "Expected one summary per chunk"
+
+    lines = [self.header]
+    for (part, summary) in enumerate(summaries):
+      summary = " ".join(summary.split())
+      lines.append(f"{self.indent}# Part {part + 1} of {len(summaries)}: {summary}")
+    lines.append(f"{self.indent}...")
+    return "\n".join(lines)
+
+
+def _get_cut_lines(node: ast.FunctionDef | ast.AsyncFunctionDef) -> set:
+  # The body may be cut before any statement at any depth, except the first of a block, which would leave its header dangling
+  return {
+    statement.lineno
+    for child in ast.walk(node)
+    for field in ("body", "orelse", "finalbody")
+    for statement in (getattr(child, field, None) or [None])[1:]
+    if isinstance(statement, ast.stmt)
+  }
+
+
+def split_function(
+  definition: str,
+  max_chunk_tokens: int,
+) -> Optional[FunctionChunks]:
+  """
+  Splits the body of a function definition into chunks of at most
+  `max_chunk_tokens` tokens, cutting between statements at whatever depth
+  fills each chunk the most. Only statements which are larger than a whole
+  chunk on their own are cut in the middle, between lines.
+
+  Returns `None` if the definition is not a function that can be split,
+  e.g. because it could not be parsed or its body is on the same line as
+  its signature.
+  """
+  assert isinstance(definition, str), "Expected definition to be a string"
+  assert max_chunk_tokens > 0, "Expected max_chunk_tokens to be positive"
+
+  tree = parse_code(definition)
+  if tree is None or len(tree.body) != 1 or not isinstance(tree.body[0], (ast.FunctionDef, ast.AsyncFunctionDef)):
+    return None
+  node = tree.body[0]
+
+  # The header ends where the body starts, which must be an indented block
+  lines = definition.split("\n")
+  body_start = node.body[0].lineno - 1
+  if lines[body_start][:node.body[0].col_offset].strip():
+    return None
+  header = "\n".join(lines[:body_start])
+  body_lines = lines[body_start:node.end_lineno]
+  indent = body_lines[0][:len(body_lines[0]) - len(body_lines[0].lstrip())]
+
+  # Greedily fill chunks line by line, cutting before the last statement which started in the current chunk once full
+  cut_lines = {lineno - 1 - body_start for lineno in _get_cut_lines(node)}
+  line_tokens = [count_tokens(line) + 1 for line in body_lines]
+  chunks = []
+  (chunk_start, chunk_tokens, last_cut) = (0, 0, None)
+  for (index, tokens) in enumerate(line_tokens):
+    if index in cut_lines and index > chunk_start:
+      last_cut = index
+    if chunk_tokens + tokens > max_chunk_tokens and index > chunk_start:
+      cut = last_cut if last_cut is not None else index
+      chunks.append("\n".join(body_lines[chunk_start:cut]))
+      (chunk_start, chunk_tokens, last_cut) = (cut, sum(line_tokens[cut:index]), None)
+    chunk_tokens += tokens
+  chunks.append("\n".join(body_lines[chunk_start:]))
+
+  return FunctionChunks(header=header, indent=indent, chunks=chunks)
@@ -0,0 +1,227 @@
+from typing import Callable, Dict, List, Optional, Sequence
+from typing_extensions import override
+import libcst
+import re
+
+
+# Class attribute values longer than this are elided from class skeletons
+MAX_ATTRIBUTE_VALUE_LENGTH = 80
+
+# Stands in for the summary of a nested definition whose docstring is still being generated, see `fill_summary_placeholders`
+SUMMARY_PLACEHOLDER = "{{{{summary:{definition_id}}}}}"
+SUMMARY_PLACEHOLDER_PATTERN = re.compile(r'^([ \t]*)"""\{\{summary:([^}]+)\}\}"""[ \t]*(?:\n|$)', re.MULTILINE)
+
+
+def _ellipsis_line() -> libcst.SimpleStatementLine:
+  return libcst.SimpleStatementLine(body=[libcst.Expr(value=libcst.Ellipsis())])
+
+
+def _escape_summary(summary: str) -> str:
+  # Escape the summary so it can be embedded in a triple-quoted string
+  return summary.replace("\\", "\\\\").replace('"""', '\\"\\"\\"')
+
+
+def _docstring_line(summary: str) -> libcst.SimpleStatementLine:
+  return libcst.SimpleStatementLine(body=[libcst.Expr(value=libcst.SimpleString(value=f'"""{_escape_summary(summary)}"""'))])
+
+
+def summarize_docstring(docstring: Optional[str]) -> Optional[str]:
+  # Use the first non-empty line of the docstring as its summary
+  if not docstring or not docstring.strip():
+    return None
+  return docstring.strip().splitlines()[0].strip()
+
+
+def get_docstring_summary(node: libcst.FunctionDef | libcst.ClassDef) -> Optional[str]:
+  assert isinstance(node, (libcst.FunctionDef | libcst.ClassDef)), "Expected node to be a function or a class definition"
+
+  return summarize_docstring(node.get_docstring())
+
+
+def _strip_docstring(body: Sequence[libcst.BaseStatement]) -> list:
+  body = list(body)
+  if body and isinstance(body[0], libcst.SimpleStatementLine) and body[0].body \
+    and isinstance(body[0].body[0], libcst.Expr) and isinstance(body[0].body[0].value, libcst.SimpleString):
+    body = body[1:]
+  return body or [_ellipsis_line()]
+
+
+class _CommentStripper(libcst.CSTTransformer):
+  """Removes all comments and empty lines."""
+
+  @override
+  def leave_EmptyLine(
+    self,
+    original_node: libcst.EmptyLine,
+    updated_node: libcst.EmptyLine,
+  ) -> libcst.EmptyLine | libcst.RemovalSentinel:
+    return libcst.RemoveFromParent()
+
+
+  @override
+  def leave_TrailingWhitespace(
+    self,
+    original_node: libcst.TrailingWhitespace,
+    updated_node: libcst.TrailingWhitespace,
+  ) -> libcst.TrailingWhitespace:
+    return updated_node.with_changes(comment=None, whitespace=libcst.SimpleWhitespace(""))
+
+
+class _FunctionCompactor(_CommentStripper):
+  """
+  Removes comments and nested docstrings from a function definition, and
+  elides the bodies of blocks nested deeper than `max_depth`.
+  """
+
+  def __init__(self, root: libcst.FunctionDef, max_depth: int) -> None:
+    super().__init__()
+    self._root = root
+    self._max_depth = max_depth
+    self._depth = 0
+
+
+  @override
+  def visit_IndentedBlock(self, node: libcst.IndentedBlock) -> bool:
+    self._depth += 1
+
+    # Don't bother visiting the contents of blocks which are going to be elided anyway
+    return self._depth <= self._max_depth
+
+
+  @override
+  def leave_IndentedBlock(
+    self,
+    original_node: libcst.IndentedBlock,
+    updated_node: libcst.IndentedBlock,
+  ) -> libcst.IndentedBlock:
+    self._depth -= 1
+
+    if self._depth >= self._max_depth:
+      return updated_node.with_changes(body=[_ellipsis_line()])
+    return updated_node
+
+
+  @override
+  def leave_FunctionDef(
+    self,
+    original_node: libcst.FunctionDef,
+    updated_node: libcst.FunctionDef,
+  ) -> libcst.FunctionDef:
+    return self._leave_nested_def(original_node, updated_node)
+
+
+  @override
+  def leave_ClassDef(
+    self,
+    original_node: libcst.ClassDef,
+    updated_node: libcst.ClassDef,
+  ) -> libcst.ClassDef:
+    return self._leave_nested_def(original_node, updated_node)
+
+
+  def _leave_nested_def(
+    self,
+    original_node: libcst.FunctionDef | libcst.ClassDef,
+    updated_node: libcst.FunctionDef | libcst.ClassDef,
+  ) -> libcst.FunctionDef | libcst.ClassDef:
+    # Keep the docstring of the definition being documented, but drop those of nested definitions
+    if original_node is self._root or not isinstance(updated_node.body, libcst.IndentedBlock):
+      return updated_node
+    return updated_node.with_changes(body=updated_node.body.with_changes(body=_strip_docstring(updated_node.body.body)))
+
+
+def compact_function(
+  node: libcst.FunctionDef,
+  max_depth: int,
+) -> libcst.FunctionDef:
+  assert isinstance(node, libcst.FunctionDef), "Expected node to be a function definition"
+  assert max_depth > 0, "Expected max_depth to be positive"
+
+  return node.visit(_FunctionCompactor(root=node, max_depth=max_depth))
+
+
+def _compact_function_signature(
+  node: libcst.FunctionDef,
+  summary: Optional[str],
+) -> libcst.FunctionDef:
+  # Keep decorators and signature, replacing the body with its summary (if any) and an ellipsis
+  body = [_docstring_line(summary)] if summary else []
+  return node.with_changes(
+    body=libcst.IndentedBlock(body=[*body, _ellipsis_line()]),
+  )
+
+
+def _compact_class_statement(
+  statement: libcst.BaseStatement,
+  get_summary: Callable[[libcst.FunctionDef | libcst.ClassDef], Optional[str]],
+) -> Optional[libcst.BaseStatement]:
+  # Keep methods and nested classes, reduced to their interface
+  if isinstance(statement, libcst.FunctionDef):
+    return _compact_function_signature(statement, get_summary(statement))
+  if isinstance(statement, libcst.ClassDef):
+    return compact_class(statement, get_summary(statement), get_summary=get_summary)
+
+  # Keep attribute declarations, eliding long values
+  if isinstance(statement, libcst.SimpleStatementLine):
+    attributes = []
+    for small_statement in statement.body:
+      if isinstance(small_statement, (libcst.Assign, libcst.AnnAssign)):
+        value = small_statement.value
+        if value is not None and len(libcst.Module(body=[]).code_for_node(value)) > MAX_ATTRIBUTE_VALUE_LENGTH:
+          small_statement = small_statement.with_changes(value=libcst.Ellipsis())
+        attributes.append(small_statement)
+    if attributes:
+      return statement.with_changes(body=attributes)
+
+  # Drop everything else, e.g. statements inside conditional blocks in the class body
+  return None
+
+
+def compact_class(
+  node: libcst.ClassDef,
+  summary: Optional[str] = None,
+  get_summary: Callable[[libcst.FunctionDef | libcst.ClassDef], Optional[str]] = get_docstring_summary,
+) -> libcst.ClassDef:
+  """
+  Reduces a class definition to a skeleton of its bases, attributes and
+  method signatures (with the one-line summaries returned by `get_summary`,
+  by default the first line of their docstrings), so that the size of its
+  prompt scales with its interface instead of its implementation.
+  """
+  assert isinstance(node, libcst.ClassDef), "Expected node to be a class definition"
+
+  # Build skeleton of class body
+  body = [] if not summary else [_docstring_line(summary)]
+  if isinstance(node.body, libcst.IndentedBlock):
+    for statement in _strip_docstring(node.body.body):
+      compacted_statement = _compact_class_statement(statement, get_summary)
+      if compacted_statement is not None:
+        body.append(compacted_statement)
+
+  skeleton = node.with_changes(
+    body=libcst.IndentedBlock(body=body or [_ellipsis_line()]),
+  )
+  return skeleton.visit(_CommentStripper())
+
+
+def find_summary_placeholders(definition: str) -> List[str]:
+  return [match.group(2) for match in SUMMARY_PLACEHOLDER_PATTERN.finditer(definition)]
+
+
+def fill_summary_placeholders(
+  definition: str,
+  summaries: Dict[str, Optional[str]],
+) -> str:
+  """
+  Replaces the placeholders left in a compacted definition by
+  `SUMMARY_PLACEHOLDER` with the summaries of the nested definitions they
+  stand for, dropping those without one (e.g. because generating their
+  docstring failed).
+  """
+  def replace(match: re.Match) -> str:
+    summary = summaries.get(match.group(2))
+    if not summary:
+      return ""
+    return f'{match.group(1)}"""{_escape_summary(summary)}"""\n'
+
+  return SUMMARY_PLACEHOLDER_PATTERN.sub(replace, definition)
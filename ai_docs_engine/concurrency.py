@@ -0,0 +1,164 @@
+from typing import Dict, Optional
+import asyncio
+import math
+import time
+
+from ai_docs_engine.metrics import metrics
+from ai_docs_engine.logger import logger
+
+
+# Smoothing factors of the short-term and long-term moving averages of latency
+SHORT_TERM_LATENCY_WEIGHT = 0.1
+LONG_TERM_LATENCY_WEIGHT = 0.01
+
+# Outcomes of a request, as far as the concurrency controller is concerned
+OUTCOME_SUCCESS = "success"
+OUTCOME_OVERLOAD = "overload"
+OUTCOME_ERROR = "error"
+
+# Reasons for changing the limit, as recorded in the `concurrency_decisions` counter
+REASON_SLOW_START = "slow_start"
+REASON_HEALTHY_LATENCY = "healthy_latency"
+REASON_OVERLOAD = "overload"
+
+
+class ConcurrencyController:
+  """
+  Additive-increase/multiplicative-decrease (AIMD) limit on the number of
+  requests in flight, in the spirit of TCP congestion control. Until the
+  provider first signals overload (i.e. rate limits or timeouts), the limit
+  grows by one request per success ("slow start"), and after that by about
+  one request per round trip. It only grows while recent latency stays
+  within `latency_tolerance` times the long-term average, and is multiplied
+  by `decrease_factor` on overload. With `adaptive=False`, the limit stays
+  at `max_limit`.
+
+  Only ever used from the scheduler's event loop.
+  """
+
+  def __init__(
+    self,
+    initial_limit: int,
+    min_limit: int,
+    max_limit: int,
+    adaptive: bool = True,
+    decrease_factor: float = 0.5,
+    latency_tolerance: float = 2.0,
+  ) -> None:
+    assert 0 < min_limit <= max_limit, "Expected 0 < min_limit <= max_limit"
+    assert 0 < decrease_factor < 1, "Expected decrease_factor to be between 0 and 1"
+    assert latency_tolerance >= 1, "Expected latency_tolerance to be at least 1"
+
+    self._adaptive = adaptive
+    self._min_limit = min_limit
+    self._max_limit = max_limit
+    self._limit = float(min(max(initial_limit, min_limit), max_limit) if adaptive else max_limit)
+    self._decrease_factor = decrease_factor
+    self._latency_tolerance = latency_tolerance
+
+    self._in_flight = 0
+    self._condition = asyncio.Condition()
+    self._short_term_latency: Optional[float] = None
+    self._long_term_latency: Optional[float] = None
+    self._slow_start = True
+    self._last_decrease = 0.0
+
+    # Decisions made so far, for logging and metrics
+    self._increases = 0
+    self._decreases = 0
+    self._peak_limit = int(self._limit)
+    self._record_limit()
+
+
+  def _record_limit(self) -> None:
+    metrics.set_gauge("concurrency_limit", self.limit, kind="current")
+    metrics.set_gauge("concurrency_limit", self._peak_limit, kind="peak")
+
+
+  @property
+  def limit(self) -> int:
+    return int(self._limit)
+
+
+  @property
+  def in_flight(self) -> int:
+    return self._in_flight
+
+
+  def snapshot(self) -> Dict[str, float]:
+    return {
+      "limit":       self.limit,
+      "in_flight":   self._in_flight,
+      "peak_limit":  self._peak_limit,
+      "increases":   self._increases,
+      "decreases":   self._decreases,
+      "latency":     self._short_term_latency or 0.0,
+    }
+
+
+  async def acquire(self) -> float:
+    """Waits for a free slot under the current limit, and returns the time the request started."""
+    async with self._condition:
+      await self._condition.wait_for(lambda: self._in_flight < self.limit)
+      self._in_flight += 1
+    return time.monotonic()
+
+
+  async def release(
+    self,
+    started_at: float,
+    outcome: str,
+  ) -> None:
+    """Frees the slot of a request, adjusting the limit based on how the request went."""
+    async with self._condition:
+      # Only grow the limit if it was actually what held requests back
+      was_saturated = self._in_flight >= self.limit
+      self._in_flight -= 1
+
+      if self._adaptive:
+        latency = time.monotonic() - started_at
+        if outcome == OUTCOME_OVERLOAD:
+          self._decrease(started_at)
+        elif outcome == OUTCOME_SUCCESS:
+          self._record_latency(latency)
+          if was_saturated and self._short_term_latency <= self._long_term_latency * self._latency_tolerance:
+            self._increase()
+
+      self._condition.notify_all()
+
+
+  def _record_latency(self, latency: float) -> None:
+    # Compare recent latency against the long-term average, as single samples are too noisy to go by
+    if self._short_term_latency is None:
+      (self._short_term_latency, self._long_term_latency) = (latency, latency)
+      return
+    self._short_term_latency += SHORT_TERM_LATENCY_WEIGHT * (latency - self._short_term_latency)
+    self._long_term_latency += LONG_TERM_LATENCY_WEIGHT * (latency - self._long_term_latency)
+
+
+  def _increase(self) -> None:
+    # In slow start the limit doubles every round trip, while growing by `1 / limit` adds about one slot per round trip
+    previous_limit = self.limit
+    reason = REASON_SLOW_START if self._slow_start else REASON_HEALTHY_LATENCY
+    self._limit = min(self._max_limit, self._limit + (1 if self._slow_start else 1 / self._limit))
+    if self.limit > previous_limit:
+      self._increases += 1
+      self._peak_limit = max(self._peak_limit, self.limit)
+      self._record_limit()
+      metrics.increment("concurrency_decisions", decision="increase", reason=reason)
+      logger.debug(f"Raised request concurrency limit from {previous_limit} to {self.limit} ({reason})")
+
+
+  def _decrease(self, started_at: float) -> None:
+    # Requests which were already in flight when the limit was last cut saw the old limit, so they don't count again
+    if started_at < self._last_decrease:
+      return
+
+    previous_limit = self.limit
+    self._limit = max(self._min_limit, math.floor(self._limit * self._decrease_factor))
+    self._slow_start = False
+    self._last_decrease = time.monotonic()
+    self._decreases += 1
+    self._record_limit()
+    metrics.increment("concurrency_decisions", decision="decrease", reason=REASON_OVERLOAD)
+    logger.info(f"Provider is overloaded, cut request concurrency limit from {previous_limit} to {self.limit}")
@@ -1,9 +1,12 @@
-from typing import Callable, List
-from pydantic import Field, validator
+from typing import Callable, Dict, List, Optional, Tuple
+from pydantic import Field, root_validator, validator
 
-from ai_docs_engine.utilities import ConstBaseModel
+from ai_docs_engine.utilities import ConstBaseModel, get_default_cache_dir
 from ai_docs_engine.docstring_schema import ClassDocstringData, FunctionDocstringData
 from ai_docs_engine.docstring_builders import BaseDocstringBuilder, GoogleDocstringBuilder
+from ai_docs_engine.remote_cache import BaseRemoteCache
+from ai_docs_engine.watch import WATCH_METHODS
+from ai_docs_engine.backend import BaseDocstringBackend, CallableDocstringBackend
 
 
 GenerateDocstringFunc = Callable[
@@ -17,20 +20,76 @@ GenerateDocstringFunc = Callable[
 ]
 
 
+BatchGenerateDocstringFunc = Callable[
+  [
+    str,                        # language
+    Dict[str, Tuple[str, str]], # definitions, i.e. (definition, definition_type) keyed by definition ID
+    float,                      # temperature
+  ],
+  Dict[str, FunctionDocstringData | ClassDocstringData], # docstring data keyed by definition ID
+]
+
+
+def _get_default_triage_policy() -> Dict[str, str]:
+  # `local_docstrings` is only imported when needed, as it depends on libcst which is slow to import
+  from ai_docs_engine.local_docstrings import DEFAULT_TRIAGE_POLICY
+  return dict(DEFAULT_TRIAGE_POLICY)
+
+
 class AIDocsEngineConfig(ConstBaseModel):
   """Configuration for Pydantic BaseModel"""
   class Config:
     arbitrary_types_allowed = True
 
   """Configuration for AI Docs Engine"""
-  include_rules:           List[str] = Field(description="List of glob rules to include files")
-  exclude_rules:           List[str] = Field(description="List of glob rules to exclude files")
+  include_rules:           List[str] = Field(description="List of glob rules to include files; supports `**` and gitignore-style rules (see `ai_docs_engine.discovery`)")
+  exclude_rules:           List[str] = Field(description="List of glob rules to exclude files; supports `**` and gitignore-style rules (see `ai_docs_engine.discovery`)")
   inplace:                 bool      = Field(description="Whether to modify files in-place or not", default=False)
+  dry_run:                 bool      = Field(description="Whether to output a unified diff of the changes instead of writing them", default=False)
+  diff_path:               Optional[str] = Field(description="Path of the file to write the unified diff of a dry run to, or `None` for stdout", default=None)
   max_workers:             int       = Field(description="Number of workers to use for parallelization", default=16)
+  execution_mode:          str       = Field(description="Where to parse and transform files: 'thread' for worker threads, or 'process' for a pool of worker processes (requires a picklable config and an `if __name__ == '__main__'` guard)", default="thread")
+  max_processes:           Optional[int] = Field(description="Number of worker processes in 'process' mode, or `None` to use one per CPU", default=None)
+  max_files_in_flight:     int       = Field(description="Maximum number of source files being processed or waiting to be, so that memory use stays flat however many files there are", default=64)
+  max_bytes_in_flight:     int       = Field(description="Maximum total size in bytes of the source files being processed or waiting to be; a larger file is still processed once nothing else is in flight", default=64 * 2**20)
+  max_requests_in_flight:  int       = Field(description="Maximum number of docstring generation requests to run concurrently across all files", default=32)
+  adaptive_concurrency:    bool      = Field(description="Whether to adapt the number of requests in flight to how the provider responds, growing it while latency is healthy and cutting it on rate limits or timeouts; `max_requests_in_flight` is the ceiling", default=True)
+  initial_requests_in_flight: int    = Field(description="Number of requests allowed in flight at the start of a run, when `adaptive_concurrency` is enabled", default=4)
+  schedule_largest_first:  bool      = Field(description="Whether to start the files and requests estimated to be the most work first, so that they don't end up as a long tail of the run; files are pre-scanned and ordered one window of `max_files_in_flight` files at a time", default=True)
+  max_queued_requests:     int       = Field(description="Maximum number of docstring generation requests waiting to be scheduled", default=256)
+  requests_per_minute:     int       = Field(description="Maximum number of docstring generation requests to send per minute", default=3_500)
+  tokens_per_minute:       int       = Field(description="Maximum number of estimated tokens to send per minute", default=90_000)
+  max_retries:             int       = Field(description="Maximum number of times to retry a request after a transient failure", default=6)
+  retry_base_delay:        float     = Field(description="Base delay in seconds for exponential backoff between retries", default=1.0)
+  retry_max_delay:         float     = Field(description="Maximum delay in seconds between retries", default=60.0)
   quote_style:             str       = Field(description="Preferred docstring quote style", default='"""')
   temperature:             float     = Field(description="Temperature to use for OpenAI API", default=0.25)
   skip_init_methods:       bool      = Field(description="Whether to skip __init__ methods or not", default=True)
-  generate_docstring_func: GenerateDocstringFunc = Field(description="Function to generate docstrings")
+  triage_policy:           Dict[str, str] = Field(description="What to do with each kind of trivial definition (see `ai_docs_engine.local_docstrings.TRIVIAL_KINDS`): 'local' to build its docstring from its signature without a request, 'skip' to leave it undocumented, or 'llm' to send it to the model like any other; kinds which are left out are sent to the model", default_factory=_get_default_triage_policy)
+  compact_prompts:         bool      = Field(description="Whether to reduce classes to skeletons and compact large functions before sending them to the model", default=True)
+  hierarchical_summaries:  bool      = Field(description="Whether to document nested definitions bottom-up, so that the prompt of a class gets the one-line summaries of its freshly documented methods and nested classes along with their signatures; classes then wait for their members to be documented first", default=False)
+  compaction_min_function_lines: int = Field(description="Minimum number of lines for a function to be compacted", default=40)
+  compaction_max_depth:    int       = Field(description="Maximum block nesting depth kept in compacted functions; deeper blocks are elided", default=2)
+  chunk_oversized_functions: bool    = Field(description="Whether to document functions too large for any model by summarizing their bodies in chunks concurrently, then generating the docstring from their signature and the chunk summaries (see `ai_docs_engine.chunking`)", default=True)
+  chunk_max_tokens:        int       = Field(description="Maximum tokens of the body in each chunk of an oversized function", default=2_000)
+  max_chunks_in_flight:    int       = Field(description="Maximum number of chunks of one oversized function to summarize concurrently", default=8)
+  cache_dir:               Optional[str] = Field(description="Directory to cache generated docstrings in, or `None` to disable caching", default_factory=get_default_cache_dir)
+  cache_size_limit:        int       = Field(description="Maximum size of the docstring cache in bytes; least recently used entries are evicted first", default=2**30)
+  remote_cache:            Optional[BaseRemoteCache] = Field(description="Remote cache shared between machines, e.g. an `HTTPRemoteCache` or `SQLiteRemoteCache` (see `ai_docs_engine.remote_cache`), which lookups read through to and generated docstrings are written behind to; only used along with `cache_dir`", default=None)
+  export_requests_path:    Optional[str] = Field(description="Path of a JSONL file to export every pending docstring request to for an offline bulk run, instead of generating docstrings; no files are modified (see `ai_docs_engine.bulk`)", default=None)
+  import_results_path:     Optional[str] = Field(description="Path of a JSONL file of offline bulk run results to generate docstrings from, instead of calling the backend (see `ai_docs_engine.bulk`)", default=None)
+  manifest_path:           Optional[str] = Field(description="Path of the manifest used to skip files and definitions which are unchanged since the previous run, or `None` to process everything", default=None)
+  watch_method:            str       = Field(description="How `watch_docstrings` watches for changes: 'inotify', 'poll' to poll the source files every `watch_poll_interval` seconds, or 'auto' for inotify where it is available and polling otherwise", default="auto")
+  watch_debounce_seconds:  float     = Field(description="Seconds without further changes to wait for in watch mode before processing the changed files, so that a burst of changes (e.g. saving several files at once) is processed together", default=0.25)
+  watch_poll_interval:     float     = Field(description="Seconds between listings of the source files when polling for changes in watch mode", default=1.0)
+  metrics_path:            Optional[str] = Field(description="Path of a JSON file to dump the metrics of the run to (see `ai_docs_engine.metrics`), or `None` to not dump them", default=None)
+  prometheus_textfile_path: Optional[str] = Field(description="Path of a Prometheus textfile (e.g. for the node exporter's textfile collector) to write the metrics of the run to, or `None` to not write one", default=None)
+  generate_docstring_func: Optional[GenerateDocstringFunc] = Field(description="Function to generate docstrings; may also be a coroutine function", default=None)
+  batch_generate_docstring_func: Optional[BatchGenerateDocstringFunc] = Field(description="Function to generate docstrings for several small definitions of a file in one request, or `None` to send one request per definition; may also be a coroutine function", default=None)
+  backend:                 Optional[BaseDocstringBackend] = Field(description="Asynchronous backend to generate docstrings with, used instead of `generate_docstring_func` and `batch_generate_docstring_func`", default=None)
+  batch_token_budget:      int       = Field(description="Maximum estimated tokens of the definitions grouped into one batched request", default=2_000)
+  batch_max_definitions:   int       = Field(description="Maximum number of definitions grouped into one batched request", default=12)
+  batch_max_definition_tokens: int   = Field(description="Definitions estimated at more tokens than this are always sent in a request of their own", default=400)
   docstring_builder:       BaseDocstringBuilder  = Field(description="Docstring builder to use", default=GoogleDocstringBuilder())
 
 
@@ -45,6 +104,92 @@ class AIDocsEngineConfig(ConstBaseModel):
     return value
 
 
+  @validator("max_workers", "max_files_in_flight", "max_bytes_in_flight", "max_requests_in_flight", "initial_requests_in_flight", "max_queued_requests", "requests_per_minute", "tokens_per_minute", "compaction_max_depth", "chunk_max_tokens", "max_chunks_in_flight", "batch_token_budget", "batch_max_definitions", "batch_max_definition_tokens", "watch_debounce_seconds", "watch_poll_interval")
+  def validate_positive(cls, value: int) -> int:
+    if value <= 0:
+      raise ValueError(f"Expected a positive value, got: {value}")
+    return value
+
+
+  @validator("triage_policy")
+  def validate_triage_policy(cls, value: Dict[str, str]) -> Dict[str, str]:
+    from ai_docs_engine.local_docstrings import TRIAGE_DECISIONS, TRIVIAL_KINDS
+
+    for (kind, decision) in value.items():
+      if kind not in TRIVIAL_KINDS:
+        raise ValueError(
+          f"Invalid kind of trivial definition: {kind}\n"
+          f"Allowed kinds: {', '.join(TRIVIAL_KINDS)}"
+        )
+      if decision not in TRIAGE_DECISIONS:
+        raise ValueError(
+          f"Invalid triage decision for {kind}: {decision}\n"
+          f"Allowed decisions: {', '.join(TRIAGE_DECISIONS)}"
+        )
+    return value
+
+
+  @validator("watch_method")
+  def validate_watch_method(cls, value: str) -> str:
+    if value not in WATCH_METHODS:
+      raise ValueError(
+        f"Invalid watch method: {value}\n"
+        f"Allowed methods: {', '.join(WATCH_METHODS)}"
+      )
+    return value
+
+
+  @validator("execution_mode")
+  def validate_execution_mode(cls, value: str) -> str:
+    allowed_modes = {"thread", "process"}
+    if value not in allowed_modes:
+      raise ValueError(
+        f"Invalid execution mode: {value}\n"
+        f"Allowed modes: {', '.join(allowed_modes)}"
+      )
+    return value
+
+
+  @root_validator(skip_on_failure=True)
+  def validate_backend(cls, values: dict) -> dict:
+    if values.get("generate_docstring_func") is None and values.get("backend") is None:
+      raise ValueError("Expected either `generate_docstring_func` or `backend` to be set")
+    if values.get("export_requests_path") is not None and values.get("import_results_path") is not None:
+      raise ValueError("Expected at most one of `export_requests_path` and `import_results_path` to be set")
+    return values
+
+
+  @validator("backend")
+  def validate_backend_type(cls, value: Optional[BaseDocstringBackend]) -> Optional[BaseDocstringBackend]:
+    if value is not None and not isinstance(value, BaseDocstringBackend):
+      raise ValueError(
+        f"Invalid backend: {value}\n"
+        f"Must be an instance of {BaseDocstringBackend}"
+      )
+    return value
+
+
+  def get_backend(self) -> BaseDocstringBackend:
+    # Docstring generation functions are wrapped, so that everything downstream only deals with backends
+    if self.backend is not None:
+      return self.backend
+    return CallableDocstringBackend(
+      generate_docstring_func=self.generate_docstring_func,
+      batch_generate_docstring_func=self.batch_generate_docstring_func,
+      max_threads=self.max_requests_in_flight,
+    )
+
+
+  @validator("remote_cache")
+  def validate_remote_cache(cls, value: Optional[BaseRemoteCache]) -> Optional[BaseRemoteCache]:
+    if value is not None and not isinstance(value, BaseRemoteCache):
+      raise ValueError(
+        f"Invalid remote cache: {value}\n"
+        f"Must be an instance of {BaseRemoteCache}"
+      )
+    return value
+
+
   @validator("docstring_builder")
   def validate_docstring_builder(cls, value: BaseDocstringBuilder) -> BaseDocstringBuilder:
     if not isinstance(value, BaseDocstringBuilder):
@@ -0,0 +1,323 @@
+##
+## Streaming source file discovery. Include and exclude rules are glob patterns with gitignore-style semantics:
+##   - `*` and `?` match within a single path component, and `**` matches any number of components
+##   - a rule without a slash (e.g. `test_*.py` or `__pycache__`) matches a name at any depth
+##   - a rule ending with a slash (e.g. `build/`) only matches directories
+##   - a rule starting with `!` re-includes paths excluded by an earlier rule; the last matching rule wins
+## Directories are matched while walking, so excluded directories are pruned without descending into them.
+##
+
+from typing import Iterator, List, Optional, Tuple
+from fnmatch import fnmatchcase
+import functools
+import re
+import os
+
+
+GLOB_CHARS = set("*?[")
+
+
+def _has_glob_chars(component: str) -> bool:
+  return any(char in GLOB_CHARS for char in component)
+
+
+def _translate_component(component: str) -> str:
+  # Translate a single path component into a regex; unlike `fnmatch`, `*` and `?` never match a slash
+  regex = ""
+  i = 0
+  while i < len(component):
+    char = component[i]
+    if char == "*":
+      regex += "[^/]*"
+    elif char == "?":
+      regex += "[^/]"
+    elif char == "[" and (end := component.find("]", i + 2 if component[i + 1:i + 2] in ("!", "]") else i + 1)) != -1:
+      char_class = component[i + 1:end].replace("\\", "\\\\")
+      if char_class.startswith("!"):
+        char_class = "^" + char_class[1:]
+      regex += f"[{char_class}]"
+      i = end
+    else:
+      regex += re.escape(char)
+    i += 1
+  return regex
+
+
+class PathPattern:
+  """A single include or exclude rule."""
+
+  def __init__(self, rule: str) -> None:
+    assert isinstance(rule, str), "Expected rule to be a string"
+
+    self.rule = rule
+    self.negated = rule.startswith("!")
+    rule = rule[1:] if self.negated else rule
+
+    self.dir_only = rule.endswith("/")
+    rule = rule.rstrip("/")
+
+    # Rules without a slash match names at any depth, while other rules are anchored to a path
+    self.anchored = "/" in rule
+    self.relative = not os.path.isabs(os.path.expanduser(rule))
+    if self.anchored:
+      rule = os.path.abspath(os.path.expanduser(rule))
+      self.components = rule.strip("/").split("/")
+    else:
+      self.components = [rule]
+
+    self._regex = re.compile(self._translate(self.components) + r"\Z")
+
+
+  @staticmethod
+  def _translate(components: List[str]) -> str:
+    regex = ""
+    for (index, component) in enumerate(components):
+      is_last = index == len(components) - 1
+      if component == "**":
+        regex += ".*" if is_last else "(?:[^/]+/)*"
+      else:
+        regex += _translate_component(component) + ("" if is_last else "/")
+    return regex
+
+
+  @property
+  def root(self) -> Optional[str]:
+    # The longest literal prefix of an anchored rule is the only place it can match anything
+    if not self.anchored:
+      return None
+
+    literal_components = []
+    for component in self.components:
+      if _has_glob_chars(component):
+        break
+      literal_components.append(component)
+    return "/" + "/".join(literal_components)
+
+
+  def matches(self, abs_path: str, name: str, is_dir: bool) -> bool:
+    if self.dir_only and not is_dir:
+      return False
+    if not self.anchored:
+      return self._regex.match(name) is not None
+
+    # Rules like `build/**` match the directory itself too, so that it gets pruned
+    if is_dir and self.components[-1] == "**":
+      abs_path += "/"
+    return self._regex.match(abs_path.lstrip("/")) is not None
+
+
+  def could_match_under(self, abs_dir: str) -> bool:
+    """Whether any path under the directory could match this rule."""
+    if not self.anchored:
+      return True
+
+    return _match_prefix(tuple(self.components), tuple(abs_dir.strip("/").split("/")))
+
+
+@functools.lru_cache(maxsize=4096)
+def _match_prefix(pattern: tuple, path: tuple) -> bool:
+  # Whether `path` matches a strict prefix of `pattern`, i.e. paths under it could still match
+  if not path:
+    return len(pattern) > 0
+  if not pattern:
+    return False
+  if pattern[0] == "**":
+    return _match_prefix(pattern[1:], path) or _match_prefix(pattern, path[1:])
+  return fnmatchcase(path[0], pattern[0]) and _match_prefix(pattern[1:], path[1:])
+
+
+def _is_excluded(
+  exclude_patterns: List[PathPattern],
+  abs_path: str,
+  name: str,
+  is_dir: bool,
+) -> bool:
+  # The last matching rule wins, so that negated rules can re-include paths
+  excluded = False
+  for pattern in exclude_patterns:
+    if pattern.negated == excluded and pattern.matches(abs_path, name, is_dir):
+      excluded = not pattern.negated
+  return excluded
+
+
+def _is_included(
+  include_patterns: List[PathPattern],
+  abs_path: str,
+  name: str,
+) -> bool:
+  included = False
+  for pattern in include_patterns:
+    if pattern.negated == included and pattern.matches(abs_path, name, is_dir=False):
+      included = not pattern.negated
+  return included
+
+
+def _get_walk_roots(include_patterns: List[PathPattern]) -> List[Tuple[str, bool]]:
+  # Rules without a slash match anywhere under the current working directory
+  roots = {}
+  for pattern in include_patterns:
+    if not pattern.negated:
+      root = pattern.root or os.getcwd()
+      roots[root] = roots.get(root, False) or pattern.relative
+
+  # Only walk outermost roots, so that nested roots don't yield paths twice
+  outermost_roots = []
+  for root in sorted(roots):
+    if not any(root == parent or root.startswith(parent.rstrip("/") + "/") for (parent, _) in outermost_roots):
+      outermost_roots.append((root, roots[root]))
+  return outermost_roots
+
+
+def _is_root_excluded(
+  exclude_patterns: List[PathPattern],
+  root: str,
+  cwd: str,
+) -> bool:
+  # Walk roots are never pruned while walking, so they are checked here, along with the directories between them and
+  # the current working directory which a walk from there would have descended through
+  directory = root
+  while True:
+    if _is_excluded(exclude_patterns, directory, os.path.basename(directory), is_dir=True):
+      return True
+    parent = os.path.dirname(directory)
+    if parent == directory or not parent.startswith(cwd.rstrip("/") + "/"):
+      return False
+    directory = parent
+
+
+def _to_display_path(abs_path: str, relative: bool, cwd: str) -> str:
+  # Yield paths relative to the current working directory for relative rules, like `glob` does
+  if not relative:
+    return abs_path
+  if abs_path.startswith(cwd + "/"):
+    return abs_path[len(cwd) + 1:]
+  return os.path.relpath(abs_path, cwd)
+
+
+def iter_source_file_paths(
+  include_rules: List[str],
+  exclude_rules: List[str],
+) -> Iterator[str]:
+  """
+  Lazily yields every file matched by `include_rules` and not by
+  `exclude_rules`, walking the file system with `os.scandir` so that
+  processing can start on the first file while discovery continues. As with
+  `glob`, hidden files and directories are only matched by literal rules,
+  and symbolic links to directories are followed, although each directory is
+  only walked once so that links which form a cycle are not.
+  """
+  assert isinstance(include_rules, List), "Expected include_rules to be a list"
+  assert isinstance(exclude_rules, List), "Expected exclude_rules to be a list"
+
+  include_patterns = [PathPattern(rule) for rule in include_rules]
+  exclude_patterns = [PathPattern(rule) for rule in exclude_rules]
+  cwd = os.getcwd()
+
+  for (root, relative) in _get_walk_roots(include_patterns):
+    # Rules without any glob characters may name a single file
+    if os.path.isfile(root):
+      name = os.path.basename(root)
+      if _is_included(include_patterns, root, name) and not _is_excluded(exclude_patterns, root, name, is_dir=False):
+        yield _to_display_path(root, relative, cwd)
+      continue
+    if _is_root_excluded(exclude_patterns, root, cwd):
+      continue
+
+    # Walk directories depth-first, in sorted order so that runs are deterministic, keeping track of the directories
+    # walked so far by device and inode, as symbolic links may lead back to them
+    stack = [root]
+    walked_directories = set()
+    while stack:
+      directory = stack.pop()
+      try:
+        stat = os.stat(directory)
+        if (stat.st_dev, stat.st_ino) in walked_directories:
+          continue
+        walked_directories.add((stat.st_dev, stat.st_ino))
+        with os.scandir(directory) as iterator:
+          entries = sorted(iterator, key=lambda entry: entry.name)
+      except OSError:
+        continue
+
+      subdirectories = []
+      for entry in entries:
+        if entry.name.startswith("."):
+          continue
+
+        abs_path = os.path.join(directory, entry.name)
+        if entry.is_dir():
+          # Prune directories which are excluded, or under which no include rule can match
+          if _is_excluded(exclude_patterns, abs_path, entry.name, is_dir=True):
+            continue
+          if not any(pattern.could_match_under(abs_path) for pattern in include_patterns if not pattern.negated):
+            continue
+          subdirectories.append(abs_path)
+
+        elif entry.is_file():
+          if _is_included(include_patterns, abs_path, entry.name) and not _is_excluded(exclude_patterns, abs_path, entry.name, is_dir=False):
+            yield _to_display_path(abs_path, relative, cwd)
+
+      # Push in reverse, so that subdirectories are visited in sorted order
+      stack.extend(reversed(subdirectories))
+
+
+class SourceFileMatcher:
+  """
+  Matches single paths against include and exclude rules the same way
+  `iter_source_file_paths` does while walking, e.g. for paths reported by a
+  file watcher, without walking the file system.
+  """
+
+  def __init__(
+    self,
+    include_rules: List[str],
+    exclude_rules: List[str],
+  ) -> None:
+    assert isinstance(include_rules, List), "Expected include_rules to be a list"
+    assert isinstance(exclude_rules, List), "Expected exclude_rules to be a list"
+
+    self._include_patterns = [PathPattern(rule) for rule in include_rules]
+    self._exclude_patterns = [PathPattern(rule) for rule in exclude_rules]
+    self._cwd = os.getcwd()
+    self.roots = _get_walk_roots(self._include_patterns)
+
+
+  def could_contain_source_files(self, abs_dir: str) -> bool:
+    """Whether the directory is one `iter_source_file_paths` would descend into."""
+    name = os.path.basename(abs_dir)
+    if name.startswith(".") or _is_excluded(self._exclude_patterns, abs_dir, name, is_dir=True):
+      return False
+    return any(pattern.could_match_under(abs_dir) for pattern in self._include_patterns if not pattern.negated)
+
+
+  def match(self, path: str) -> Optional[str]:
+    """
+    Returns the path as `iter_source_file_paths` would yield it if it is a
+    source file matched by the rules, or `None` otherwise. Only the path is
+    matched, so it may well not exist (anymore).
+    """
+    abs_path = os.path.abspath(path)
+    name = os.path.basename(abs_path)
+
+    for (root, relative) in self.roots:
+      # Rules without any glob characters may name a single file
+      if abs_path == root:
+        if _is_included(self._include_patterns, abs_path, name) and not _is_excluded(self._exclude_patterns, abs_path, name, is_dir=False):
+          return _to_display_path(abs_path, relative, self._cwd)
+        continue
+      if not abs_path.startswith(root.rstrip("/") + "/"):
+        continue
+      if _is_root_excluded(self._exclude_patterns, root, self._cwd):
+        return None
+
+      # Every directory between the root and the file must be one that the walk descends into
+      components = abs_path[len(root.rstrip("/")) + 1:].split("/")
+      directory = root
+      if name.startswith(".") or not all(self.could_contain_source_files(directory := os.path.join(directory, component)) for component in components[:-1]):
+        return None
+
+      if _is_included(self._include_patterns, abs_path, name) and not _is_excluded(self._exclude_patterns, abs_path, name, is_dir=False):
+        return _to_display_path(abs_path, relative, self._cwd)
+      return None
+
+    return None
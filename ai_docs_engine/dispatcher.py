@@ -0,0 +1,588 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import concurrent.futures
+import threading
+
+from ai_docs_engine.docstring_schema import ClassDocstringData, FunctionDocstringData
+from ai_docs_engine.python_docstring_inserter import postprocess_docstring
+from ai_docs_engine.docstring_request import DocstringRequest
+from ai_docs_engine.compaction import fill_summary_placeholders, summarize_docstring
+from ai_docs_engine.chunking import FunctionChunks, split_function
+from ai_docs_engine.bulk import BulkRequestWriter, BulkResults
+from ai_docs_engine.cache import DocstringCache
+from ai_docs_engine.concurrency import ConcurrencyController
+from ai_docs_engine.scheduler import RequestScheduler
+from ai_docs_engine.tokens import count_tokens
+from ai_docs_engine.errors import AIDocsEngineTooManyTokensError
+from ai_docs_engine.config import AIDocsEngineConfig
+from ai_docs_engine.metrics import COUNT_BUCKETS, STAGE_LLM_WAIT, STAGE_RESPONSE_VALIDATION, metrics
+from ai_docs_engine.logger import logger
+
+
+# Estimated tokens used by the system prompt, agent function schema and response of a request
+REQUEST_TOKEN_OVERHEAD = 1_000
+
+# Estimated tokens used by the heading and response of each definition in a batched request
+BATCH_DEFINITION_TOKEN_OVERHEAD = 250
+
+# Kinds of futures a file waits on: a request for one definition, a batched request, or the flight of another file
+FLIGHT_SINGLE = "single"
+FLIGHT_BATCH = "batch"
+FLIGHT_SHARED = "shared"
+
+
+def estimate_request_tokens(request: DocstringRequest) -> int:
+  return count_tokens(request.definition) + REQUEST_TOKEN_OVERHEAD
+
+
+def estimate_batch_tokens(requests: List[DocstringRequest]) -> int:
+  return sum(count_tokens(request.definition) + BATCH_DEFINITION_TOKEN_OVERHEAD for request in requests) + REQUEST_TOKEN_OVERHEAD
+
+
+def get_parent_qualname(request: DocstringRequest) -> str:
+  # Methods share the qualified name of their class as a parent, while top-level definitions share an empty one
+  return request.qualname.rpartition(".")[0]
+
+
+class DocstringDispatcher:
+  """
+  Runs docstring generation requests concurrently on behalf of every file in
+  a run, so that the number of requests in flight is not tied to the number
+  of files being processed. Requests with the same cache key share a single
+  flight, i.e. identical definitions (in any number of files) cost exactly
+  one request per run, even when they all miss the cache at once.
+  """
+
+  def __init__(
+    self,
+    config: AIDocsEngineConfig,
+  ) -> None:
+    assert isinstance(config, AIDocsEngineConfig), "Expected config to be an `AIDocsEngineConfig`"
+
+    self._config = config
+    self._backend = config.get_backend()
+    self._scheduler = RequestScheduler(config)
+    self._failure_count = 0
+    self._failure_count_lock = threading.Lock()
+
+    # Estimated costs of the requests actually sent, i.e. not served from the cache, triaged or coalesced
+    self._dispatched_costs: List[int] = []
+    self._dispatched_costs_lock = threading.Lock()
+
+    # Futures of definitions in flight, keyed by cache key
+    self._flights: Dict[str, concurrent.futures.Future] = {}
+    self._flights_lock = threading.Lock()
+
+    # Open the response cache, if enabled
+    self._cache = None
+    if config.cache_dir is not None:
+      self._cache = DocstringCache(directory=config.cache_dir, size_limit=config.cache_size_limit, remote_cache=config.remote_cache)
+
+    # Requests are keyed by their cache key, which also serves as the stable ID of bulk requests
+    self._cache_fingerprint = self._backend.cache_fingerprint()
+
+    # In bulk modes, requests are exported to a file, or their results imported from one, instead of calling the backend
+    self._bulk_request_writer = None
+    if config.export_requests_path is not None:
+      self._bulk_request_writer = BulkRequestWriter(path=config.export_requests_path, backend=self._backend, temperature=config.temperature)
+    self._bulk_results = None
+    if config.import_results_path is not None:
+      self._bulk_results = BulkResults(path=config.import_results_path, backend=self._backend)
+
+
+  def __enter__(self) -> "DocstringDispatcher":
+    return self
+
+
+  def __exit__(self, *_) -> None:
+    self.shutdown()
+
+
+  def shutdown(self) -> None:
+    self._scheduler.shutdown(cleanup=self._backend.aclose)
+    if self._cache is not None:
+      self._cache.close()
+    if self._bulk_request_writer is not None:
+      self._bulk_request_writer.close()
+
+
+  @property
+  def failure_count(self) -> int:
+    return self._failure_count
+
+
+  @property
+  def dispatched_costs(self) -> List[int]:
+    with self._dispatched_costs_lock:
+      return list(self._dispatched_costs)
+
+
+  @property
+  def concurrency(self) -> ConcurrencyController:
+    return self._scheduler.concurrency
+
+
+  async def _generate(
+    self,
+    request: DocstringRequest,
+    cache_key: str,
+  ) -> FunctionDocstringData | ClassDocstringData:
+    # Generate docstring (i.e. via OpenAI API backend)
+    docstring_data = await self._backend.generate(
+      language=request.language,
+      definition=request.definition,
+      definition_type=request.definition_type,
+      temperature=self._config.temperature,
+    )
+
+    # Cache the raw docstring data, so that changes to postprocessing apply to cached entries too
+    if self._cache is not None:
+      self._cache.set(cache_key, docstring_data)
+
+    # Return postprocessed docstring
+    return postprocess_docstring(docstring_data)
+
+
+  async def _generate_batch(
+    self,
+    requests: List[DocstringRequest],
+    cache_keys: Dict[str, str],
+  ) -> Dict[str, FunctionDocstringData | ClassDocstringData]:
+    # Generate docstrings for every definition in the batch with one request
+    batch_data = await self._backend.generate_many(
+      language=requests[0].language,
+      definitions={request.definition_id: (request.definition, request.definition_type) for request in requests},
+      temperature=self._config.temperature,
+    )
+
+    # Validate docstring data against the type of each definition, dropping anything unexpected
+    with metrics.time_stage(STAGE_RESPONSE_VALIDATION):
+      valid_requests = []
+      for request in requests:
+        response_type = FunctionDocstringData if request.definition_type == "function" else ClassDocstringData
+        if isinstance(batch_data.get(request.definition_id), response_type):
+          valid_requests.append(request)
+    metrics.increment("batch_definitions", len(valid_requests), result="documented")
+    metrics.increment("batch_definitions", len(requests) - len(valid_requests), result="missing")
+
+    results = {}
+    for request in valid_requests:
+      docstring_data = batch_data[request.definition_id]
+
+      # Cache the raw docstring data of each definition on its own, so that it can be reused outside of this batch
+      if self._cache is not None:
+        self._cache.set(cache_keys[request.definition_id], docstring_data)
+
+      results[request.definition_id] = postprocess_docstring(docstring_data)
+
+    return results
+
+
+  def _lookup_many(
+    self,
+    requests: List[DocstringRequest],
+  ) -> Tuple[Dict[str, str], Dict[str, FunctionDocstringData | ClassDocstringData]]:
+    # Returns the cache keys of the requests, and the cached docstring data of the hits, both keyed by definition ID
+    cache_keys = {
+      request.definition_id: DocstringCache.make_key(
+        request=request,
+        temperature=self._config.temperature,
+        fingerprint=self._cache_fingerprint,
+      )
+      for request in requests
+    }
+    if self._cache is None:
+      return (cache_keys, {})
+
+    # Look up all of the requests at once, so that a remote cache is asked once per file rather than once per definition
+    cached = self._cache.get_many({cache_keys[request.definition_id]: request.definition_type for request in requests})
+    hits = {
+      definition_id: cached[cache_key]
+      for (definition_id, cache_key) in cache_keys.items()
+      if cache_key in cached
+    }
+    metrics.increment("cache_lookups", len(hits), result="hit")
+    metrics.increment("cache_lookups", len(requests) - len(hits), result="miss")
+    return (cache_keys, hits)
+
+
+  def _submit(
+    self,
+    func: Callable[[], Awaitable[Any]],
+    estimated_tokens: int,
+    description: str,
+  ) -> concurrent.futures.Future:
+    # Record the estimated cost of every request sent, which is what the makespan prediction is based on
+    with self._dispatched_costs_lock:
+      self._dispatched_costs.append(estimated_tokens)
+    return self._scheduler.submit(func=func, estimated_tokens=estimated_tokens, description=description)
+
+
+  def _submit_uncached(
+    self,
+    request: DocstringRequest,
+    cache_key: str,
+  ) -> concurrent.futures.Future:
+    return self._submit(
+      func=lambda: self._generate(request, cache_key),
+      estimated_tokens=estimate_request_tokens(request),
+      description=f"`{request.qualname}` (`{request.file_path}`)",
+    )
+
+
+  def _submit_batch_uncached(
+    self,
+    requests: List[DocstringRequest],
+    cache_keys: Dict[str, str],
+  ) -> concurrent.futures.Future:
+    return self._submit(
+      func=lambda: self._generate_batch(requests, cache_keys),
+      estimated_tokens=estimate_batch_tokens(requests),
+      description=f"batch of {len(requests)} definitions (`{requests[0].file_path}`)",
+    )
+
+
+  def _submit_chunk(
+    self,
+    request: DocstringRequest,
+    chunks: FunctionChunks,
+    part: int,
+  ) -> concurrent.futures.Future:
+    definition = chunks.get_chunk_definition(part)
+    return self._submit(
+      func=lambda: self._backend.summarize_chunk(
+        language=request.language,
+        definition=definition,
+        temperature=self._config.temperature,
+      ),
+      estimated_tokens=count_tokens(definition) + REQUEST_TOKEN_OVERHEAD,
+      description=f"part {part + 1} of {len(chunks.chunks)} of `{request.qualname}` (`{request.file_path}`)",
+    )
+
+
+  def _generate_chunked(
+    self,
+    request: DocstringRequest,
+    cache_key: str,
+  ) -> FunctionDocstringData:
+    """
+    Generates the docstring of a function which is too large for any model,
+    by summarizing its body in chunks, at most `max_chunks_in_flight` at a
+    time, then generating the docstring from its signature and the chunk
+    summaries, see `ai_docs_engine.chunking`.
+    """
+    chunks = split_function(request.definition, max_chunk_tokens=self._config.chunk_max_tokens)
+    if chunks is None:
+      raise AIDocsEngineTooManyTokensError(num_tokens=count_tokens(request.definition))
+
+    # The number of chunks per definition goes into a histogram, as labelling it by definition would add a series for every oversized function
+    metrics.observe("definition_chunks", len(chunks.chunks), buckets=COUNT_BUCKETS)
+    logger.info(f"Summarizing `{request.qualname}` (`{request.file_path}`) in {len(chunks.chunks)} chunks, as it is too large for any model")
+
+    # Map: summarize chunks concurrently, keeping up to `max_chunks_in_flight` of them in flight
+    summaries = [None] * len(chunks.chunks)
+    parts = iter(range(len(chunks.chunks)))
+    pending = {}
+    for part in parts:
+      pending[self._submit_chunk(request, chunks, part)] = part
+      if len(pending) >= self._config.max_chunks_in_flight:
+        break
+    while pending:
+      (done, _) = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        summaries[pending.pop(future)] = future.result()
+        part = next(parts, None)
+        if part is not None:
+          pending[self._submit_chunk(request, chunks, part)] = part
+
+    # Reduce: generate the docstring from the signature and the chunk summaries, caching it for the whole function
+    reduced_request = request.copy(update={"definition": chunks.get_reduced_definition(summaries)})
+    return self._submit_uncached(reduced_request, cache_key).result()
+
+
+  def _join_flight(
+    self,
+    request: DocstringRequest,
+    cache_key: str,
+  ) -> Tuple[concurrent.futures.Future, bool]:
+    """
+    Returns the future of the flight for a cache key, and whether the caller
+    leads it, i.e. has to make the request and land the flight afterwards.
+    """
+    with self._flights_lock:
+      flight = self._flights.get(cache_key)
+      if flight is not None:
+        metrics.increment("coalesced_definitions")
+        return (flight, False)
+      flight = concurrent.futures.Future()
+      self._flights[cache_key] = flight
+
+    # The previous flight may have landed in the cache between our lookup and now
+    if self._cache is not None:
+      docstring_data = self._cache.get(cache_key, request.definition_type)
+      if docstring_data is not None:
+        self._land_flight(cache_key, postprocess_docstring(docstring_data))
+        return (flight, False)
+
+    return (flight, True)
+
+
+  def _land_flight(
+    self,
+    cache_key: str,
+    docstring_data: Optional[FunctionDocstringData | ClassDocstringData] = None,
+    exception: Optional[BaseException] = None,
+  ) -> None:
+    with self._flights_lock:
+      flight = self._flights.pop(cache_key)
+    if exception is not None:
+      flight.set_exception(exception)
+    else:
+      flight.set_result(docstring_data)
+
+
+  def _abort_flights(
+    self,
+    flights: Dict[str, concurrent.futures.Future],
+    exception: BaseException,
+  ) -> None:
+    # Only flights which are still up are landed, as a landed flight's cache key may already belong to a newer one
+    for (cache_key, flight) in flights.items():
+      with self._flights_lock:
+        if self._flights.get(cache_key) is not flight:
+          continue
+        del self._flights[cache_key]
+      flight.set_exception(exception)
+
+
+  def _make_batches(
+    self,
+    requests: List[DocstringRequest],
+  ) -> List[List[DocstringRequest]]:
+    """
+    Groups small definitions into batches up to the token budget, keeping the
+    methods of a class together, while large definitions get a batch of
+    their own.
+    """
+    if not self._backend.supports_batching:
+      return [[request] for request in requests]
+
+    # Order small definitions by parent, so that siblings end up in the same batch; sorting is stable
+    small_requests = []
+    batches = []
+    for request in requests:
+      if count_tokens(request.definition) <= self._config.batch_max_definition_tokens:
+        small_requests.append(request)
+      else:
+        batches.append([request])
+    small_requests.sort(key=get_parent_qualname)
+
+    # Greedily fill batches, starting a new one whenever the next definition doesn't fit
+    batch = []
+    batch_tokens = 0
+    for request in small_requests:
+      request_tokens = count_tokens(request.definition) + BATCH_DEFINITION_TOKEN_OVERHEAD
+      if batch and (batch_tokens + request_tokens > self._config.batch_token_budget or len(batch) >= self._config.batch_max_definitions):
+        batches.append(batch)
+        (batch, batch_tokens) = ([], 0)
+      batch.append(request)
+      batch_tokens += request_tokens
+    if batch:
+      batches.append(batch)
+
+    return batches
+
+
+  def _record_failure(
+    self,
+    request: DocstringRequest,
+    exception: Exception,
+  ) -> None:
+    with self._failure_count_lock:
+      self._failure_count += 1
+    metrics.increment("failed_definitions")
+    logger.error(
+      "Failed to generate docstring for node, skipping.\n"
+      f"Node: {request.qualname} (`{request.file_path}`)\n"
+      f"Error: {exception}"
+    )
+
+
+  def _import_result(
+    self,
+    request: DocstringRequest,
+    cache_key: str,
+    results: Dict[str, FunctionDocstringData | ClassDocstringData],
+  ) -> None:
+    try:
+      docstring_data = self._bulk_results.get(request, custom_id=cache_key)
+    except Exception as exception:
+      self._record_failure(request, exception)
+      return
+
+    # Cache the imported docstring data, so that later runs don't need the results file
+    if self._cache is not None:
+      self._cache.set(cache_key, docstring_data)
+
+    results[request.definition_id] = postprocess_docstring(docstring_data)
+
+
+  def dispatch(
+    self,
+    requests: List[DocstringRequest],
+  ) -> Dict[str, FunctionDocstringData | ClassDocstringData]:
+    """
+    Generates docstrings for the requests of one file, keyed by definition
+    ID. Requests which await the summaries of nested definitions (see
+    `hierarchical_summaries`) are held back until those have been
+    generated, so that definitions are documented bottom-up in rounds.
+    """
+    results = {}
+
+    # In bulk modes, nested definitions are not documented yet, so summaries are left out on export and import alike
+    use_summaries = self._bulk_request_writer is None and self._bulk_results is None
+
+    waiting_requests = list(requests)
+    while waiting_requests:
+      # Requests are ready once none of the definitions they await are still waiting themselves
+      waiting_ids = {request.definition_id for request in waiting_requests}
+      ready_requests = [request for request in waiting_requests if waiting_ids.isdisjoint(request.child_definition_ids)]
+      waiting_requests = [request for request in waiting_requests if not waiting_ids.isdisjoint(request.child_definition_ids)]
+
+      # Fill in the summaries of nested definitions, leaving out those which failed
+      ready_requests = [
+        self._fill_summaries(request, results if use_summaries else {})
+        for request in ready_requests
+      ]
+      self._dispatch_round(ready_requests, results)
+
+    return results
+
+
+  def _fill_summaries(
+    self,
+    request: DocstringRequest,
+    results: Dict[str, FunctionDocstringData | ClassDocstringData],
+  ) -> DocstringRequest:
+    if not request.child_definition_ids:
+      return request
+
+    summaries = {
+      definition_id: summarize_docstring(results[definition_id].description)
+      for definition_id in request.child_definition_ids
+      if definition_id in results
+    }
+    return request.copy(update={
+      "definition": fill_summary_placeholders(request.definition, summaries),
+      "child_definition_ids": [],
+    })
+
+
+  def _dispatch_round(
+    self,
+    requests: List[DocstringRequest],
+    results: Dict[str, FunctionDocstringData | ClassDocstringData],
+  ) -> None:
+    # Serve what we can from the cache, so that only misses are batched
+    (cache_keys, hits) = self._lookup_many(requests)
+    uncached_requests = [request for request in requests if request.definition_id not in hits]
+
+    # On export, cache misses are only written out, while hits are left for the import run to apply along with the results
+    if self._bulk_request_writer is not None:
+      for request in uncached_requests:
+        self._bulk_request_writer.write(request, custom_id=cache_keys[request.definition_id])
+      return
+
+    for (definition_id, docstring_data) in hits.items():
+      results[definition_id] = postprocess_docstring(docstring_data)
+
+    # On import, cache misses are served from the imported results
+    if self._bulk_results is not None:
+      for request in uncached_requests:
+        self._import_result(request, cache_keys[request.definition_id], results)
+      return
+
+    # Only request definitions which are not already in flight, and wait on the flights of the others instead
+    pending = {}
+    leading_requests = []
+    leading_flights = {}
+    for request in uncached_requests:
+      (flight, is_leader) = self._join_flight(request, cache_keys[request.definition_id])
+      if is_leader:
+        leading_requests.append(request)
+        leading_flights[cache_keys[request.definition_id]] = flight
+      else:
+        pending[flight] = ([request], FLIGHT_SHARED)
+
+    try:
+      # Fire all requests at once, batching small definitions together if enabled, and starting with the largest if enabled
+      batches = self._make_batches(leading_requests)
+      if self._config.schedule_largest_first:
+        batches.sort(key=estimate_batch_tokens, reverse=True)
+      for batch in batches:
+        if len(batch) == 1:
+          pending[self._submit_uncached(batch[0], cache_keys[batch[0].definition_id])] = (batch, FLIGHT_SINGLE)
+        else:
+          pending[self._submit_batch_uncached(batch, cache_keys)] = (batch, FLIGHT_BATCH)
+
+      if len(leading_requests) > len(batches):
+        logger.info(f"Batched {len(leading_requests)} definitions into {len(batches)} requests for file `{requests[0].file_path}`")
+
+      # Gather results as they complete, keyed by definition ID
+      with metrics.time_stage(STAGE_LLM_WAIT):
+        self._gather(pending, cache_keys, results)
+
+    # Other files may be waiting on the flights this round leads, so land every one which is still up before giving up
+    except BaseException as exception:
+      self._abort_flights(leading_flights, exception)
+      raise
+
+
+  def _gather(
+    self,
+    pending: Dict[concurrent.futures.Future, Tuple[List[DocstringRequest], str]],
+    cache_keys: Dict[str, str],
+    results: Dict[str, FunctionDocstringData | ClassDocstringData],
+  ) -> None:
+    while pending:
+      (done, _) = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        (batch, kind) = pending.pop(future)
+
+        # Copy docstrings shared with another file, so that neither can affect the other
+        if kind == FLIGHT_SHARED:
+          try:
+            results[batch[0].definition_id] = future.result().copy(deep=True)
+          except Exception as exception:
+            self._record_failure(batch[0], exception)
+          continue
+
+        # If docstring generation fails even after retrying, then log error and skip the definition
+        if kind == FLIGHT_SINGLE:
+          cache_key = cache_keys[batch[0].definition_id]
+          try:
+            try:
+              results[batch[0].definition_id] = future.result()
+
+            # Functions too large for any model are documented from summaries of their body instead, if enabled
+            except AIDocsEngineTooManyTokensError:
+              if not self._config.chunk_oversized_functions or batch[0].definition_type != "function":
+                raise
+              results[batch[0].definition_id] = self._generate_chunked(batch[0], cache_key)
+
+            self._land_flight(cache_key, results[batch[0].definition_id])
+          except Exception as exception:
+            self._land_flight(cache_key, exception=exception)
+            self._record_failure(batch[0], exception)
+          continue
+
+        # Fall back to individual requests for definitions which the batch failed to document
+        try:
+          results.update(future.result())
+        except Exception as exception:
+          logger.warning(f"Batched request for {len(batch)} definitions failed, retrying them individually ({exception = })")
+
+        for request in batch:
+          if request.definition_id in results:
+            self._land_flight(cache_keys[request.definition_id], results[request.definition_id])
+          else:
+            pending[self._submit_uncached(request, cache_keys[request.definition_id])] = ([request], FLIGHT_SINGLE)
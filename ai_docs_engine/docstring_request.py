@@ -0,0 +1,14 @@
+from typing import List
+from pydantic import Field
+
+from ai_docs_engine.utilities import ConstBaseModel
+
+
+class DocstringRequest(ConstBaseModel):
+  file_path:            str = Field(description="Path of the source file that contains the definition")
+  definition_id:        str = Field(description="Identifier of the definition, unique within its source file")
+  qualname:             str = Field(description="Qualified name of the definition, e.g. 'Foo.bar'")
+  language:             str = Field(description="Language of the definition, e.g. 'python'")
+  definition:           str = Field(description="Preprocessed source code of the definition")
+  definition_type:      str = Field(description="Type of the definition, e.g. 'function' or 'class'")
+  child_definition_ids: List[str] = Field(description="IDs of nested definitions whose summaries `definition` awaits, see `ai_docs_engine.compaction.fill_summary_placeholders`", default=[])
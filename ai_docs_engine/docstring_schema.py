@@ -30,3 +30,15 @@ class FunctionDocstringData(BaseModel):
 
 class ClassDocstringData(BaseModel):
   description:    str = Field(default="", description="The overall description of the class in 1 sentence; this should begin with a verb.")
+
+
+class ChunkSummaryData(BaseModel):
+  summary:        str = Field(default="", description="What this part of the function does, in 1 sentence; this should begin with a verb.")
+
+
+class BatchDocstringItemData(FunctionDocstringData):
+  definition_id:  str                         = Field(description="The ID of the definition this docstring is for, exactly as it was given.")
+
+
+class BatchDocstringData(BaseModel):
+  docstrings:     List[BatchDocstringItemData] = Field(default=[], description="An array of docstrings, with exactly one for each of the given definitions. Class docstrings only need a description.")
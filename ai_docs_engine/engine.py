@@ -0,0 +1,588 @@
+import concurrent.futures
+from typing import Callable, Dict, Iterator, List, Optional, Set, TextIO, Tuple
+import multiprocessing
+import contextlib
+import itertools
+import threading
+import json
+import time
+import sys
+import os
+
+from ai_docs_engine.pipeline import FileResult, FileWork, SKIP_REASON_NOTHING_TO_DOCUMENT, apply_file, apply_file_in_worker, collect_file, collect_file_in_worker, estimate_file_in_worker, init_worker
+from ai_docs_engine.cache import hash_text
+from ai_docs_engine.discovery import SourceFileMatcher, iter_source_file_paths
+from ai_docs_engine.dispatcher import DocstringDispatcher
+from ai_docs_engine.planning import FileEstimate, estimate_file, order_largest_first, predict_makespan
+from ai_docs_engine.local_docstrings import TRIAGE_LLM
+from ai_docs_engine.manifest import Manifest
+from ai_docs_engine.watch import create_file_watcher
+from ai_docs_engine.utilities import load_environment
+from ai_docs_engine.errors import AIDocsEngineError
+from ai_docs_engine.config import AIDocsEngineConfig
+from ai_docs_engine.metrics import STAGE_DISCOVERY, STAGE_PLANNING, metrics
+from ai_docs_engine.tokens import token_usage
+from ai_docs_engine.logger import logger
+
+
+# Seconds to wait for changes at a time in watch mode while files are pending or in flight, and while idle
+WATCH_BUSY_INTERVAL = 0.05
+WATCH_IDLE_INTERVAL = 0.5
+
+
+def _normalize_triage_policy(triage_policy: Dict[str, str]) -> Dict[str, str]:
+  # Kinds which are left out are sent to the model, the same as kinds which are explicitly sent to it
+  return {kind: decision for (kind, decision) in triage_policy.items() if decision != TRIAGE_LLM}
+
+
+def _get_manifest_fingerprint(config: AIDocsEngineConfig) -> str:
+  # Settings which change what a run leaves behind for a file invalidate the whole manifest
+  return hash_text(json.dumps({
+    "inplace":           config.inplace,
+    "skip_init_methods": config.skip_init_methods,
+    "quote_style":       config.quote_style,
+    "triage_policy":     _normalize_triage_policy(config.triage_policy),
+    "docstring_builder": type(config.docstring_builder).__qualname__,
+    "backend":           config.get_backend().cache_fingerprint(),
+  }, sort_keys=True))
+
+
+def _generate_docstrings_for_file(
+  config: AIDocsEngineConfig,
+  dispatcher: DocstringDispatcher,
+  manifest: Optional[Manifest],
+  file_path: str,
+  process_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None,
+  emit_diff: Optional[Callable[[str], None]] = None,
+) -> Optional[Tuple[str, str]]:
+  # Collect definitions which need docstrings, in a worker process if enabled
+  collect_kwargs = dict(
+    file_path=file_path,
+    previous_content_hash=manifest.get_content_hash(file_path) if manifest is not None else None,
+    settled_definitions=manifest.get_definition_hashes(file_path) if manifest is not None else None,
+  )
+  if process_pool is not None:
+    work = process_pool.submit(collect_file_in_worker, **collect_kwargs).result()
+    metrics.merge(work.metrics)
+  else:
+    work = collect_file(config=config, **collect_kwargs)
+
+  # Skip file if there is nothing to do, remembering files with nothing to document
+  if work.skip_reason is not None:
+    if manifest is not None and not config.dry_run and work.skip_reason == SKIP_REASON_NOTHING_TO_DOCUMENT:
+      manifest.update_file(file_path=file_path, content_hash=work.content_hash, definition_hashes={})
+    return None
+
+  # Generate docstrings for all collected definitions concurrently
+  generated_docstrings = dispatcher.dispatch(work.requests)
+
+  # Exporting requests leaves the file untouched, so that the requests exported for its classes still match it on import,
+  # where local, cached and imported docstrings are applied together
+  if config.export_requests_path is not None:
+    return None
+
+  # Apply the generated docstrings alongside those which were built locally
+  docstrings = {**work.local_docstrings, **generated_docstrings}
+
+  # Apply generated docstrings to the file, in a worker process if enabled
+  apply_kwargs = dict(
+    file_path=file_path,
+    content_hash=work.content_hash,
+    docstrings=docstrings,
+    track_hashes=manifest is not None,
+  )
+  if process_pool is not None:
+    result = process_pool.submit(apply_file_in_worker, **apply_kwargs).result()
+    metrics.merge(result.metrics)
+  else:
+    result = apply_file(config=config, wrapper=work.wrapper, **apply_kwargs)
+
+  # Output the changes a dry run would have made
+  if result.diff and emit_diff is not None:
+    emit_diff(result.diff)
+
+  # Record the state the file was left in, so that the next run can skip what is unchanged
+  if manifest is not None and not config.dry_run:
+    _update_manifest_for_file(
+      manifest=manifest,
+      work=work,
+      docstrings=docstrings,
+      result=result,
+    )
+
+  # Skip files which were not written to, i.e. unchanged files and dry runs
+  if result.written_path is None:
+    return None
+
+  # Return the original file path and the path that the modified code was written to
+  return (file_path, result.written_path)
+
+
+def _update_manifest_for_file(
+  manifest: Manifest,
+  work: FileWork,
+  docstrings: dict,
+  result: FileResult,
+) -> None:
+  # Definitions which failed are left out, so that they are retried next time
+  failed_definition_keys = {
+    work.definition_keys[request.definition_id]
+    for request in work.requests
+    if request.definition_id not in docstrings
+  }
+
+  # If the file was modified in-place, then the next run will see the modified code instead
+  content_hash = result.content_hash or work.content_hash
+  definition_hashes = result.definition_hashes if result.definition_hashes is not None else work.definition_hashes
+
+  manifest.update_file(
+    file_path=work.file_path,
+    content_hash=None if failed_definition_keys else content_hash,
+    definition_hashes={
+      definition_key: definition_hash
+      for (definition_key, definition_hash) in definition_hashes.items()
+      if definition_key not in failed_definition_keys
+    },
+  )
+
+
+def _estimate_files(
+  config: AIDocsEngineConfig,
+  manifest: Optional[Manifest],
+  file_paths: List[str],
+  process_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None,
+) -> List[FileEstimate]:
+  # Pre-scan files in worker processes if enabled, as parsing them is CPU-bound
+  estimate_kwargs = [
+    dict(
+      file_path=file_path,
+      previous_content_hash=manifest.get_content_hash(file_path) if manifest is not None else None,
+    )
+    for file_path in file_paths
+  ]
+  if process_pool is not None:
+    futures = [process_pool.submit(estimate_file_in_worker, **kwargs) for kwargs in estimate_kwargs]
+    return [future.result() for future in futures]
+  return [estimate_file(config=config, **kwargs) for kwargs in estimate_kwargs]
+
+
+def _iter_largest_first(
+  config: AIDocsEngineConfig,
+  manifest: Optional[Manifest],
+  file_paths: Iterator[str],
+  process_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None,
+) -> Iterator[str]:
+  # Estimate and order the files one window of `max_files_in_flight` files at a time, so that processing starts once
+  # the first window is pre-scanned rather than once every file is, and the paths held at a time stay bounded
+  while True:
+    with metrics.time_stage(STAGE_DISCOVERY):
+      window = list(itertools.islice(file_paths, config.max_files_in_flight))
+    if not window:
+      return
+    with metrics.time_stage(STAGE_PLANNING):
+      estimates = order_largest_first(_estimate_files(config, manifest, window, process_pool))
+    for estimate in estimates:
+      yield estimate.file_path
+
+
+def _report_makespan(
+  request_costs: List[int],
+  slots: int,
+  actual_makespan: float,
+) -> None:
+  # Scale the estimated costs so that they add up to the time actually spent on requests; only their shape is predicted
+  request_seconds = metrics.get_histogram_sum("request_seconds", outcome="success")
+  if not request_costs or request_seconds == 0:
+    return
+  seconds_per_cost = request_seconds / sum(request_costs)
+
+  predicted_makespan = predict_makespan(request_costs, slots) * seconds_per_cost
+  metrics.set_gauge("makespan_seconds", predicted_makespan, kind="predicted")
+  metrics.set_gauge("makespan_seconds", actual_makespan, kind="actual")
+  logger.info(
+    f"Predicted makespan of {predicted_makespan:.2f} seconds for {request_seconds:.2f} seconds of requests over {slots} slots, "
+    f"actual makespan was {actual_makespan:.2f} seconds"
+  )
+
+
+def _create_process_pool(config: AIDocsEngineConfig) -> Optional[concurrent.futures.ProcessPoolExecutor]:
+  if config.execution_mode != "process":
+    return None
+  return concurrent.futures.ProcessPoolExecutor(
+    max_workers=config.max_processes or os.cpu_count(),
+    mp_context=multiprocessing.get_context("spawn"),
+    initializer=init_worker,
+    initargs=(config,),
+  )
+
+
+def _open_diff_stream(config: AIDocsEngineConfig) -> Tuple[Optional[TextIO], Callable[[str], None]]:
+  # Returns the patch stream of a dry run, if any, along with a function to write diffs to it from any thread
+  diff_stream = None
+  diff_lock = threading.Lock()
+  if config.dry_run:
+    diff_stream = open(config.diff_path, "w") if config.diff_path is not None else sys.stdout
+
+  def emit_diff(diff: str) -> None:
+    with diff_lock:
+      diff_stream.write(diff)
+      diff_stream.flush()
+
+  return (diff_stream, emit_diff)
+
+
+def _report_token_usage() -> None:
+  for (model, usage) in token_usage.snapshot().items():
+    logger.info(
+      f"Model `{model}` used {usage['prompt_tokens']} prompt tokens and "
+      f"{usage['completion_tokens']} completion tokens over {usage['requests']} requests"
+    )
+    metrics.increment("model_requests", usage["requests"], model=model)
+    metrics.increment("tokens", usage["prompt_tokens"], model=model, kind="prompt")
+    metrics.increment("tokens", usage["completion_tokens"], model=model, kind="completion")
+
+
+def _dump_metrics(config: AIDocsEngineConfig) -> None:
+  if config.metrics_path is not None:
+    metrics.write_json(config.metrics_path)
+  if config.prometheus_textfile_path is not None:
+    metrics.write_prometheus_textfile(config.prometheus_textfile_path)
+
+
+def _get_file_size(file_path: str) -> int:
+  # Unreadable files will fail later on anyway, so they take up no room here
+  try:
+    return os.path.getsize(file_path)
+  except OSError:
+    return 0
+
+
+def iter_docstrings(
+  config: AIDocsEngineConfig,
+) -> Iterator[Tuple[str, str]]:
+  """
+  Generates docstrings for every source file matched by the config, yielding
+  the original path and the path the modified code was written to of each
+  file as soon as it is done, in no particular order.
+
+  Files are submitted as they are discovered, but only up to
+  `max_files_in_flight` files and `max_bytes_in_flight` bytes of source code
+  at a time, so that memory use does not grow with the number of files
+  (except for the manifest). With `schedule_largest_first`, files are
+  estimated and ordered one window of `max_files_in_flight` files at a time.
+  Files are only submitted while the caller is iterating.
+  """
+  # Load environment variables from `.env`, which is deferred until a run starts so that importing the package has no side effects
+  load_environment()
+
+  # Start tallying token usage and metrics for this run
+  token_usage.reset()
+  metrics.reset()
+  started_at = time.monotonic()
+
+  # Lazily discover source file paths to be processed
+  source_file_paths = iter_source_file_paths(
+    include_rules=config.include_rules,
+    exclude_rules=config.exclude_rules,
+  )
+
+  # Load manifest of previous run, if enabled
+  manifest = None
+  if config.manifest_path is not None:
+    manifest = Manifest(path=config.manifest_path, fingerprint=_get_manifest_fingerprint(config))
+
+  # In process mode, parsing and transforming run in worker processes, while threads only coordinate them
+  process_pool = _create_process_pool(config)
+
+  # In dry runs, write unified diffs of all changes to one patch stream
+  (diff_stream, emit_diff) = _open_diff_stream(config)
+
+  # Estimate how much work each file is ahead of submitting it, so that the largest files start first instead of ending up as a long tail
+  if config.schedule_largest_first:
+    source_file_paths = _iter_largest_first(config, manifest, source_file_paths, process_pool)
+
+  # Process source files in parallel, sharing one dispatcher for all of their docstring requests
+  with DocstringDispatcher(config) as dispatcher, concurrent.futures.ThreadPoolExecutor(max_workers=config.max_workers) as executor:
+    # Sizes of the files in flight, keyed by their futures
+    in_flight: Dict[concurrent.futures.Future, int] = {}
+    num_files = 0
+
+    def wait_for_files() -> Iterator[Tuple[str, str]]:
+      # Wait for at least one file in flight to finish, and yield the results of those which did
+      (done, _) = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        del in_flight[future]
+        try:
+          # Skip files which were not modified
+          result = future.result()
+          if result is not None:
+            yield result
+
+        except Exception as exception:
+          metrics.increment("failed_files")
+          logger.error(f"Error while processing a source file. ({exception = })")
+
+    try:
+      # Submit source files to executor as they are discovered (and, if enabled, estimated), so that processing starts right away
+      source_file_path_iterator = iter(source_file_paths)
+      while True:
+        # Discovery is timed by `_iter_largest_first` itself when scheduling largest first, apart from planning
+        with metrics.time_stage(STAGE_DISCOVERY) if not config.schedule_largest_first else contextlib.nullcontext():
+          source_file_path = next(source_file_path_iterator, None)
+        if source_file_path is None:
+          break
+
+        # Wait for room before submitting, although a file larger than the byte cap on its own goes once nothing else is in flight
+        file_size = _get_file_size(source_file_path)
+        while in_flight and (len(in_flight) >= config.max_files_in_flight or sum(in_flight.values()) + file_size > config.max_bytes_in_flight):
+          yield from wait_for_files()
+
+        future = executor.submit(
+          _generate_docstrings_for_file,
+          config=config,
+          dispatcher=dispatcher,
+          manifest=manifest,
+          file_path=source_file_path,
+          process_pool=process_pool,
+          emit_diff=emit_diff,
+        )
+        in_flight[future] = file_size
+        num_files += 1
+
+      metrics.increment("discovered_files", num_files)
+
+      # Check that there is at least one path
+      if num_files == 0:
+        raise AIDocsEngineError("No paths to process")
+
+      # Process the remaining files as they complete
+      while in_flight:
+        yield from wait_for_files()
+
+    finally:
+      # If the caller stopped early, then don't start on files which are still queued
+      for future in in_flight:
+        future.cancel()
+      concurrent.futures.wait(in_flight)
+
+      # Shut down worker processes
+      if process_pool is not None:
+        process_pool.shutdown(wait=True)
+
+      # Close patch stream, unless it is stdout
+      if diff_stream is not None and diff_stream is not sys.stdout:
+        diff_stream.close()
+
+      # Save manifest for the next run, unless nothing was actually written
+      if manifest is not None and not config.dry_run:
+        manifest.save()
+
+      # Log number of source files which were processed; the run is reported on here so that its summary and metrics are
+      # still written when the caller stops early
+      logger.info(f"Processed {num_files} source files")
+
+      # Log where the request concurrency limit ended up
+      concurrency = dispatcher.concurrency.snapshot()
+      if config.adaptive_concurrency:
+        logger.info(
+          f"Request concurrency limit settled at {concurrency['limit']} (peak {concurrency['peak_limit']}), "
+          f"after {concurrency['increases']} increases and {concurrency['decreases']} decreases"
+        )
+
+      # Compare the actual makespan against the one predicted from the estimates of the requests which were sent
+      if config.schedule_largest_first:
+        _report_makespan(
+          request_costs=dispatcher.dispatched_costs,
+          slots=concurrency["peak_limit"],
+          actual_makespan=time.monotonic() - started_at,
+        )
+
+      # Log requests which were avoided by documenting trivial definitions locally or skipping them
+      avoided_requests = metrics.get_counter_total("avoided_requests")
+      if avoided_requests > 0:
+        logger.info(f"Avoided {avoided_requests:g} requests for trivial definitions (see `triage_policy`)")
+
+      # Log definitions which could not be documented
+      if dispatcher.failure_count > 0:
+        logger.warning(f"Failed to generate docstrings for {dispatcher.failure_count} definitions")
+
+      # Log token usage per model, and add it to the metrics
+      _report_token_usage()
+
+      # Dump metrics of the run, if enabled
+      _dump_metrics(config)
+
+  # Log end of docstring generation
+  logger.info("Docstring generation complete")
+
+
+def generate_docstrings(
+  config: AIDocsEngineConfig,
+) -> Dict[str, str]:
+  # Return processed source files as a dictionary which maps their original paths to their modified paths; see
+  # `iter_docstrings` to handle them as they are done instead
+  return dict(iter_docstrings(config))
+
+
+def _is_unchanged_since_processed(
+  manifest: Manifest,
+  file_path: str,
+) -> bool:
+  # E.g. a file which was just written in-place, or only touched
+  try:
+    with open(file_path) as file:
+      return hash_text(file.read()) == manifest.get_content_hash(file_path)
+  except OSError:
+    return False
+
+
+def watch_docstrings(
+  config: AIDocsEngineConfig,
+  stop_event: Optional[threading.Event] = None,
+) -> Iterator[Tuple[str, str]]:
+  """
+  Watches the source files matched by the config for changes, and generates
+  docstrings for each changed file shortly after it is saved, yielding the
+  original path and the path the modified code was written to of each file
+  as soon as it is done. Runs until `stop_event` is set, or the caller stops
+  iterating (e.g. on `KeyboardInterrupt`).
+
+  Unlike running `iter_docstrings` after every change, nothing is discovered
+  again, only the changed files are parsed, and only their new or changed
+  definitions are documented, while the cache, the backend's connection pool
+  and the state of every file stay in memory between changes. That state is
+  kept in a manifest, which is saved to `manifest_path` if it is set, so
+  that a file's first change only documents what earlier runs have not.
+  """
+  # Load environment variables from `.env`, and start tallying token usage and metrics for this session
+  load_environment()
+  token_usage.reset()
+  metrics.reset()
+
+  # Match changed paths against the same rules as discovery
+  matcher = SourceFileMatcher(
+    include_rules=config.include_rules,
+    exclude_rules=config.exclude_rules,
+  )
+
+  # Keep the state of every file in a manifest, in memory only unless a path is set
+  manifest = Manifest(path=config.manifest_path, fingerprint=_get_manifest_fingerprint(config))
+  process_pool = _create_process_pool(config)
+  (diff_stream, emit_diff) = _open_diff_stream(config)
+
+  # Unless files are modified in-place, the modified copies written next to them match the same rules, so they are ignored
+  written_paths: Set[str] = set()
+
+  watcher = create_file_watcher(
+    matcher=matcher,
+    list_file_paths=lambda: iter_source_file_paths(include_rules=config.include_rules, exclude_rules=config.exclude_rules),
+    method=config.watch_method,
+    poll_interval=config.watch_poll_interval,
+  )
+  logger.info("Watching for changes to source files")
+
+  # Changes can't be told apart more finely than the watcher notices them, e.g. when polling
+  debounce_seconds = max(config.watch_debounce_seconds, watcher.resolution)
+
+  # Share one dispatcher, and so one cache and backend, for every change during the session
+  with watcher, DocstringDispatcher(config) as dispatcher, concurrent.futures.ThreadPoolExecutor(max_workers=config.max_workers) as executor:
+    # Paths of the files in flight, keyed by their futures
+    in_flight: Dict[concurrent.futures.Future, str] = {}
+
+    # Paths of the files which changed since they were last submitted, and when the latest change came in
+    changed_paths: Set[str] = set()
+    last_change_at = 0.0
+
+    # Number of files in the current burst of changes, and when it started
+    burst_size = 0
+    burst_started_at = 0.0
+
+    try:
+      while stop_event is None or not stop_event.is_set():
+        # Wait for changes, but wake up in time to yield finished files and to process changes once they settle
+        timeout = WATCH_BUSY_INTERVAL if in_flight or changed_paths else WATCH_IDLE_INTERVAL
+        changes = watcher.read_changes(timeout)
+        if changes is None:
+          logger.warning("Changes were lost, so checking every source file again")
+          changes = iter_source_file_paths(include_rules=config.include_rules, exclude_rules=config.exclude_rules)
+        for path in changes:
+          source_file_path = matcher.match(path)
+          if source_file_path is not None:
+            changed_paths.add(source_file_path)
+            last_change_at = time.monotonic()
+
+        # Yield the results of files which finished
+        for future in [future for future in in_flight if future.done()]:
+          del in_flight[future]
+          try:
+            # Skip files which were not modified
+            result = future.result()
+            if result is None:
+              continue
+            if os.path.abspath(result[1]) != os.path.abspath(result[0]):
+              written_paths.add(os.path.abspath(result[1]))
+            yield result
+
+          except Exception as exception:
+            metrics.increment("failed_files")
+            logger.error(f"Error while processing a source file. ({exception = })")
+
+        # Once a burst of changes is done, persist the state of every file and the metrics
+        if burst_size > 0 and not in_flight:
+          logger.info(f"Processed {burst_size} changed source files in {time.monotonic() - burst_started_at:.2f} seconds")
+          burst_size = 0
+          if not config.dry_run:
+            manifest.save()
+          _dump_metrics(config)
+
+        # Wait for changes to settle, so that a burst of them is processed together
+        if not changed_paths or time.monotonic() - last_change_at < debounce_seconds:
+          continue
+
+        # Files which are still being processed are submitted again once they are done, as they changed in the meantime
+        busy_paths = set(in_flight.values())
+        ready_paths = sorted(path for path in changed_paths if path not in busy_paths)
+        changed_paths.difference_update(ready_paths)
+        for source_file_path in ready_paths:
+          # Skip deleted files, modified copies written by this session, and files which are unchanged since they were last processed
+          if not os.path.isfile(source_file_path) or os.path.abspath(source_file_path) in written_paths or _is_unchanged_since_processed(manifest, source_file_path):
+            continue
+
+          if burst_size == 0:
+            burst_started_at = time.monotonic()
+          burst_size += 1
+          metrics.increment("watched_changes")
+
+          future = executor.submit(
+            _generate_docstrings_for_file,
+            config=config,
+            dispatcher=dispatcher,
+            manifest=manifest,
+            file_path=source_file_path,
+            process_pool=process_pool,
+            emit_diff=emit_diff,
+          )
+          in_flight[future] = source_file_path
+
+    finally:
+      # Don't start on files which are still queued
+      for future in in_flight:
+        future.cancel()
+      concurrent.futures.wait(in_flight)
+
+      # Shut down worker processes
+      if process_pool is not None:
+        process_pool.shutdown(wait=True)
+
+      # Close patch stream, unless it is stdout
+      if diff_stream is not None and diff_stream is not sys.stdout:
+        diff_stream.close()
+
+      # Save manifest for the next session, unless nothing was actually written
+      if not config.dry_run:
+        manifest.save()
+
+      # Watch mode normally ends with the caller stopping, so the session is wrapped up here rather than after the loop
+      _report_token_usage()
+      _dump_metrics(config)
+      logger.info("Stopped watching for changes")
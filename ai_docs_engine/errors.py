@@ -1,3 +1,6 @@
+from typing import Optional
+
+
 class AIDocsEngineError(Exception):
   """
   This is the base class for any Exception that is intentionally raised
@@ -7,5 +10,26 @@ class AIDocsEngineError(Exception):
 
 
 class AIDocsEngineTooManyTokensError(AIDocsEngineError):
-  def __init__(self) -> None:
-    super().__init__(f"There is no OpenAI API model that can handle this many tokens, and I have not yet implemented the logic to pre-process the input to fit within the OpenAI API limits.")
+  def __init__(self, num_tokens: Optional[int] = None) -> None:
+    super().__init__(f"There is no OpenAI API model that can handle this many tokens{f' ({num_tokens})' if num_tokens is not None else ''}; functions this large are only documented if `chunk_oversized_functions` is enabled.")
+    self.num_tokens = num_tokens
+
+
+class AIDocsEngineRetryableError(AIDocsEngineError):
+  """
+  Raised by docstring generation functions for transient failures, such as
+  rate limits or server errors, which the request scheduler should retry.
+  `overload` marks failures which mean the provider is overloaded although
+  they carry no such status code, such as timeouts.
+  """
+  def __init__(
+    self,
+    message: str,
+    status_code: Optional[int] = None,
+    retry_after: Optional[float] = None,
+    overload: bool = False,
+  ) -> None:
+    super().__init__(message)
+    self.status_code = status_code
+    self.retry_after = retry_after
+    self.overload = overload
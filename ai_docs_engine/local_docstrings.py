@@ -0,0 +1,227 @@
+##
+## Rule-based docstrings for trivial definitions, e.g. `@overload` stubs, abstract methods, getters, empty classes and
+## one-line dunder methods, which a model has nothing to add to. Each such definition is triaged by its kind into being
+## documented locally from its signature, annotations and decorators, being skipped, or being sent to the model anyway.
+##
+
+from typing import List, Optional
+import libcst
+
+from ai_docs_engine.docstring_schema import ClassDocstringData, FunctionDocstringData, FunctionParameterData, FunctionReturnData
+
+
+# What to do with a trivial definition: document it locally, leave it undocumented, or send it to the model anyway
+TRIAGE_LOCAL = "local"
+TRIAGE_SKIP = "skip"
+TRIAGE_LLM = "llm"
+TRIAGE_DECISIONS = (TRIAGE_LOCAL, TRIAGE_SKIP, TRIAGE_LLM)
+
+# Kinds of trivial definitions
+TRIVIAL_OVERLOAD = "overload"
+TRIVIAL_ABSTRACT_METHOD = "abstract_method"
+TRIVIAL_GETTER = "getter"
+TRIVIAL_EMPTY_CLASS = "empty_class"
+TRIVIAL_DUNDER = "dunder"
+TRIVIAL_KINDS = (TRIVIAL_OVERLOAD, TRIVIAL_ABSTRACT_METHOD, TRIVIAL_GETTER, TRIVIAL_EMPTY_CLASS, TRIVIAL_DUNDER)
+
+# Overload stubs are documented by their implementation, so they are left alone by default
+DEFAULT_TRIAGE_POLICY = {
+  TRIVIAL_OVERLOAD:        TRIAGE_SKIP,
+  TRIVIAL_ABSTRACT_METHOD: TRIAGE_LOCAL,
+  TRIVIAL_GETTER:          TRIAGE_LOCAL,
+  TRIVIAL_EMPTY_CLASS:     TRIAGE_LOCAL,
+  TRIVIAL_DUNDER:          TRIAGE_LOCAL,
+}
+
+# Descriptions of the dunder methods whose one-line implementations are documented locally
+DUNDER_DESCRIPTIONS = {
+  "__repr__":     "Returns the developer-facing string representation of the object.",
+  "__str__":      "Returns the string representation of the object.",
+  "__format__":   "Formats the object according to a format specification.",
+  "__hash__":     "Returns the hash of the object.",
+  "__bool__":     "Returns whether the object is truthy.",
+  "__len__":      "Returns the number of items in the object.",
+  "__iter__":     "Returns an iterator over the items of the object.",
+  "__next__":     "Returns the next item of the iterator.",
+  "__reversed__": "Returns a reverse iterator over the items of the object.",
+  "__contains__": "Checks whether the object contains an item.",
+  "__getitem__":  "Returns the item for a key.",
+  "__setitem__":  "Sets the item for a key.",
+  "__delitem__":  "Deletes the item for a key.",
+  "__eq__":       "Checks whether the object is equal to another.",
+  "__ne__":       "Checks whether the object is not equal to another.",
+  "__lt__":       "Checks whether the object is less than another.",
+  "__le__":       "Checks whether the object is less than or equal to another.",
+  "__gt__":       "Checks whether the object is greater than another.",
+  "__ge__":       "Checks whether the object is greater than or equal to another.",
+  "__enter__":    "Enters the runtime context of the object.",
+  "__exit__":     "Exits the runtime context of the object.",
+  "__aenter__":   "Enters the asynchronous runtime context of the object.",
+  "__aexit__":    "Exits the asynchronous runtime context of the object.",
+  "__del__":      "Finalizes the object before it is destroyed.",
+}
+
+# Parameters which are bound implicitly, and so are left out of docstrings
+IMPLICIT_PARAMETERS = {"self", "cls"}
+
+
+def _code_for_node(node: libcst.CSTNode) -> str:
+  return libcst.Module(body=[]).code_for_node(node)
+
+
+def _get_decorator_names(node: libcst.FunctionDef | libcst.ClassDef) -> List[str]:
+  # Decorators are matched by their last name, e.g. `typing.overload` and `overload` alike, with or without a call
+  names = []
+  for decorator in node.decorators:
+    expression = decorator.decorator
+    if isinstance(expression, libcst.Call):
+      expression = expression.func
+    if isinstance(expression, libcst.Attribute):
+      names.append(expression.attr.value)
+    elif isinstance(expression, libcst.Name):
+      names.append(expression.value)
+  return names
+
+
+def _get_small_statements(node: libcst.FunctionDef | libcst.ClassDef) -> Optional[List[libcst.BaseSmallStatement]]:
+  # Returns the statements of a body made of simple statements only, or `None` if it has any compound statement
+  if isinstance(node.body, libcst.SimpleStatementSuite):
+    return list(node.body.body)
+
+  small_statements = []
+  for statement in node.body.body:
+    if not isinstance(statement, libcst.SimpleStatementLine):
+      return None
+    small_statements.extend(statement.body)
+  return small_statements
+
+
+def _is_placeholder_statement(statement: libcst.BaseSmallStatement) -> bool:
+  # `pass`, `...` and `raise NotImplementedError` all stand in for a body that isn't there
+  if isinstance(statement, libcst.Pass):
+    return True
+  if isinstance(statement, libcst.Expr) and isinstance(statement.value, libcst.Ellipsis):
+    return True
+  if isinstance(statement, libcst.Raise) and statement.exc is not None:
+    exception = statement.exc.func if isinstance(statement.exc, libcst.Call) else statement.exc
+    return isinstance(exception, libcst.Name) and exception.value == "NotImplementedError"
+  return False
+
+
+def _is_placeholder_body(node: libcst.FunctionDef | libcst.ClassDef) -> bool:
+  small_statements = _get_small_statements(node)
+  return bool(small_statements) and all(_is_placeholder_statement(statement) for statement in small_statements)
+
+
+def _get_returned_attribute(node: libcst.FunctionDef) -> Optional[str]:
+  # Getters take nothing but `self`, and do nothing but return one of its attributes
+  parameters = node.params
+  if [param.name.value for param in parameters.params] != ["self"] or parameters.posonly_params or parameters.kwonly_params \
+    or not isinstance(parameters.star_arg, libcst.MaybeSentinel) or parameters.star_kwarg is not None:
+    return None
+
+  small_statements = _get_small_statements(node)
+  if small_statements is None or len(small_statements) != 1 or not isinstance(small_statements[0], libcst.Return):
+    return None
+
+  value = small_statements[0].value
+  if isinstance(value, libcst.Attribute) and isinstance(value.value, libcst.Name) and value.value.value == "self":
+    return value.attr.value
+  return None
+
+
+def classify_trivial_definition(node: libcst.FunctionDef | libcst.ClassDef) -> Optional[str]:
+  """
+  Returns the kind of trivial definition a node is (see `TRIVIAL_KINDS`),
+  or `None` if it is not trivial, i.e. if it is worth asking a model about.
+  """
+  assert isinstance(node, (libcst.FunctionDef | libcst.ClassDef)), "Expected node to be a function or a class definition"
+
+  if isinstance(node, libcst.ClassDef):
+    return TRIVIAL_EMPTY_CLASS if _is_placeholder_body(node) else None
+
+  decorator_names = _get_decorator_names(node)
+  if "overload" in decorator_names:
+    return TRIVIAL_OVERLOAD
+  if "abstractmethod" in decorator_names and _is_placeholder_body(node):
+    return TRIVIAL_ABSTRACT_METHOD
+  if _get_returned_attribute(node) is not None:
+    return TRIVIAL_GETTER
+
+  # Only one-line implementations of well-known dunder methods, as anything longer may well do something surprising
+  small_statements = _get_small_statements(node)
+  if node.name.value in DUNDER_DESCRIPTIONS and small_statements is not None and len(small_statements) == 1:
+    return TRIVIAL_DUNDER
+
+  return None
+
+
+def _humanize(name: str) -> str:
+  # E.g. `_user_id` becomes "user id"
+  return " ".join(name.strip("_").split("_")) or name
+
+
+def _get_parameters(node: libcst.FunctionDef) -> List[FunctionParameterData]:
+  parameters = []
+  for param in [*node.params.posonly_params, *node.params.params, *node.params.kwonly_params]:
+    if param.name.value in IMPLICIT_PARAMETERS:
+      continue
+    parameters.append(FunctionParameterData(
+      name=param.name.value,
+      description=f"The {_humanize(param.name.value)}.",
+      assumed_type=_code_for_node(param.annotation.annotation) if param.annotation is not None else "",
+    ))
+  return parameters
+
+
+def _get_return_values(
+  node: libcst.FunctionDef,
+  description: str,
+) -> List[FunctionReturnData]:
+  # Only annotated return values are documented, as there is nothing to go on otherwise
+  if node.returns is None:
+    return []
+  assumed_type = _code_for_node(node.returns.annotation)
+  if assumed_type == "None":
+    return []
+  return [FunctionReturnData(description=description, assumed_type=assumed_type)]
+
+
+def build_local_docstring(
+  node: libcst.FunctionDef | libcst.ClassDef,
+  kind: str,
+) -> FunctionDocstringData | ClassDocstringData:
+  """
+  Builds the docstring of a trivial definition from its name, signature,
+  annotations and decorators alone, without asking a model.
+  """
+  assert kind in TRIVIAL_KINDS, f"Unsupported kind of trivial definition: {kind}"
+
+  name = node.name.value
+
+  if kind == TRIVIAL_EMPTY_CLASS:
+    bases = [_code_for_node(base.value) for base in node.bases]
+    if not bases:
+      return ClassDocstringData(description="Marker class without any behavior of its own.")
+    return ClassDocstringData(description=f"Specializes {', '.join(f'`{base}`' for base in bases)} without adding any behavior of its own.")
+
+  if kind == TRIVIAL_GETTER:
+    attribute = _humanize(_get_returned_attribute(node))
+    return FunctionDocstringData(
+      description=f"Returns the {attribute}.",
+      return_values=_get_return_values(node, f"The {attribute}."),
+    )
+
+  if kind == TRIVIAL_OVERLOAD:
+    description = f"Overload of `{name}`."
+  elif kind == TRIVIAL_ABSTRACT_METHOD:
+    description = f"Abstract method `{name}`, which subclasses must implement."
+  else:
+    description = DUNDER_DESCRIPTIONS[name]
+
+  return FunctionDocstringData(
+    description=description,
+    parameters=_get_parameters(node),
+    return_values=_get_return_values(node, "The result."),
+  )
+
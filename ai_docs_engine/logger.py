@@ -34,14 +34,9 @@ class CustomFormatter(logging.Formatter):
     return super().format(record)
 
 
-# Configure logging
-logging.basicConfig(
-  level=logging.INFO,
-  handlers=[],
-)
-
-# Create logger instance
+# Create logger instance; only the package's own logger is configured, leaving the root logger to the application
 logger = logging.getLogger("ai_docs_engine")
+logger.setLevel(logging.INFO)
 
 # Create stream handler and set formatter
 ch = logging.StreamHandler()
@@ -0,0 +1,103 @@
+from typing import Dict, Optional
+import threading
+import json
+import os
+
+from ai_docs_engine.utilities import write_file_atomically
+from ai_docs_engine.logger import logger
+
+
+# Bump this whenever the layout of the manifest changes
+MANIFEST_FORMAT_VERSION = 1
+
+
+class Manifest:
+  """
+  Persisted record of the state each source file and definition was left in
+  by the previous run, which lets unchanged files and definitions be skipped.
+
+  Maps each file path to the hash of its content, and each definition's
+  qualified name to the hash of its source code. A file hash of `None`
+  means the file must be processed again (e.g. because some of its
+  definitions failed), while its definition hashes are still trusted. With
+  a path of `None`, the manifest is only kept in memory, e.g. in watch mode.
+  """
+
+  def __init__(
+    self,
+    path: Optional[str],
+    fingerprint: str,
+  ) -> None:
+    assert path is None or isinstance(path, str), "Expected path to be a string or `None`"
+    assert isinstance(fingerprint, str), "Expected fingerprint to be a string"
+
+    self._path = path
+    self._fingerprint = fingerprint
+    self._lock = threading.Lock()
+    self._files: Dict[str, dict] = self._load()
+
+
+  def _load(self) -> Dict[str, dict]:
+    if self._path is None or not os.path.exists(self._path):
+      return {}
+
+    try:
+      with open(self._path) as file:
+        data = json.load(file)
+    except (OSError, ValueError) as exception:
+      logger.warning(f"Ignoring unreadable manifest `{self._path}` ({exception = })")
+      return {}
+
+    # Entries recorded with different settings can't be trusted
+    if data.get("version") != MANIFEST_FORMAT_VERSION or data.get("fingerprint") != self._fingerprint:
+      logger.info(f"Ignoring manifest `{self._path}` written with different settings")
+      return {}
+
+    return data.get("files", {})
+
+
+  def save(self) -> None:
+    if self._path is None:
+      return
+
+    with self._lock:
+      data = {
+        "version":     MANIFEST_FORMAT_VERSION,
+        "fingerprint": self._fingerprint,
+        "files":       self._files,
+      }
+
+    # Write atomically, so that an interrupted run can't leave a truncated manifest behind
+    os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+    write_file_atomically(self._path, json.dumps(data, indent=1, sort_keys=True))
+
+
+  def get_content_hash(
+    self,
+    file_path: str,
+  ) -> Optional[str]:
+    with self._lock:
+      entry = self._files.get(os.path.abspath(file_path))
+    return entry["hash"] if entry is not None else None
+
+
+  def get_definition_hashes(
+    self,
+    file_path: str,
+  ) -> Dict[str, str]:
+    with self._lock:
+      entry = self._files.get(os.path.abspath(file_path))
+    return dict(entry["definitions"]) if entry is not None else {}
+
+
+  def update_file(
+    self,
+    file_path: str,
+    content_hash: Optional[str],
+    definition_hashes: Dict[str, str],
+  ) -> None:
+    with self._lock:
+      self._files[os.path.abspath(file_path)] = {
+        "hash":        content_hash,
+        "definitions": dict(definition_hashes),
+      }
@@ -0,0 +1,250 @@
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import contextlib
+import threading
+import bisect
+import json
+import time
+
+from ai_docs_engine.utilities import write_file_atomically
+
+
+# Prefix of metric names in Prometheus textfiles
+PROMETHEUS_PREFIX = "ai_docs_engine_"
+
+# Upper bounds of histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Upper bounds of histogram buckets for counts of things, e.g. chunks per definition
+COUNT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+# Stages of processing a run, whose durations are recorded in the `stage_seconds` histogram
+STAGE_DISCOVERY = "discovery"
+STAGE_PLANNING = "planning"
+STAGE_PRESCAN = "prescan"
+STAGE_PARSE = "parse"
+STAGE_METADATA_RESOLVE = "metadata_resolve"
+STAGE_COLLECT = "collect"
+STAGE_PROMPT_BUILD = "prompt_build"
+STAGE_LLM_WAIT = "llm_wait"
+STAGE_RESPONSE_VALIDATION = "response_validation"
+STAGE_DOCSTRING_BUILD = "docstring_build"
+STAGE_WRITE = "write"
+
+
+# Labels are stored as a sorted tuple of pairs, so that they can be used as dictionary keys
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _make_labels(labels: Dict[str, object]) -> Labels:
+  return tuple(sorted((key, str(value)) for (key, value) in labels.items()))
+
+
+class _Histogram:
+  def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.count = 0
+    self.sum = 0.0
+
+
+  def observe(self, value: float) -> None:
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.count += 1
+    self.sum += value
+
+
+  def to_dict(self) -> dict:
+    return {"count": self.count, "sum": self.sum, "buckets": list(self.buckets), "bucket_counts": list(self.counts)}
+
+
+def _to_entries(
+  metrics: Dict[str, Dict[Labels, object]],
+  to_fields: Callable[[object], dict],
+) -> List[dict]:
+  # Snapshots hold one entry per name and set of labels, with the labels as an object, so that they can be queried as is
+  return [
+    {"name": name, "labels": dict(labels), **to_fields(value)}
+    for (name, values) in sorted(metrics.items())
+    for (labels, value) in sorted(values.items(), key=lambda item: item[0])
+  ]
+
+
+class MetricsRegistry:
+  """
+  Thread-safe registry of counters, gauges and histograms, each of which is keyed
+  by a name and a set of labels (e.g. `cache_lookups{result=hit}`).
+  Snapshots are plain JSON-serializable dictionaries, which can be merged
+  into another registry, e.g. to collect metrics from worker processes.
+  """
+
+  def __init__(self) -> None:
+    self._lock = threading.Lock()
+    self._counters: Dict[str, Dict[Labels, float]] = {}
+    self._gauges: Dict[str, Dict[Labels, float]] = {}
+    self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+
+
+  def reset(self) -> None:
+    with self._lock:
+      self._counters.clear()
+      self._gauges.clear()
+      self._histograms.clear()
+
+
+  def increment(
+    self,
+    name: str,
+    amount: float = 1,
+    **labels,
+  ) -> None:
+    key = _make_labels(labels)
+    with self._lock:
+      counter = self._counters.setdefault(name, {})
+      counter[key] = counter.get(key, 0) + amount
+
+
+  def set_gauge(
+    self,
+    name: str,
+    value: float,
+    **labels,
+  ) -> None:
+    with self._lock:
+      self._gauges.setdefault(name, {})[_make_labels(labels)] = value
+
+
+  def observe(
+    self,
+    name: str,
+    value: float,
+    buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    **labels,
+  ) -> None:
+    key = _make_labels(labels)
+    with self._lock:
+      histogram = self._histograms.setdefault(name, {})
+      if key not in histogram:
+        histogram[key] = _Histogram(buckets)
+      histogram[key].observe(value)
+
+
+  @contextlib.contextmanager
+  def time_stage(self, stage: str) -> Iterator[None]:
+    """
+    Records how long the body of the `with` statement took in the
+    `stage_seconds` histogram. May also be used as a function decorator.
+    """
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe("stage_seconds", time.perf_counter() - start, stage=stage)
+
+
+  def get_counter(
+    self,
+    name: str,
+    **labels,
+  ) -> float:
+    with self._lock:
+      return self._counters.get(name, {}).get(_make_labels(labels), 0)
+
+
+  def get_counter_total(
+    self,
+    name: str,
+  ) -> float:
+    # Sum of a counter over all of its labels
+    with self._lock:
+      return sum(self._counters.get(name, {}).values())
+
+
+  def get_histogram_sum(
+    self,
+    name: str,
+    **labels,
+  ) -> float:
+    with self._lock:
+      histogram = self._histograms.get(name, {}).get(_make_labels(labels))
+      return histogram.sum if histogram is not None else 0.0
+
+
+  def snapshot(self) -> dict:
+    with self._lock:
+      return {
+        "counters":   _to_entries(self._counters, lambda value: {"value": value}),
+        "gauges":     _to_entries(self._gauges, lambda value: {"value": value}),
+        "histograms": _to_entries(self._histograms, lambda value: value.to_dict()),
+      }
+
+
+  def merge(self, snapshot: dict) -> None:
+    with self._lock:
+      for entry in snapshot.get("counters", []):
+        counter = self._counters.setdefault(entry["name"], {})
+        key = _make_labels(entry["labels"])
+        counter[key] = counter.get(key, 0) + entry["value"]
+
+      # Gauges are only ever set in one place, so the merged value simply wins
+      for entry in snapshot.get("gauges", []):
+        self._gauges.setdefault(entry["name"], {})[_make_labels(entry["labels"])] = entry["value"]
+
+      for entry in snapshot.get("histograms", []):
+        histogram = self._histograms.setdefault(entry["name"], {})
+        key = _make_labels(entry["labels"])
+        if key not in histogram:
+          histogram[key] = _Histogram(tuple(entry["buckets"]))
+        histogram[key].counts = [a + b for (a, b) in zip(histogram[key].counts, entry["bucket_counts"])]
+        histogram[key].count += entry["count"]
+        histogram[key].sum += entry["sum"]
+
+
+  def write_json(self, path: str) -> None:
+    write_file_atomically(path, json.dumps(self.snapshot(), indent=2, sort_keys=True))
+
+
+  def to_prometheus(self) -> str:
+    """Renders all metrics in the Prometheus text exposition format."""
+    def format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+      pairs = [*labels, *([extra] if extra else [])]
+      if not pairs:
+        return ""
+      escape = lambda value: value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+      return "{" + ",".join(f'{key}="{escape(value)}"' for (key, value) in pairs) + "}"
+
+    lines = []
+    with self._lock:
+      for (name, counter) in sorted(self._counters.items()):
+        metric_name = f"{PROMETHEUS_PREFIX}{name}_total"
+        lines.append(f"# TYPE {metric_name} counter")
+        for (labels, value) in sorted(counter.items()):
+          lines.append(f"{metric_name}{format_labels(labels)} {value}")
+
+      for (name, gauge) in sorted(self._gauges.items()):
+        metric_name = f"{PROMETHEUS_PREFIX}{name}"
+        lines.append(f"# TYPE {metric_name} gauge")
+        for (labels, value) in sorted(gauge.items()):
+          lines.append(f"{metric_name}{format_labels(labels)} {value}")
+
+      for (name, histogram) in sorted(self._histograms.items()):
+        metric_name = f"{PROMETHEUS_PREFIX}{name}"
+        lines.append(f"# TYPE {metric_name} histogram")
+        for (labels, value) in sorted(histogram.items()):
+          # Bucket counts are cumulative in Prometheus
+          cumulative_count = 0
+          for (bound, count) in zip([*value.buckets, "+Inf"], value.counts):
+            cumulative_count += count
+            lines.append(f"{metric_name}_bucket{format_labels(labels, ('le', str(bound)))} {cumulative_count}")
+          lines.append(f"{metric_name}_sum{format_labels(labels)} {value.sum}")
+          lines.append(f"{metric_name}_count{format_labels(labels)} {value.count}")
+
+    return "\n".join(lines) + "\n"
+
+
+  def write_prometheus_textfile(self, path: str) -> None:
+    # Written atomically, as the node exporter's textfile collector may read it at any time
+    write_file_atomically(path, self.to_prometheus())
+
+
+# Metrics of the current run
+metrics = MetricsRegistry()
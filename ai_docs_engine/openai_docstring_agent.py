@@ -1,18 +1,26 @@
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from types import ModuleType
 from pydantic import Field
-import diskcache
-import openai
+import asyncio
 import json
+import sys
+import os
 
-from ai_docs_engine.agent_functions import RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_CLASS, RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_FUNCTION
-from ai_docs_engine.docstring_schema import ClassDocstringData, FunctionDocstringData
-from ai_docs_engine.errors import AIDocsEngineError, AIDocsEngineTooManyTokensError
+from ai_docs_engine.agent_functions import RESPOND_WITH_CHUNK_SUMMARY, RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_CLASS, RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_DEFINITIONS, RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_FUNCTION
+from ai_docs_engine.docstring_schema import BatchDocstringData, ChunkSummaryData, ClassDocstringData, FunctionDocstringData
+from ai_docs_engine.errors import AIDocsEngineError, AIDocsEngineRetryableError, AIDocsEngineTooManyTokensError
 from ai_docs_engine.meta import SUPPORTED_LANGUAGES
-from ai_docs_engine.utilities import ConstBaseModel, time_func
+from ai_docs_engine.utilities import ConstBaseModel, load_environment, time_func
+from ai_docs_engine.cache import hash_text, with_cache_fingerprint
+from ai_docs_engine.backend import BaseDocstringBackend, with_bulk_format
+from ai_docs_engine.metrics import STAGE_PROMPT_BUILD, STAGE_RESPONSE_VALIDATION, metrics
+from ai_docs_engine.tokens import count_message_tokens, token_usage
 from ai_docs_engine.logger import logger, col
 
-
-# Cache all OpenAI API calls to avoid paying for same call more than once
-cache = diskcache.Cache("data/cache/openai")
+# The OpenAI SDK and aiohttp are slow to import, so they are only imported once a request is made
+if TYPE_CHECKING:
+  import aiohttp
+  import openai
 
 
 class OpenAIModel(ConstBaseModel):
@@ -24,119 +32,637 @@ class OpenAIModel(ConstBaseModel):
 DEFAULT_MODEL = OpenAIModel(name="gpt-3.5-turbo-0613", tok_lim=4_096)
 EXTRA_CONTEXT_MODEL = OpenAIModel(name="gpt-3.5-turbo-16k-0613", tok_lim=16_384)
 
+# Models to route requests between, from smallest to largest context window
+MODELS = sorted([DEFAULT_MODEL, EXTRA_CONTEXT_MODEL], key=lambda model: model.tok_lim)
 
-# @cache.memoize()
-def generate_docstring(
+# Base URL of the API, unless configured otherwise
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+
+# Number of tokens to leave free in the context window for the model's response
+COMPLETION_TOKEN_RESERVE = 1_024
+
+# Number of tokens to leave free in the context window for each definition's entry in a batched response
+BATCH_COMPLETION_TOKEN_RESERVE_PER_DEFINITION = 256
+
+
+# System prompt template; `language_name` and `definition_type` are filled in per request
+SYSTEM_PROMPT_TEMPLATE = "\n".join([
+  "You are a robot who is an expert at writing docstrings for {language_name} classes and functions, mainly because you are extremely good at being concise.",
+  "Help the human write a docstring for the following {definition_type}:",
+])
+
+# Batched system prompt template; each definition in the user message is headed by its ID and type
+BATCH_SYSTEM_PROMPT_TEMPLATE = "\n".join([
+  "You are a robot who is an expert at writing docstrings for {language_name} classes and functions, mainly because you are extremely good at being concise.",
+  "Help the human write a docstring for each of the following definitions, responding with exactly one docstring per definition ID:",
+])
+
+# Chunk system prompt template; the user message is the signature of a function followed by one part of its body
+CHUNK_SYSTEM_PROMPT_TEMPLATE = "\n".join([
+  "You are a robot who is an expert at reading {language_name} code, mainly because you are extremely good at being concise.",
+  "The following function is too large to read at once, so you are only given one part of its body. Help the human summarize what this part does:",
+])
+
+
+# Agent function and type of the structured docstring data, for each type of definition
+AGENT_FUNCTION_MAP = {
+  "function": {
+    "agent_function": RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_FUNCTION,
+    "response_type":  FunctionDocstringData,
+  },
+  "class": {
+    "agent_function": RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_CLASS,
+    "response_type":  ClassDocstringData,
+  },
+}
+
+
+def _parse_retry_after(headers: dict) -> float | None:
+  try:
+    return float(headers.get("retry-after"))
+  except (TypeError, ValueError):
+    return None
+
+
+def select_model(
+  num_prompt_tokens: int,
+  num_completion_tokens: int = COMPLETION_TOKEN_RESERVE,
+) -> OpenAIModel:
+  # Pick the smallest (i.e. cheapest) model whose context window fits the prompt and its response
+  for model in MODELS:
+    if num_prompt_tokens + num_completion_tokens <= model.tok_lim:
+      return model
+
+  # Reject the request before making a network call that is bound to fail
+  raise AIDocsEngineTooManyTokensError(num_tokens=num_prompt_tokens)
+
+
+def cache_fingerprint() -> str:
+  # Anything which changes what the model is asked, or which model is asked, must be part of this
+  return hash_text(json.dumps({
+    "system_prompt":   SYSTEM_PROMPT_TEMPLATE,
+    "agent_functions": [RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_FUNCTION, RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_CLASS],
+    "models":          [model.dict() for model in MODELS],
+  }, sort_keys=True))
+
+
+def batch_cache_fingerprint() -> str:
+  return hash_text(json.dumps({
+    "system_prompt":   BATCH_SYSTEM_PROMPT_TEMPLATE,
+    "agent_functions": [RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_DEFINITIONS],
+    "models":          [model.dict() for model in MODELS],
+  }, sort_keys=True))
+
+
+class _Prompt:
+  """Messages and agent function of a request, along with the model selected for it."""
+
+  def __init__(
+    self,
+    messages: List[dict],
+    agent_function: dict,
+    num_prompt_tokens: int,
+    model: str,
+  ) -> None:
+    self.messages = messages
+    self.agent_function = agent_function
+    self.num_prompt_tokens = num_prompt_tokens
+    self.model = model
+
+
+@metrics.time_stage(STAGE_PROMPT_BUILD)
+def _build_prompt(
   language: str,
   definition: str,
   definition_type: str,
-  temperature: float,
+) -> _Prompt:
+  # Validate definition type
+  assert definition_type in AGENT_FUNCTION_MAP, f"Unsupported definition type: {definition_type}"
+
+  # Get preferred name stylization for language
+  language_name = SUPPORTED_LANGUAGES[language].stylized_name
+
+  # Build system prompt
+  system_prompt = SYSTEM_PROMPT_TEMPLATE.format(
+    language_name=language_name,
+    definition_type=definition_type,
+  )
+
+  # Format messages
+  messages = [
+    { "role": "system", "content": system_prompt, },
+    { "role": "user", "content": definition, },
+  ]
+
+  # Select agent function to use
+  agent_function = AGENT_FUNCTION_MAP[definition_type]["agent_function"]
+
+  # Count total tokens in `messages`, including the agent function schema
+  num_prompt_tokens = count_message_tokens(messages=messages, functions=[agent_function])
+
+  # Select model based on number of tokens
+  model = select_model(num_prompt_tokens).name
+
+  return _Prompt(messages=messages, agent_function=agent_function, num_prompt_tokens=num_prompt_tokens, model=model)
+
+
+@metrics.time_stage(STAGE_RESPONSE_VALIDATION)
+def _parse_docstring_data(
+  arguments: str,
+  definition: str,
+  definition_type: str,
 ) -> FunctionDocstringData | ClassDocstringData:
-  """
-  Generates a docstring for a given class or function definition using OpenAI's API.
-  
-  Args:
-    language: The programming language of the input definition
-    definition: The definition to generate a docstring for (e.g. "def foo(): ..." or "class Foo: ...")
-    definition_type: The type of definition (e.g. "function", "class")
-    temperature: The temperature to use for the OpenAI API
+  # Get the type of the structured docstring data to return
+  response_type = AGENT_FUNCTION_MAP[definition_type]["response_type"]
 
-  Returns:
-    The parsed, structured, and validated docstring data
-  """
+  # Return the parsed, structured, validated docstring data
+  try:
+    return response_type.parse_raw(arguments)
+  except Exception as exception:
+    note = (
+      "Failed to parse OpenAI response.\n"
+      f"{arguments = }\n"
+      f"{definition = }\n"
+      f"{definition_type = }"
+    )
+    logger.error(note)
+    exception.add_note(note)
+    raise exception
 
-  # Define agent function map
-  agent_function_map = {
-    "function": {
-      "agent_function": RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_FUNCTION,
-      "response_type":  FunctionDocstringData,
-    },
-    "class": {
-      "agent_function": RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_CLASS,
-      "response_type":  ClassDocstringData,
-    },
-  }
 
-  # Validate definition type
-  assert definition_type in agent_function_map, f"Unsupported definition type: {definition_type}"
+@metrics.time_stage(STAGE_PROMPT_BUILD)
+def _build_chunk_prompt(
+  language: str,
+  definition: str,
+) -> _Prompt:
+  # Get preferred name stylization for language
+  language_name = SUPPORTED_LANGUAGES[language].stylized_name
+
+  # Format messages
+  messages = [
+    { "role": "system", "content": CHUNK_SYSTEM_PROMPT_TEMPLATE.format(language_name=language_name), },
+    { "role": "user", "content": definition, },
+  ]
+
+  # Count total tokens in `messages`, including the agent function schema, and select model based on them
+  agent_function = RESPOND_WITH_CHUNK_SUMMARY
+  num_prompt_tokens = count_message_tokens(messages=messages, functions=[agent_function])
+  model = select_model(num_prompt_tokens).name
+
+  return _Prompt(messages=messages, agent_function=agent_function, num_prompt_tokens=num_prompt_tokens, model=model)
+
+
+@metrics.time_stage(STAGE_RESPONSE_VALIDATION)
+def _parse_chunk_summary(
+  arguments: str,
+  definition: str,
+) -> str:
+  try:
+    return ChunkSummaryData.parse_raw(arguments).summary
+  except Exception as exception:
+    note = (
+      "Failed to parse OpenAI response.\n"
+      f"{arguments = }\n"
+      f"{definition = }"
+    )
+    logger.error(note)
+    exception.add_note(note)
+    raise exception
+
+
+@metrics.time_stage(STAGE_PROMPT_BUILD)
+def _build_batch_prompt(
+  language: str,
+  definitions: Dict[str, Tuple[str, str]],
+) -> _Prompt:
+  # Validate definition types
+  for (definition, definition_type) in definitions.values():
+    assert definition_type in AGENT_FUNCTION_MAP, f"Unsupported definition type: {definition_type}"
 
   # Get preferred name stylization for language
   language_name = SUPPORTED_LANGUAGES[language].stylized_name
 
   # Build system prompt
-  system_prompt = "\n".join([
-    f"You are a robot who is an expert at writing docstrings for {language_name} classes and functions, mainly because you are extremely good at being concise.",
-    f"Help the human write a docstring for the following {definition_type}:",
-  ])
+  system_prompt = BATCH_SYSTEM_PROMPT_TEMPLATE.format(
+    language_name=language_name,
+  )
 
-  # Format messages
+  # Format messages, heading each definition with its ID and type
   messages = [
     { "role": "system", "content": system_prompt, },
-    { "role": "user", "content": definition, },
+    { "role": "user", "content": "\n\n".join(
+      f"ID: `{definition_id}` ({definition_type})\n{definition}"
+      for (definition_id, (definition, definition_type)) in definitions.items()
+    ), },
   ]
 
-  # TODO: count total tokens in `messages`
-  # ...
+  # Count total tokens in `messages`, including the agent function schema
+  agent_function = RESPOND_WITH_STRUCTURED_DOCSTRING_DATA_FOR_DEFINITIONS
+  num_prompt_tokens = count_message_tokens(messages=messages, functions=[agent_function])
 
-  # TODO: select model here based on number of tokens; not yet clear what best way to measure function call tokens is
-  model = DEFAULT_MODEL.name # EXTRA_CONTEXT_MODEL.name
-  
-  # Select agent function to use
-  agent_function = agent_function_map[definition_type]["agent_function"]
+  # Select model based on number of tokens, leaving room for every definition's response
+  model = select_model(
+    num_prompt_tokens,
+    num_completion_tokens=BATCH_COMPLETION_TOKEN_RESERVE_PER_DEFINITION * len(definitions),
+  ).name
+
+  return _Prompt(messages=messages, agent_function=agent_function, num_prompt_tokens=num_prompt_tokens, model=model)
+
+
+@metrics.time_stage(STAGE_RESPONSE_VALIDATION)
+def _parse_batch_docstring_data(
+  arguments: str,
+  definitions: Dict[str, Tuple[str, str]],
+) -> Dict[str, FunctionDocstringData | ClassDocstringData]:
+  # Parse and validate the structured docstring data
+  try:
+    batch_data = BatchDocstringData.parse_raw(arguments)
+  except Exception as exception:
+    note = (
+      "Failed to parse OpenAI response.\n"
+      f"{arguments = }\n"
+      f"{definitions = }"
+    )
+    logger.error(note)
+    exception.add_note(note)
+    raise exception
+
+  # Scatter the docstrings back to their definitions, ignoring any IDs the model made up
+  docstrings = {}
+  for item in batch_data.docstrings:
+    if item.definition_id not in definitions:
+      logger.warning(f"Ignoring docstring for unknown definition ID `{item.definition_id}`")
+      continue
+
+    (_, definition_type) = definitions[item.definition_id]
+    if definition_type == "class":
+      docstrings[item.definition_id] = ClassDocstringData(description=item.description)
+    else:
+      docstrings[item.definition_id] = FunctionDocstringData(**item.dict(exclude={"definition_id"}))
+
+  return docstrings
+
+
+def _build_payload(
+  prompt: _Prompt,
+  temperature: float,
+) -> dict:
+  # Body of a request to the chat completions endpoint
+  return {
+    "model":         prompt.model,
+    "messages":      prompt.messages,
+    "temperature":   temperature,
+    "functions":     [prompt.agent_function],
+    "function_call": {"name": prompt.agent_function["name"]},
+  }
+
+
+def _extract_function_call_arguments(
+  response: dict,
+  prompt: _Prompt,
+  record_usage: bool = True,
+) -> str:
+  # Record token usage, preferring the exact numbers reported by the API over our estimate
+  if record_usage:
+    usage = response.get("usage") or {}
+    token_usage.record(
+      model=prompt.model,
+      prompt_tokens=usage.get("prompt_tokens", prompt.num_prompt_tokens),
+      completion_tokens=usage.get("completion_tokens", 0),
+    )
+
+  # If the message is not a function call, then the model failed to generate the docstring
+  message = response["choices"][0]["message"]
+  if "function_call" not in message:
+    logger.error(f"Received unexpected message: {message}")
+    raise AIDocsEngineError(f"Model {prompt.model} failed to generate docstring (message did not include a `function_call`, but instead was: `{message}`)")
   
+  # Extract function call
+  function_call = message["function_call"]
+
+  # If the function call is not one of the expected function calls, then the model has failed to generate the docstring
+  assert function_call["name"] == prompt.agent_function["name"], f"Unexpected function call name received: {function_call['name']}"
+
+  return function_call["arguments"]
+
+
+def _import_openai() -> ModuleType:
+  # The SDK reads `OPENAI_API_KEY` when it is imported, so the `.env` file is loaded first; if the application imported it
+  # beforehand, then the key is filled in from the environment unless it was configured explicitly
+  load_environment()
+  import openai
+  if openai.api_key is None:
+    openai.api_key = os.environ.get("OPENAI_API_KEY")
+  return openai
+
+
+def _get_api_settings() -> Tuple[str, str]:
+  # Returns the base URL of the API and the API key; the settings of the SDK are only used if the application already
+  # imported (and so may have configured) it, to avoid importing it just for them
+  load_environment()
+  openai = sys.modules.get("openai")
+  if openai is not None:
+    return (openai.api_base, openai.api_key or os.environ.get("OPENAI_API_KEY", ""))
+  return (os.environ.get("OPENAI_API_BASE", DEFAULT_API_BASE), os.environ.get("OPENAI_API_KEY", ""))
+
+
+def _request_function_call(
+  prompt: _Prompt,
+  temperature: float,
+) -> str:
+  openai = _import_openai()
+
   # Log API call
   logger.info(
-    f"Querying model `{col(model, 'yellow')}`"
+    f"Querying model `{col(prompt.model, 'yellow')}` (~{prompt.num_prompt_tokens} prompt tokens)"
   )
 
   # Generate docstring with OpenAI API
   # NOTE: an exception will be raised if the model's token limit is exceeded
   try:
     response = openai.ChatCompletion.create(
-      model=model,
-      messages=messages,
+      model=prompt.model,
+      messages=prompt.messages,
       temperature=temperature,
       functions=[
-        agent_function,
+        prompt.agent_function,
       ],
       function_call={
-        "name": agent_function["name"],
+        "name": prompt.agent_function["name"],
       },
     )
 
-  # If the token limit was exceeded, then raise a custom error
+  # If the token limit was exceeded despite our estimate, then raise a custom error
   except openai.InvalidRequestError as exception:
     if exception.code == "context_length_exceeded":
-      raise AIDocsEngineTooManyTokensError() from exception
+      raise AIDocsEngineTooManyTokensError(num_tokens=prompt.num_prompt_tokens) from exception
     
     # Otherwise, raise the original exception
     raise exception
 
-  # If the message is not a function call, then the model failed to generate the docstring
-  message = response["choices"][0]["message"]
-  if "function_call" not in message:
-    logger.error(f"Received unexpected message: {message}")
-    raise AIDocsEngineError(f"Model {model} failed to generate docstring (message did not include a `function_call`, but instead was: `{message}`)")
+  # If the failure is transient, then let the request scheduler retry it
+  except (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+  ) as exception:
+    raise AIDocsEngineRetryableError(
+      str(exception),
+      status_code=exception.http_status,
+      retry_after=_parse_retry_after(exception.headers),
+      overload=isinstance(exception, openai.error.Timeout),
+    ) from exception
+
+  return _extract_function_call_arguments(response, prompt)
+
+
+def render_request(
+  language: str,
+  definition: str,
+  definition_type: str,
+  temperature: float,
+) -> dict:
+  # Requests are rendered in the format of OpenAI's batch API
+  prompt = _build_prompt(language=language, definition=definition, definition_type=definition_type)
+  return {
+    "method": "POST",
+    "url":    "/v1/chat/completions",
+    "body":   _build_payload(prompt, temperature),
+  }
+
+
+def parse_response(
+  response: dict,
+  language: str,
+  definition: str,
+  definition_type: str,
+) -> FunctionDocstringData | ClassDocstringData:
+  # Imported responses were paid for by the offline run, so they don't count towards this run's token usage
+  prompt = _build_prompt(language=language, definition=definition, definition_type=definition_type)
+  arguments = _extract_function_call_arguments(response, prompt, record_usage=False)
+  return _parse_docstring_data(arguments=arguments, definition=definition, definition_type=definition_type)
+
+
+@with_cache_fingerprint(cache_fingerprint)
+@with_bulk_format(render_request, parse_response)
+def generate_docstring(
+  language: str,
+  definition: str,
+  definition_type: str,
+  temperature: float,
+) -> FunctionDocstringData | ClassDocstringData:
+  """
+  Generates a docstring for a given class or function definition using OpenAI's API.
   
-  # Extract function call
-  function_call = message["function_call"]
+  Args:
+    language: The programming language of the input definition
+    definition: The definition to generate a docstring for (e.g. "def foo(): ..." or "class Foo: ...")
+    definition_type: The type of definition (e.g. "function", "class")
+    temperature: The temperature to use for the OpenAI API
 
-  # If the function call is not one of the expected function calls, then the model has failed to generate the docstring
-  assert function_call["name"] == agent_function["name"], f"Unexpected function call name received: {function_call['name']}"
+  Returns:
+    The parsed, structured, and validated docstring data
+  """
+  prompt = _build_prompt(language=language, definition=definition, definition_type=definition_type)
+  arguments = _request_function_call(prompt=prompt, temperature=temperature)
+  return _parse_docstring_data(arguments=arguments, definition=definition, definition_type=definition_type)
 
-  # Get the type of the structured docstring data to return
-  response_type = agent_function_map[definition_type]["response_type"]
 
-  # Return the parsed, structured, validated docstring data
-  try:
-    return response_type.parse_raw(function_call["arguments"])
-  except Exception as exception:
-    note = (
-      "Failed to parse OpenAI response.\n"
-      f"{response = }\n"
-      f"{definition = }\n"
-      f"{definition_type = }"
+@with_cache_fingerprint(batch_cache_fingerprint)
+def generate_docstrings(
+  language: str,
+  definitions: Dict[str, Tuple[str, str]],
+  temperature: float,
+) -> Dict[str, FunctionDocstringData | ClassDocstringData]:
+  """
+  Generates docstrings for several class or function definitions in a single
+  request to OpenAI's API, sharing one system prompt and agent function
+  schema between all of them.
+
+  Args:
+    language: The programming language of the input definitions
+    definitions: The definitions to generate docstrings for, as `(definition, definition_type)` keyed by definition ID
+    temperature: The temperature to use for the OpenAI API
+
+  Returns:
+    The parsed, structured, and validated docstring data keyed by definition ID; definitions the model skipped are missing
+  """
+  prompt = _build_batch_prompt(language=language, definitions=definitions)
+  arguments = _request_function_call(prompt=prompt, temperature=temperature)
+  return _parse_batch_docstring_data(arguments=arguments, definitions=definitions)
+
+
+class OpenAIDocstringBackend(BaseDocstringBackend):
+  """
+  Asynchronous backend for OpenAI's API, or any API compatible with it. All
+  requests from an event loop share one pool of keep-alive HTTP connections,
+  so that requests don't pay for a new connection and TLS handshake each.
+
+  Args:
+    api_key: The API key to use; defaults to `openai.api_key` if the SDK was imported, then the `OPENAI_API_KEY` environment variable
+    api_base: The base URL of the API; defaults to `openai.api_base` if the SDK was imported, then the `OPENAI_API_BASE` environment variable
+    batching: Whether to document several small definitions per request, see `generate_docstrings`
+    max_connections: The maximum number of pooled connections
+    timeout: The timeout in seconds for each request
+  """
+
+  def __init__(
+    self,
+    api_key: Optional[str] = None,
+    api_base: Optional[str] = None,
+    batching: bool = True,
+    max_connections: int = 256,
+    timeout: float = 600.0,
+  ) -> None:
+    self._api_key = api_key
+    self._api_base = api_base
+    self._batching = batching
+    self._max_connections = max_connections
+    self._timeout = timeout
+
+    # Connection pools are bound to an event loop, so one is created lazily for each loop the backend is used from
+    self._session: Optional["aiohttp.ClientSession"] = None
+    self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+  def __getstate__(self) -> dict:
+    # Connection pools never cross a process boundary
+    return {**self.__dict__, "_session": None, "_session_loop": None}
+
+
+  def _get_session(self) -> "aiohttp.ClientSession":
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    if self._session is None or self._session.closed or self._session_loop is not loop:
+      self._session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=self._max_connections, keepalive_timeout=60),
+        timeout=aiohttp.ClientTimeout(total=self._timeout),
+      )
+      self._session_loop = loop
+    return self._session
+
+
+  async def _request_function_call(
+    self,
+    prompt: _Prompt,
+    temperature: float,
+  ) -> str:
+    # Log API call
+    logger.info(
+      f"Querying model `{col(prompt.model, 'yellow')}` (~{prompt.num_prompt_tokens} prompt tokens)"
     )
-    logger.error(note)
-    exception.add_note(note)
-    raise exception
+
+    import aiohttp
+
+    (default_api_base, default_api_key) = _get_api_settings()
+    api_base = (self._api_base or default_api_base).rstrip("/")
+    api_key = self._api_key or default_api_key
+    payload = _build_payload(prompt, temperature)
+
+    # Transport failures are transient, so let the request scheduler retry them
+    try:
+      async with self._get_session().post(
+        f"{api_base}/chat/completions",
+        json=payload,
+        headers={"Authorization": f"Bearer {api_key}"},
+      ) as http_response:
+        status = http_response.status
+        headers = dict(http_response.headers)
+        body = await http_response.text()
+    except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as exception:
+      raise AIDocsEngineRetryableError(f"Request failed ({exception!r})", overload=isinstance(exception, asyncio.TimeoutError)) from exception
+
+    if status == 200:
+      return _extract_function_call_arguments(json.loads(body), prompt)
+
+    # If the token limit was exceeded despite our estimate, then raise a custom error
+    try:
+      error = json.loads(body).get("error") or {}
+    except (ValueError, AttributeError):
+      error = {}
+    if error.get("code") == "context_length_exceeded":
+      raise AIDocsEngineTooManyTokensError(num_tokens=prompt.num_prompt_tokens)
+
+    # Raise errors with the status code attached, so that the request scheduler can tell which ones to retry
+    message = f"Request failed with status {status}: {error.get('message') or body[:200]}"
+    if status in (408, 409, 429) or status >= 500:
+      raise AIDocsEngineRetryableError(message, status_code=status, retry_after=_parse_retry_after({key.lower(): value for (key, value) in headers.items()}))
+    raise AIDocsEngineError(message)
+
+
+  async def generate(
+    self,
+    language: str,
+    definition: str,
+    definition_type: str,
+    temperature: float,
+  ) -> FunctionDocstringData | ClassDocstringData:
+    prompt = _build_prompt(language=language, definition=definition, definition_type=definition_type)
+    arguments = await self._request_function_call(prompt=prompt, temperature=temperature)
+    return _parse_docstring_data(arguments=arguments, definition=definition, definition_type=definition_type)
+
+
+  async def generate_many(
+    self,
+    language: str,
+    definitions: Dict[str, Tuple[str, str]],
+    temperature: float,
+  ) -> Dict[str, FunctionDocstringData | ClassDocstringData]:
+    prompt = _build_batch_prompt(language=language, definitions=definitions)
+    arguments = await self._request_function_call(prompt=prompt, temperature=temperature)
+    return _parse_batch_docstring_data(arguments=arguments, definitions=definitions)
+
+
+  async def summarize_chunk(
+    self,
+    language: str,
+    definition: str,
+    temperature: float,
+  ) -> str:
+    prompt = _build_chunk_prompt(language=language, definition=definition)
+    arguments = await self._request_function_call(prompt=prompt, temperature=temperature)
+    return _parse_chunk_summary(arguments=arguments, definition=definition)
+
+
+  @property
+  def supports_batching(self) -> bool:
+    return self._batching
+
+
+  def render_request(
+    self,
+    language: str,
+    definition: str,
+    definition_type: str,
+    temperature: float,
+  ) -> dict:
+    return render_request(language=language, definition=definition, definition_type=definition_type, temperature=temperature)
+
+
+  def parse_response(
+    self,
+    response: dict,
+    language: str,
+    definition: str,
+    definition_type: str,
+  ) -> FunctionDocstringData | ClassDocstringData:
+    return parse_response(response=response, language=language, definition=definition, definition_type=definition_type)
+
+
+  def cache_fingerprint(self) -> str:
+    # Same prompts, agent functions and models as the synchronous functions, so their cache entries are shared
+    fingerprint = cache_fingerprint()
+    if self._batching:
+      fingerprint += "+" + batch_cache_fingerprint()
+    return fingerprint
+
+
+  async def aclose(self) -> None:
+    if self._session is not None and self._session_loop is asyncio.get_running_loop():
+      await self._session.close()
+    self._session = None
+    self._session_loop = None
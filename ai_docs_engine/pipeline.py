@@ -0,0 +1,269 @@
+##
+## CPU-bound stages of processing a single source file: collecting the definitions which need docstrings,
+## and applying generated docstrings back to the file. Both stages are plain functions over picklable inputs
+## and outputs, so that they can run either on a thread or in a worker process.
+##
+
+from typing import Dict, List, Optional
+from libcst.metadata import MetadataWrapper
+import difflib
+import libcst
+import os
+
+from ai_docs_engine.python_docstring_inserter import PythonDefinitionCollector, PythonDefinitionVisitor, PythonDocstringInserter
+from ai_docs_engine.docstring_schema import ClassDocstringData, FunctionDocstringData
+from ai_docs_engine.docstring_request import DocstringRequest
+from ai_docs_engine.prescan import count_undocumented_definitions
+from ai_docs_engine.planning import FileEstimate, estimate_file
+from ai_docs_engine.config import AIDocsEngineConfig
+from ai_docs_engine.metrics import (
+  STAGE_DOCSTRING_BUILD,
+  STAGE_COLLECT,
+  STAGE_METADATA_RESOLVE,
+  STAGE_PARSE,
+  STAGE_PRESCAN,
+  STAGE_WRITE,
+  metrics,
+)
+from ai_docs_engine.errors import AIDocsEngineError
+from ai_docs_engine.utilities import write_file_atomically
+from ai_docs_engine.cache import hash_text
+from ai_docs_engine.logger import logger
+
+
+# Reasons for which a file is skipped without being parsed by `libcst`
+SKIP_REASON_UNCHANGED = "unchanged"
+SKIP_REASON_NOTHING_TO_DOCUMENT = "nothing to document"
+
+
+class FileWork:
+  """
+  Definitions collected from a source file, which are ready to be
+  dispatched. The parsed module is kept around for the apply stage when
+  running on a thread, but never crosses a process boundary. When collected
+  in a worker process, `metrics` holds the metrics recorded while doing so.
+  """
+
+  def __init__(
+    self,
+    file_path: str,
+    content_hash: str,
+    skip_reason: Optional[str] = None,
+    requests: Optional[List[DocstringRequest]] = None,
+    local_docstrings: Optional[Dict[str, FunctionDocstringData | ClassDocstringData]] = None,
+    definition_keys: Optional[Dict[str, str]] = None,
+    definition_hashes: Optional[Dict[str, str]] = None,
+    wrapper: Optional[MetadataWrapper] = None,
+    metrics: Optional[dict] = None,
+  ) -> None:
+    self.file_path = file_path
+    self.content_hash = content_hash
+    self.skip_reason = skip_reason
+    self.requests = requests or []
+    self.local_docstrings = local_docstrings or {}
+    self.definition_keys = definition_keys or {}
+    self.definition_hashes = definition_hashes or {}
+    self.wrapper = wrapper
+    self.metrics = metrics
+
+
+  def __getstate__(self) -> dict:
+    return {**self.__dict__, "wrapper": None}
+
+
+class FileResult:
+  """
+  Outcome of applying generated docstrings to a source file. `written_path`
+  is `None` if nothing was written, i.e. the file was unchanged or this is a
+  dry run, in which case `diff` holds the changes that would have been made.
+  When applied in a worker process, `metrics` holds the metrics recorded
+  while doing so.
+  """
+
+  def __init__(
+    self,
+    file_path: str,
+    written_path: Optional[str] = None,
+    diff: Optional[str] = None,
+    content_hash: Optional[str] = None,
+    definition_hashes: Optional[Dict[str, str]] = None,
+    metrics: Optional[dict] = None,
+  ) -> None:
+    self.file_path = file_path
+    self.written_path = written_path
+    self.diff = diff
+    self.metrics = metrics
+
+    # Only set when the file was modified in-place, in which case they describe the modified code
+    self.content_hash = content_hash
+    self.definition_hashes = definition_hashes
+
+
+def collect_file(
+  config: AIDocsEngineConfig,
+  file_path: str,
+  previous_content_hash: Optional[str] = None,
+  settled_definitions: Optional[Dict[str, str]] = None,
+) -> FileWork:
+  # Read source code from file
+  with open(file_path) as file:
+    code = file.read()
+
+  # Skip file without parsing it if it has not changed since it was last processed
+  content_hash = hash_text(code)
+  if previous_content_hash == content_hash:
+    logger.info(f"Skipping unchanged file `{file_path}`")
+    metrics.increment("skipped_files", reason=SKIP_REASON_UNCHANGED)
+    return FileWork(file_path=file_path, content_hash=content_hash, skip_reason=SKIP_REASON_UNCHANGED)
+
+  # Skip file without parsing it with `libcst` if it has nothing to document
+  with metrics.time_stage(STAGE_PRESCAN):
+    num_undocumented_definitions = count_undocumented_definitions(code, skip_init_methods=config.skip_init_methods)
+  if num_undocumented_definitions == 0:
+    logger.info(f"Skipping file with nothing to document `{file_path}`")
+    metrics.increment("skipped_files", reason=SKIP_REASON_NOTHING_TO_DOCUMENT)
+    return FileWork(file_path=file_path, content_hash=content_hash, skip_reason=SKIP_REASON_NOTHING_TO_DOCUMENT)
+
+  # Log start of docstring generation for current file
+  logger.info(f"Generating docstrings for file `{file_path}`")
+
+  # Parse source code into module, and wrap it in a metadata wrapper; makes a deep copy of the module
+  with metrics.time_stage(STAGE_PARSE):
+    module = libcst.parse_module(code)
+    wrapper = MetadataWrapper(module)
+
+  # Collect every definition that is missing a docstring
+  collector = PythonDefinitionCollector(
+    module=wrapper.module,
+    config=config,
+    file_path=file_path,
+    settled_definitions=settled_definitions,
+  )
+
+  # Resolve metadata up front, so that it is timed apart from the visit; the wrapper caches it
+  with metrics.time_stage(STAGE_METADATA_RESOLVE):
+    wrapper.resolve_many(collector.METADATA_DEPENDENCIES)
+  with metrics.time_stage(STAGE_COLLECT):
+    wrapper.visit(collector)
+  metrics.increment("collected_definitions", len(collector.requests))
+
+  # Log tokens saved by compaction, and add them to the metrics
+  if collector.tokens_saved > 0:
+    logger.info(f"Compaction saved {collector.tokens_saved} prompt tokens for file `{file_path}`")
+    metrics.increment("compaction_tokens_saved", collector.tokens_saved)
+
+  return FileWork(
+    file_path=file_path,
+    content_hash=content_hash,
+    requests=collector.requests,
+    local_docstrings=collector.local_docstrings,
+    definition_keys=collector.definition_keys,
+    definition_hashes=collector.definition_hashes,
+    wrapper=wrapper,
+  )
+
+
+def apply_file(
+  config: AIDocsEngineConfig,
+  file_path: str,
+  content_hash: str,
+  docstrings: Dict[str, FunctionDocstringData | ClassDocstringData],
+  wrapper: Optional[MetadataWrapper] = None,
+  track_hashes: bool = False,
+) -> FileResult:
+  # Nothing to insert, so the file would be unchanged
+  if not docstrings:
+    return FileResult(file_path=file_path)
+
+  # Parse the file again if the module from the collect stage is not available, e.g. in a worker process
+  if wrapper is None:
+    with open(file_path) as file:
+      code = file.read()
+
+    # Definition IDs are positions, so they are only valid for the exact code they were collected from
+    if hash_text(code) != content_hash:
+      raise AIDocsEngineError(f"File `{file_path}` changed while its docstrings were being generated")
+
+    with metrics.time_stage(STAGE_PARSE):
+      wrapper = MetadataWrapper(libcst.parse_module(code))
+
+  # Initialize docstring transformer with the generated docstrings
+  transformer = PythonDocstringInserter(
+    module=wrapper.module,
+    config=config,
+    docstrings=docstrings,
+  )
+
+  # Apply docstring transformer to source code
+  with metrics.time_stage(STAGE_DOCSTRING_BUILD):
+    modified_module = wrapper.visit(transformer)
+    modified_code = modified_module.code
+
+  # Don't touch files whose code is unchanged, to avoid needless writes and mtime churn
+  if hash_text(modified_code) == content_hash:
+    return FileResult(file_path=file_path)
+
+  # Determine path to write to based on whether or not the user wants to overwrite the original file
+  if config.inplace:
+    path_to_write_to = file_path
+  else:
+    file_dir = os.path.dirname(file_path)
+    path_to_write_to = os.path.join(file_dir, f"modified_{os.path.basename(file_path)}")
+
+  # In dry runs, describe the changes as a unified diff instead of writing them
+  if config.dry_run:
+    diff = difflib.unified_diff(
+      wrapper.module.code.splitlines(keepends=True),
+      modified_code.splitlines(keepends=True),
+      fromfile=f"a/{file_path.lstrip('/')}",
+      tofile=f"b/{path_to_write_to.lstrip('/')}",
+    )
+    return FileResult(file_path=file_path, diff="".join(diff))
+
+  # Write transformed code to file atomically, so that an interrupted run can't truncate it
+  with metrics.time_stage(STAGE_WRITE):
+    write_file_atomically(path_to_write_to, modified_code)
+
+  # If the file was modified in-place, then the next run will see the modified code, so describe that instead
+  if not (config.inplace and track_hashes):
+    return FileResult(file_path=file_path, written_path=path_to_write_to)
+
+  visitor = PythonDefinitionVisitor(modified_module)
+  modified_module.visit(visitor)
+  return FileResult(
+    file_path=file_path,
+    written_path=path_to_write_to,
+    content_hash=hash_text(modified_code),
+    definition_hashes=visitor.definition_hashes,
+  )
+
+
+##
+## Worker process entry points; the config is sent to each worker once, instead of with every task
+##
+
+_worker_config: Optional[AIDocsEngineConfig] = None
+
+
+def init_worker(config: AIDocsEngineConfig) -> None:
+  global _worker_config
+  _worker_config = config
+
+
+def estimate_file_in_worker(**kwargs) -> FileEstimate:
+  return estimate_file(config=_worker_config, **kwargs)
+
+
+def collect_file_in_worker(**kwargs) -> FileWork:
+  # Send the metrics recorded for this file back along with its work, for the parent process to merge
+  metrics.reset()
+  work = collect_file(config=_worker_config, **kwargs)
+  work.metrics = metrics.snapshot()
+  return work
+
+
+def apply_file_in_worker(**kwargs) -> FileResult:
+  metrics.reset()
+  result = apply_file(config=_worker_config, **kwargs)
+  result.metrics = metrics.snapshot()
+  return result
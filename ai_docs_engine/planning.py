@@ -0,0 +1,80 @@
+##
+## Up-front estimates of how much work each file is, so that a run can start the biggest files first instead of
+## leaving them for last, and a prediction of the run's makespan (i.e. wall-clock time) under longest-processing-
+## time-first (LPT) scheduling to compare the actual run against.
+##
+
+from typing import List, Optional
+import heapq
+
+from ai_docs_engine.prescan import estimate_undocumented_definition_tokens
+from ai_docs_engine.dispatcher import REQUEST_TOKEN_OVERHEAD
+from ai_docs_engine.config import AIDocsEngineConfig
+from ai_docs_engine.cache import hash_text
+
+
+class FileEstimate:
+  """Estimated cost of each request needed for a file, in estimated tokens."""
+
+  def __init__(
+    self,
+    file_path: str,
+    request_costs: List[int],
+  ) -> None:
+    self.file_path = file_path
+    self.request_costs = request_costs
+
+
+  @property
+  def cost(self) -> int:
+    return sum(self.request_costs)
+
+
+def estimate_file(
+  config: AIDocsEngineConfig,
+  file_path: str,
+  previous_content_hash: Optional[str] = None,
+) -> FileEstimate:
+  # Read source code from file; unreadable files will fail later on anyway, so they cost nothing here
+  try:
+    with open(file_path) as file:
+      code = file.read()
+  except (OSError, UnicodeDecodeError):
+    return FileEstimate(file_path=file_path, request_costs=[])
+
+  # Files which are unchanged since the previous run will be skipped
+  if previous_content_hash == hash_text(code):
+    return FileEstimate(file_path=file_path, request_costs=[])
+
+  # Files which could not be parsed are assumed to be one request, the same as `libcst` would find out
+  definition_tokens = estimate_undocumented_definition_tokens(code, skip_init_methods=config.skip_init_methods)
+  if definition_tokens is None:
+    definition_tokens = [0]
+
+  return FileEstimate(
+    file_path=file_path,
+    request_costs=[tokens + REQUEST_TOKEN_OVERHEAD for tokens in definition_tokens],
+  )
+
+
+def order_largest_first(estimates: List[FileEstimate]) -> List[FileEstimate]:
+  # Sorting is stable, so files of equal cost keep the order they were discovered in
+  return sorted(estimates, key=lambda estimate: estimate.cost, reverse=True)
+
+
+def predict_makespan(
+  costs: List[float],
+  slots: int,
+) -> float:
+  """
+  Predicts the makespan of running jobs of the given costs on `slots`
+  parallel slots, assigning the largest remaining job to whichever slot
+  frees up first. This is within 4/3 of the optimal makespan, which is
+  itself at least `max(sum(costs) / slots, max(costs))`.
+  """
+  assert slots > 0, "Expected slots to be positive"
+
+  finish_times = [0.0] * slots
+  for cost in sorted(costs, reverse=True):
+    heapq.heapreplace(finish_times, finish_times[0] + cost)
+  return max(finish_times)
@@ -0,0 +1,135 @@
+from typing import Iterator, List, Optional
+import threading
+import tokenize
+import ast
+import io
+
+
+# Rough ratio of characters to tokens for source code, used where counting tokens exactly would be too slow
+CHARS_PER_TOKEN_ESTIMATE = 4
+
+# `ast.parse` may fail spuriously with "AST constructor recursion depth mismatch" when called from several threads
+# at once on some Python versions (see CPython issue #106905); it holds the GIL throughout, so serializing it is free
+_parse_lock = threading.Lock()
+
+
+def parse_code(code: str) -> Optional[ast.Module]:
+  try:
+    with _parse_lock:
+      return ast.parse(code)
+  except (SyntaxError, ValueError):
+    return None
+
+
+def _is_single_string_literal(source: str) -> bool:
+  # `libcst` treats implicitly concatenated strings (e.g. `"a" "b"`) as a `ConcatenatedString`, which is not a docstring
+  try:
+    tokens = tokenize.generate_tokens(io.StringIO(source).readline)
+    return sum(1 for token in tokens if token.type == tokenize.STRING) == 1
+  except (tokenize.TokenError, SyntaxError):
+    return False
+
+
+def _get_source_segment(lines: list, node: ast.expr) -> str:
+  # Like `ast.get_source_segment`, but without re-splitting the whole source for every node; offsets are in UTF-8 bytes
+  first_line = lines[node.lineno - 1].encode()
+  if node.lineno == node.end_lineno:
+    return first_line[node.col_offset:node.end_col_offset].decode(errors="replace")
+
+  last_line = lines[node.end_lineno - 1].encode()
+  return "\n".join([
+    first_line[node.col_offset:].decode(errors="replace"),
+    *lines[node.lineno:node.end_lineno - 1],
+    last_line[:node.end_col_offset].decode(errors="replace"),
+  ])
+
+
+def _has_docstring(
+  node: ast.FunctionDef | ast.AsyncFunctionDef | ast.ClassDef,
+  lines: list,
+) -> bool:
+  """
+  Mirrors `check_if_node_has_docstring`, i.e. the first statement of the
+  body must be a lone string literal on its own line within an indented
+  block.
+  """
+  first_statement = node.body[0]
+  if not isinstance(first_statement, ast.Expr):
+    return False
+  if not isinstance(first_statement.value, ast.Constant) or not isinstance(first_statement.value.value, (str, bytes)):
+    return False
+
+  # One-line definitions (e.g. `def f(): "doc"`) do not have an indented block
+  if lines[first_statement.lineno - 1][:first_statement.col_offset].strip():
+    return False
+
+  return _is_single_string_literal(_get_source_segment(lines, first_statement.value))
+
+
+def _iter_undocumented_definitions(
+  tree: ast.Module,
+  lines: list,
+  skip_init_methods: bool,
+) -> Iterator[ast.FunctionDef | ast.AsyncFunctionDef | ast.ClassDef]:
+  for node in ast.walk(tree):
+    if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+      continue
+
+    # Skip if function is an `__init__` function
+    if skip_init_methods and not isinstance(node, ast.ClassDef) and node.name == "__init__":
+      continue
+
+    if not _has_docstring(node, lines):
+      yield node
+
+
+def count_undocumented_definitions(
+  code: str,
+  skip_init_methods: bool,
+) -> Optional[int]:
+  """
+  Cheaply counts the function and class definitions without a docstring,
+  using the same rules as `PythonDefinitionCollector`, so that files with
+  nothing to document never reach the much slower `libcst` path.
+
+  Returns `None` if the code could not be parsed, in which case the caller
+  should fall back to `libcst` to find out.
+  """
+  assert isinstance(code, str), "Expected code to be a string"
+
+  tree = parse_code(code)
+  if tree is None:
+    return None
+
+  lines = code.split("\n")
+  return sum(1 for _ in _iter_undocumented_definitions(tree, lines, skip_init_methods))
+
+
+def estimate_undocumented_definition_tokens(
+  code: str,
+  skip_init_methods: bool,
+) -> Optional[List[int]]:
+  """
+  Cheaply estimates the prompt tokens of each definition without a
+  docstring, from its length in characters. Classes only count their
+  header and the first line of each statement in their body, since
+  compaction reduces them to a skeleton before they are sent.
+
+  Returns `None` if the code could not be parsed.
+  """
+  assert isinstance(code, str), "Expected code to be a string"
+
+  tree = parse_code(code)
+  if tree is None:
+    return None
+
+  lines = code.split("\n")
+  estimates = []
+  for node in _iter_undocumented_definitions(tree, lines, skip_init_methods):
+    if isinstance(node, ast.ClassDef):
+      num_chars = len(lines[node.lineno - 1]) + sum(len(lines[statement.lineno - 1]) for statement in node.body)
+    else:
+      num_chars = sum(len(line) for line in lines[node.lineno - 1:node.end_lineno])
+    estimates.append(max(1, num_chars // CHARS_PER_TOKEN_ESTIMATE))
+
+  return estimates
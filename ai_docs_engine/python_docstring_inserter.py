@@ -1,13 +1,19 @@
-from typing import Tuple
+from typing import Dict, List, Optional
 from libcst.metadata import PositionProvider
 from typing_extensions import override
 import libcst
 
 from ai_docs_engine.docstring_schema import FunctionDocstringData, ClassDocstringData
-from ai_docs_engine.utilities import capitalize_first_letter, time_func
+from ai_docs_engine.docstring_request import DocstringRequest
+from ai_docs_engine.local_docstrings import TRIAGE_LLM, TRIAGE_LOCAL, TRIAGE_SKIP, build_local_docstring, classify_trivial_definition
+from ai_docs_engine.compaction import SUMMARY_PLACEHOLDER, compact_class, compact_function, find_summary_placeholders, get_docstring_summary
+from ai_docs_engine.cache import hash_text, normalize_definition
+from ai_docs_engine.tokens import count_tokens
+from ai_docs_engine.metrics import metrics
+from ai_docs_engine.logger import logger
+from ai_docs_engine.utilities import capitalize_first_letter
 from ai_docs_engine.config import AIDocsEngineConfig
 from ai_docs_engine.errors import AIDocsEngineError
-from ai_docs_engine.logger import logger
 
 
 def preprocess_func_or_class_def(definition: str) -> str:
@@ -69,25 +75,55 @@ def check_if_node_has_docstring(
   return has_docstr
 
 
-class PythonDocstringInserter(libcst.CSTTransformer):
-  # Declare metadeta dependencies
-  METADATA_DEPENDENCIES = (PositionProvider, )
+def get_definition_id(
+  visitor: libcst.MetadataDependent,
+  node: libcst.FunctionDef | libcst.ClassDef,
+) -> str:
+  # Identify definitions by their name and start position, which are stable
+  # between the collect and apply passes over the same module
+  position = visitor.get_metadata(PositionProvider, node).start
+  return f"{node.name.value}:{position.line}:{position.column}"
 
 
+def get_definition_type(
+  node: libcst.FunctionDef | libcst.ClassDef,
+) -> str:
+  if isinstance(node, libcst.FunctionDef):
+    return "function"
+  elif isinstance(node, libcst.ClassDef):
+    return "class"
+  else:
+    raise AIDocsEngineError(f"Unexpected node type: {type(node)}")
+
+
+class PythonDefinitionVisitor(libcst.CSTVisitor):
+  """
+  Visits every function and class definition in a module, keeping track of
+  their qualified names. When `track_hashes` is set, it also records a hash
+  of every definition's source code, keyed by a qualified name which is
+  unique within the module.
+  """
+
   def __init__(
     self,
     module: libcst.Module,
-    config: AIDocsEngineConfig,
+    track_hashes: bool = True,
   ) -> None:
     super().__init__()
 
     assert isinstance(module, libcst.Module), "Expected module to be a `libcst.Module`"
-    assert isinstance(config, AIDocsEngineConfig), "Expected config to be an `AIDocsEngineConfig`"
 
     self._module = module
-    self._config = config
-    self._default_indent = self._module.default_indent
-    
+    self._track_hashes = track_hashes
+    self._scope: List[str] = []
+    self._key_counts: Dict[str, int] = {}
+    self.definition_hashes: Dict[str, str] = {}
+
+
+  @property
+  def qualname(self) -> str:
+    return ".".join(self._scope)
+
 
   def extract_node_source_code(
     self,
@@ -98,36 +134,270 @@ class PythonDocstringInserter(libcst.CSTTransformer):
       return self._module.code_for_node(node)
 
 
-  def generate_docstring(
+  def get_definition_key(self) -> str:
+    # Disambiguate redefinitions (e.g. `@overload`s or property setters) by their order of appearance
+    key = self.qualname
+    count = self._key_counts.get(key, 0)
+    self._key_counts[key] = count + 1
+    return key if count == 0 else f"{key}#{count}"
+
+
+  def get_definition_hash(
     self,
     node: libcst.FunctionDef | libcst.ClassDef,
-  ) -> FunctionDocstringData | ClassDocstringData:
-      assert isinstance(node, (libcst.FunctionDef | libcst.ClassDef)), "Expected node to be a function or a class definition"
+  ) -> str:
+    return hash_text(normalize_definition(self.extract_node_source_code(node)))
 
-      # Extract node source code
-      node_source_code = self.extract_node_source_code(node)
 
-      # Preprocess function or class definition to minimize tokens passed to OpenAI API
-      node_source_code = preprocess_func_or_class_def(node_source_code)
+  def on_definition(
+    self,
+    node: libcst.FunctionDef | libcst.ClassDef,
+    definition_key: str,
+    definition_hash: Optional[str],
+  ) -> None:
+    pass
 
-      # Determine node type
-      if isinstance(node, libcst.FunctionDef):
-        node_type = "function"
-      elif isinstance(node, libcst.ClassDef):
-        node_type = "class"
-      else:
-        raise AIDocsEngineError(f"Unexpected node type: {type(node)}")
-      
-      # Generate docstring (i.e. via OpenAI API wrapper function)
-      docstring_value = self._config.generate_docstring_func(
+
+  def _visit_definition(
+    self,
+    node: libcst.FunctionDef | libcst.ClassDef,
+  ) -> bool:
+    self._scope.append(node.name.value)
+
+    # Record hash of definition
+    definition_key = self.get_definition_key()
+    definition_hash = None
+    if self._track_hashes:
+      definition_hash = self.get_definition_hash(node)
+      self.definition_hashes[definition_key] = definition_hash
+
+    self.on_definition(node, definition_key, definition_hash)
+    return True
+
+
+  @override
+  def visit_ClassDef(self, node: libcst.ClassDef) -> bool:
+    return self._visit_definition(node)
+
+
+  @override
+  def leave_ClassDef(self, original_node: libcst.ClassDef) -> None:
+    self._scope.pop()
+
+
+  @override
+  def visit_FunctionDef(self, node: libcst.FunctionDef) -> bool:
+    return self._visit_definition(node)
+
+
+  @override
+  def leave_FunctionDef(self, original_node: libcst.FunctionDef) -> None:
+    self._scope.pop()
+
+
+class PythonDefinitionCollector(PythonDefinitionVisitor):
+  """
+  Collects a `DocstringRequest` for every function and class definition in a
+  module that does not have a docstring yet, without generating anything.
+
+  Definitions whose hash matches `settled_definitions` (e.g. from the
+  manifest of a previous run) are left alone.
+
+  Trivial definitions are triaged according to `triage_policy` instead,
+  and those which are documented locally end up in `local_docstrings`.
+
+  With `hierarchical_summaries`, classes are collected once all of their
+  members have been, as a skeleton with placeholders for the summaries of
+  members which are being documented in the same run.
+  """
+
+  # Declare metadeta dependencies
+  METADATA_DEPENDENCIES = (PositionProvider, )
+
+
+  def __init__(
+    self,
+    module: libcst.Module,
+    config: AIDocsEngineConfig,
+    file_path: str,
+    settled_definitions: Optional[Dict[str, str]] = None,
+  ) -> None:
+    super().__init__(module=module, track_hashes=settled_definitions is not None)
+
+    assert isinstance(config, AIDocsEngineConfig), "Expected config to be an `AIDocsEngineConfig`"
+    assert isinstance(file_path, str), "Expected file_path to be a string"
+
+    self._config = config
+    self._file_path = file_path
+    self._settled_definitions = settled_definitions or {}
+    self.requests: List[DocstringRequest] = []
+    self.local_docstrings: Dict[str, FunctionDocstringData | ClassDocstringData] = {}
+    self.definition_keys: Dict[str, str] = {}
+    self.tokens_saved = 0
+
+    # Definition IDs of collected nodes, and definition keys of classes waiting to be collected, keyed by node identity
+    self._collected_ids: Dict[int, str] = {}
+    self._deferred_classes: Dict[int, str] = {}
+
+
+  @override
+  def on_definition(
+    self,
+    node: libcst.FunctionDef | libcst.ClassDef,
+    definition_key: str,
+    definition_hash: Optional[str],
+  ) -> None:
+    # Skip if function is an `__init__` function
+    if isinstance(node, libcst.FunctionDef) and self._config.skip_init_methods and node.name.value == "__init__":
+      metrics.increment("skipped_definitions", reason="init_method")
+      return
+
+    # Skip if function or class already has docstring
+    if check_if_node_has_docstring(node):
+      metrics.increment("skipped_definitions", reason="has_docstring")
+      return
+
+    # Skip if definition has not changed since it was last processed
+    if definition_hash is not None and self._settled_definitions.get(definition_key) == definition_hash:
+      metrics.increment("skipped_definitions", reason="unchanged")
+      return
+
+    # Triage trivial definitions, which may not be worth a request
+    kind = classify_trivial_definition(node)
+    decision = self._config.triage_policy.get(kind, TRIAGE_LLM) if kind is not None else TRIAGE_LLM
+    if decision != TRIAGE_LLM:
+      metrics.increment("avoided_requests", kind=kind, decision=decision)
+    if decision == TRIAGE_SKIP:
+      metrics.increment("skipped_definitions", reason="trivial")
+      return
+    if decision == TRIAGE_LOCAL:
+      self.document_locally(node, definition_key, kind)
+      return
+
+    # Collect classes after their members, so that their summaries can be awaited
+    if isinstance(node, libcst.ClassDef) and self._config.hierarchical_summaries:
+      self._deferred_classes[id(node)] = definition_key
+      return
+
+    self.collect(node, definition_key)
+
+
+  @override
+  def leave_ClassDef(self, original_node: libcst.ClassDef) -> None:
+    definition_key = self._deferred_classes.pop(id(original_node), None)
+    if definition_key is not None:
+      self.collect(original_node, definition_key)
+    super().leave_ClassDef(original_node)
+
+
+  def get_summary(
+    self,
+    node: libcst.FunctionDef | libcst.ClassDef,
+  ) -> Optional[str]:
+    # Members which are being documented get a placeholder for their summary, the others keep their docstring's
+    definition_id = self._collected_ids.get(id(node))
+    if definition_id in self.local_docstrings:
+      return self.local_docstrings[definition_id].description
+    if definition_id is not None:
+      return SUMMARY_PLACEHOLDER.format(definition_id=definition_id)
+    return get_docstring_summary(node)
+
+
+  def document_locally(
+    self,
+    node: libcst.FunctionDef | libcst.ClassDef,
+    definition_key: str,
+    kind: str,
+  ) -> None:
+    # Record docstring for the definition, built without a request
+    definition_id = get_definition_id(self, node)
+    self.definition_keys[definition_id] = definition_key
+    self._collected_ids[id(node)] = definition_id
+    self.local_docstrings[definition_id] = build_local_docstring(node, kind)
+
+
+  def collect(
+    self,
+    node: libcst.FunctionDef | libcst.ClassDef,
+    definition_key: str,
+  ) -> None:
+    # Extract node source code
+    node_source_code = self.extract_node_source_code(node)
+
+    # Preprocess function or class definition to minimize tokens passed to OpenAI API
+    node_source_code = preprocess_func_or_class_def(node_source_code)
+
+    # Compact classes and large functions down to what is needed to describe them; hierarchical summaries need class skeletons
+    if self._config.compact_prompts or (self._config.hierarchical_summaries and isinstance(node, libcst.ClassDef)):
+      node_source_code = self.compact(node, node_source_code)
+
+    # Record request for the definition
+    definition_id = get_definition_id(self, node)
+    self.definition_keys[definition_id] = definition_key
+    self._collected_ids[id(node)] = definition_id
+    self.requests.append(
+      DocstringRequest(
+        file_path=self._file_path,
+        definition_id=definition_id,
+        qualname=self.qualname,
         language="python",
         definition=node_source_code,
-        definition_type=node_type,
-        temperature=self._config.temperature,
+        definition_type=get_definition_type(node),
+        child_definition_ids=find_summary_placeholders(node_source_code),
       )
+    )
+
+
+  def compact(
+    self,
+    node: libcst.FunctionDef | libcst.ClassDef,
+    node_source_code: str,
+  ) -> str:
+    # Reduce classes to a skeleton, and only touch functions which are long enough to be worth it
+    if isinstance(node, libcst.ClassDef):
+      compacted_node = compact_class(node, get_summary=self.get_summary if self._config.hierarchical_summaries else get_docstring_summary)
+    else:
+      position = self.get_metadata(PositionProvider, node)
+      if position.end.line - position.start.line + 1 < self._config.compaction_min_function_lines:
+        return node_source_code
+      compacted_node = compact_function(node, max_depth=self._config.compaction_max_depth)
+
+    compacted_source_code = preprocess_func_or_class_def(self.extract_node_source_code(compacted_node))
 
-      # Return postprocessed docstring
-      return postprocess_docstring(docstring_value)
+    # Report tokens saved for this node
+    tokens_saved = count_tokens(node_source_code) - count_tokens(compacted_source_code)
+    self.tokens_saved += tokens_saved
+    logger.debug(f"Compaction saved {tokens_saved} tokens for `{self.qualname}` (`{self._file_path}`)")
+
+    return compacted_source_code
+
+
+class PythonDocstringInserter(libcst.CSTTransformer):
+  """
+  Splices previously generated docstrings back into the definitions that a
+  `PythonDefinitionCollector` collected from the same module.
+  """
+
+  # Declare metadeta dependencies
+  METADATA_DEPENDENCIES = (PositionProvider, )
+
+
+  def __init__(
+    self,
+    module: libcst.Module,
+    config: AIDocsEngineConfig,
+    docstrings: Dict[str, FunctionDocstringData | ClassDocstringData],
+  ) -> None:
+    super().__init__()
+
+    assert isinstance(module, libcst.Module), "Expected module to be a `libcst.Module`"
+    assert isinstance(config, AIDocsEngineConfig), "Expected config to be an `AIDocsEngineConfig`"
+    assert isinstance(docstrings, dict), "Expected docstrings to be a dictionary"
+
+    self._module = module
+    self._config = config
+    self._docstrings = docstrings
+    self._default_indent = self._module.default_indent
 
 
   def create_docstring_node(
@@ -226,22 +496,9 @@ class PythonDocstringInserter(libcst.CSTTransformer):
     original_node: libcst.FunctionDef | libcst.ClassDef,
     updated_node: libcst.FunctionDef | libcst.ClassDef,
   ) -> libcst.FunctionDef | libcst.ClassDef:
-    # Skip if function or class already has docstring
-    if check_if_node_has_docstring(updated_node):
-      return updated_node
-
-    # Try to generate docstring
-    try:
-      docstring_data = self.generate_docstring(updated_node)
-    
-    # If docstring generation fails, then log warning and return original node
-    except Exception as exception:
-      logger.warning(
-        "Failed to generate docstring for node, skipping.\n"
-        f"Node: {updated_node.name.value}\n"
-        f"Error: {exception}"
-      )
-
+    # Skip if no docstring was generated for this function or class
+    docstring_data = self._docstrings.get(get_definition_id(self, original_node))
+    if docstring_data is None:
       return updated_node
 
     # Insert docstring as first statement in function or class node
@@ -270,8 +527,4 @@ class PythonDocstringInserter(libcst.CSTTransformer):
     original_node: libcst.FunctionDef,
     updated_node: libcst.FunctionDef,
   ) -> libcst.FunctionDef:
-    # Skip if function is an `__init__` function
-    if self._config.skip_init_methods and updated_node.name.value == "__init__":
-      return updated_node
-    
     return self.leave_FunctionOrClassDef(original_node, updated_node)
@@ -0,0 +1,253 @@
+##
+## Remote tier behind the local docstring cache, so that a team's machines (e.g. CI runners and developers) reuse each
+## other's generations. Lookups read through the local cache to the remote one, batched per file, while writes are sent
+## behind the run's back in batches. Whenever the remote cache is unreachable, the run carries on with the local cache
+## alone, and tries the remote cache again a while later.
+##
+
+from typing import Dict, List, Optional
+import threading
+import sqlite3
+import queue
+import json
+import time
+
+from ai_docs_engine.metrics import metrics
+from ai_docs_engine.logger import logger
+
+
+# Maximum number of entries per batched write
+WRITE_BATCH_SIZE = 256
+
+# Seconds to wait for more entries before sending a partial batch of writes
+WRITE_BATCH_DELAY = 1.0
+
+# Seconds to wait before trying an unreachable remote cache again
+RETRY_INTERVAL = 60.0
+
+
+class BaseRemoteCache:
+  """
+  Key/value store shared between machines, holding the same JSON values as
+  `DocstringCache`. Both methods are called from several threads at once,
+  and may raise any exception when the store is unreachable.
+  """
+
+  def get_many(self, keys: List[str]) -> Dict[str, str]:
+    """Returns the values of the keys which are present."""
+    raise NotImplementedError()
+
+
+  def set_many(self, items: Dict[str, str]) -> None:
+    raise NotImplementedError()
+
+
+  def close(self) -> None:
+    pass
+
+
+class HTTPRemoteCache(BaseRemoteCache):
+  """
+  Client for a key/value service over HTTP, e.g. the reference server in
+  `ai_docs_engine.remote_cache_server`. Keys are looked up with a `POST` of
+  `{"keys": [...]}` to `{url}/get`, which responds with `{"values": {...}}`,
+  and stored with a `POST` of `{"items": {...}}` to `{url}/set`.
+
+  Args:
+    url: The base URL of the service
+    timeout: The timeout in seconds for each request
+    headers: Extra headers to send with each request, e.g. for authentication
+  """
+
+  def __init__(
+    self,
+    url: str,
+    timeout: float = 5.0,
+    headers: Optional[Dict[str, str]] = None,
+  ) -> None:
+    assert isinstance(url, str), "Expected url to be a string"
+
+    self._url = url.rstrip("/")
+    self._timeout = timeout
+    self._headers = headers or {}
+
+
+  def _post(self, path: str, body: dict) -> dict:
+    # Imported here, as it is slow to import and only needed once a lookup is made
+    import urllib.request
+
+    request = urllib.request.Request(
+      f"{self._url}/{path}",
+      data=json.dumps(body).encode("utf-8"),
+      headers={"Content-Type": "application/json", **self._headers},
+      method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=self._timeout) as response:
+      return json.loads(response.read())
+
+
+  def get_many(self, keys: List[str]) -> Dict[str, str]:
+    return self._post("get", {"keys": keys}).get("values") or {}
+
+
+  def set_many(self, items: Dict[str, str]) -> None:
+    self._post("set", {"items": items})
+
+
+class SQLiteRemoteCache(BaseRemoteCache):
+  """
+  Shared SQLite database, e.g. on network storage that every machine mounts.
+
+  Args:
+    path: The path of the database file, which is created if it doesn't exist
+    timeout: The timeout in seconds to wait for other writers to release the database
+  """
+
+  # Number of keys looked up per query, which keeps below SQLite's limit on the number of parameters
+  MAX_KEYS_PER_QUERY = 500
+
+
+  def __init__(
+    self,
+    path: str,
+    timeout: float = 30.0,
+  ) -> None:
+    assert isinstance(path, str), "Expected path to be a string"
+
+    self._path = path
+    self._timeout = timeout
+    self._connection: Optional[sqlite3.Connection] = None
+    self._lock = threading.Lock()
+
+
+  def __getstate__(self) -> dict:
+    # Connections never cross a process boundary
+    return {**self.__dict__, "_connection": None, "_lock": None}
+
+
+  def __setstate__(self, state: dict) -> None:
+    self.__dict__.update(state)
+    self._lock = threading.Lock()
+
+
+  def _connect(self) -> sqlite3.Connection:
+    # Connect lazily, so that an unreachable database only fails the first lookup instead of the whole run
+    if self._connection is None:
+      self._connection = sqlite3.connect(self._path, timeout=self._timeout, check_same_thread=False)
+      self._connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+      self._connection.commit()
+    return self._connection
+
+
+  def get_many(self, keys: List[str]) -> Dict[str, str]:
+    values = {}
+    with self._lock:
+      connection = self._connect()
+      for start in range(0, len(keys), self.MAX_KEYS_PER_QUERY):
+        batch = keys[start:start + self.MAX_KEYS_PER_QUERY]
+        rows = connection.execute(
+          f"SELECT key, value FROM entries WHERE key IN ({', '.join('?' * len(batch))})",
+          batch,
+        )
+        values.update(rows)
+    return values
+
+
+  def set_many(self, items: Dict[str, str]) -> None:
+    with self._lock:
+      connection = self._connect()
+      connection.executemany("INSERT OR REPLACE INTO entries (key, value) VALUES (?, ?)", items.items())
+      connection.commit()
+
+
+  def close(self) -> None:
+    with self._lock:
+      if self._connection is not None:
+        self._connection.close()
+        self._connection = None
+
+
+class RemoteCacheTier:
+  """
+  Wraps a `BaseRemoteCache` so that it can never fail or hold up a run:
+  lookups return nothing while it is unreachable, and writes are queued,
+  then sent in batches by a background thread.
+  """
+
+  def __init__(
+    self,
+    remote_cache: BaseRemoteCache,
+  ) -> None:
+    assert isinstance(remote_cache, BaseRemoteCache), "Expected remote_cache to be a `BaseRemoteCache`"
+
+    self._remote_cache = remote_cache
+    self._unavailable_until = 0.0
+    self._writes: queue.Queue = queue.Queue()
+    self._writer = threading.Thread(target=self._write_behind, name="ai_docs_engine_remote_cache", daemon=True)
+    self._writer.start()
+
+
+  @property
+  def available(self) -> bool:
+    return time.monotonic() >= self._unavailable_until
+
+
+  def _mark_unavailable(self, exception: Exception) -> None:
+    # Only log when the remote cache becomes unavailable, not for every call which fails while it is
+    metrics.increment("remote_cache_errors")
+    if self.available:
+      logger.warning(f"Remote cache is unreachable, using the local cache alone for the next {RETRY_INTERVAL:g} seconds ({exception = })")
+    self._unavailable_until = time.monotonic() + RETRY_INTERVAL
+
+
+  def get_many(self, keys: List[str]) -> Dict[str, str]:
+    if not keys or not self.available:
+      return {}
+
+    try:
+      return self._remote_cache.get_many(keys)
+    except Exception as exception:
+      self._mark_unavailable(exception)
+      return {}
+
+
+  def set(self, key: str, value: str) -> None:
+    self._writes.put((key, value))
+
+
+  def _write_behind(self) -> None:
+    while True:
+      # Wait for a first entry, then for a full batch or a short while, whichever comes first
+      item = self._writes.get()
+      if item is None:
+        return
+      items = dict([item])
+      deadline = time.monotonic() + WRITE_BATCH_DELAY
+      closing = False
+      while len(items) < WRITE_BATCH_SIZE:
+        try:
+          item = self._writes.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+          break
+        if item is None:
+          closing = True
+          break
+        items[item[0]] = item[1]
+
+      # Entries written while the remote cache is unavailable are only kept locally
+      if self.available:
+        try:
+          self._remote_cache.set_many(items)
+          metrics.increment("remote_cache_writes", len(items))
+        except Exception as exception:
+          self._mark_unavailable(exception)
+
+      if closing:
+        return
+
+
+  def close(self) -> None:
+    # Send the remaining writes before closing
+    self._writes.put(None)
+    self._writer.join()
+    self._remote_cache.close()
@@ -0,0 +1,114 @@
+##
+## Reference server for `HTTPRemoteCache`, which keeps entries in a SQLite database. It is meant for trying out a
+## remote cache locally, or for small teams; anything bigger should put the same two endpoints in front of a proper
+## key/value store.
+##
+## Usage:
+##   python -m ai_docs_engine.remote_cache_server --port 8765 --path remote_cache.sqlite
+##
+
+from typing import Optional
+import threading
+import argparse
+import asyncio
+
+from aiohttp import web
+
+from ai_docs_engine.remote_cache import SQLiteRemoteCache
+
+
+class RemoteCacheServer:
+  """
+  Serves `POST /get` and `POST /set` for `HTTPRemoteCache`, storing entries
+  in a `SQLiteRemoteCache`.
+
+  Args:
+    path: The path of the SQLite database, or `:memory:` to keep entries in memory
+  """
+
+  def __init__(
+    self,
+    path: str = ":memory:",
+  ) -> None:
+    self._store = SQLiteRemoteCache(path)
+    self.stats = {"gets": 0, "keys": 0, "hits": 0, "sets": 0, "items": 0}
+
+    self._loop: Optional[asyncio.AbstractEventLoop] = None
+    self._runner: Optional[web.AppRunner] = None
+    self.url: Optional[str] = None
+
+
+  def make_app(self) -> web.Application:
+    app = web.Application(client_max_size=2**26)
+    app.router.add_post("/get", self._handle_get)
+    app.router.add_post("/set", self._handle_set)
+    return app
+
+
+  async def _handle_get(self, request: web.Request) -> web.Response:
+    keys = (await request.json()).get("keys") or []
+    if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+      return web.json_response({"error": "Expected `keys` to be a list of strings"}, status=400)
+
+    values = self._store.get_many(keys)
+    self.stats["gets"] += 1
+    self.stats["keys"] += len(keys)
+    self.stats["hits"] += len(values)
+    return web.json_response({"values": values})
+
+
+  async def _handle_set(self, request: web.Request) -> web.Response:
+    items = (await request.json()).get("items") or {}
+    if not isinstance(items, dict) or not all(isinstance(value, str) for value in items.values()):
+      return web.json_response({"error": "Expected `items` to be an object of strings"}, status=400)
+
+    self._store.set_many(items)
+    self.stats["sets"] += 1
+    self.stats["items"] += len(items)
+    return web.json_response({})
+
+
+  def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+    """Starts serving on a background thread, and returns the URL to give `HTTPRemoteCache`."""
+    self._loop = asyncio.new_event_loop()
+    threading.Thread(target=self._loop.run_forever, name="remote_cache_server", daemon=True).start()
+
+    async def start_site() -> int:
+      self._runner = web.AppRunner(self.make_app())
+      await self._runner.setup()
+      site = web.TCPSite(self._runner, host, port)
+      await site.start()
+      return site._server.sockets[0].getsockname()[1]
+
+    bound_port = asyncio.run_coroutine_threadsafe(start_site(), self._loop).result()
+    self.url = f"http://{host}:{bound_port}"
+    return self.url
+
+
+  def stop(self) -> None:
+    if self._loop is None:
+      return
+    asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+    self._loop.call_soon_threadsafe(self._loop.stop)
+    self._loop = None
+
+
+  def __enter__(self) -> "RemoteCacheServer":
+    self.start()
+    return self
+
+
+  def __exit__(self, *_) -> None:
+    self.stop()
+    self._store.close()
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Reference remote cache server for `HTTPRemoteCache`")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8765)
+  parser.add_argument("--path", default="remote_cache.sqlite", help="Path of the SQLite database to store entries in")
+  args = parser.parse_args()
+
+  server = RemoteCacheServer(path=args.path)
+  web.run_app(server.make_app(), host=args.host, port=args.port)
@@ -0,0 +1,268 @@
+from typing import Any, Awaitable, Callable, Optional
+import concurrent.futures
+import threading
+import asyncio
+import random
+import time
+
+from ai_docs_engine.concurrency import OUTCOME_ERROR, OUTCOME_OVERLOAD, OUTCOME_SUCCESS, ConcurrencyController
+from ai_docs_engine.errors import AIDocsEngineRetryableError
+from ai_docs_engine.config import AIDocsEngineConfig
+from ai_docs_engine.metrics import metrics
+from ai_docs_engine.logger import logger
+
+
+# HTTP status codes which indicate a transient failure worth retrying
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def get_error_status_code(exception: BaseException) -> Optional[int]:
+  # Support our own errors as well as the attribute names used by common HTTP client libraries
+  for attribute in ("status_code", "http_status", "status"):
+    status_code = getattr(exception, attribute, None)
+    if isinstance(status_code, int):
+      return status_code
+  return None
+
+
+def is_retryable_error(exception: BaseException) -> bool:
+  if isinstance(exception, (AIDocsEngineRetryableError, TimeoutError, ConnectionError)):
+    return True
+
+  status_code = get_error_status_code(exception)
+  return status_code is not None and (status_code in RETRYABLE_STATUS_CODES or status_code >= 500)
+
+
+def is_rate_limit_error(exception: BaseException) -> bool:
+  return get_error_status_code(exception) == 429
+
+
+def is_overload_error(exception: BaseException) -> bool:
+  # Rate limits and timeouts are the provider telling us to slow down, including timeouts wrapped by the backends
+  if isinstance(exception, TimeoutError) or getattr(exception, "overload", False) is True:
+    return True
+  return get_error_status_code(exception) in (408, 429, 504)
+
+
+def compute_backoff_delay(
+  attempt: int,
+  base_delay: float,
+  max_delay: float,
+  retry_after: Optional[float] = None,
+) -> float:
+  # Exponential backoff with full jitter, never retrying sooner than the server asked us to
+  delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+  if retry_after is not None:
+    delay = max(delay, retry_after)
+  return delay
+
+
+class TokenBucket:
+  """
+  Token bucket which refills continuously at `capacity` tokens per minute.
+  Only ever used from the scheduler's event loop.
+  """
+
+  def __init__(self, capacity: int) -> None:
+    assert capacity > 0, "Expected capacity to be positive"
+
+    self._capacity = capacity
+    self._tokens = float(capacity)
+    self._refill_rate = capacity / 60.0
+    self._last_refill = time.monotonic()
+    self._lock = asyncio.Lock()
+
+
+  def _refill(self) -> None:
+    now = time.monotonic()
+    self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._refill_rate)
+    self._last_refill = now
+
+
+  async def acquire(self, amount: int) -> None:
+    # Requests larger than the whole bucket are let through once the bucket is full
+    amount = min(amount, self._capacity)
+
+    # Serve waiters in FIFO order so large requests are not starved by small ones
+    async with self._lock:
+      while True:
+        self._refill()
+        if self._tokens >= amount:
+          self._tokens -= amount
+          return
+        await asyncio.sleep((amount - self._tokens) / self._refill_rate)
+
+
+class _Job:
+  def __init__(
+    self,
+    func: Callable[[], Awaitable[Any]],
+    estimated_tokens: int,
+    description: str,
+  ) -> None:
+    self.func = func
+    self.estimated_tokens = estimated_tokens
+    self.description = description
+    self.future = concurrent.futures.Future()
+
+
+class RequestScheduler:
+  """
+  Shared request scheduler for a whole run. Jobs are queued on a bounded
+  asyncio queue, then drained by a fixed number of workers which respect
+  the configured requests-per-minute and tokens-per-minute budgets, and
+  which retry transient failures with exponential backoff and jitter. How
+  many of the workers may have a request in flight at once is decided by a
+  `ConcurrencyController`.
+  """
+
+  def __init__(
+    self,
+    config: AIDocsEngineConfig,
+  ) -> None:
+    assert isinstance(config, AIDocsEngineConfig), "Expected config to be an `AIDocsEngineConfig`"
+
+    self._config = config
+
+    # Run the event loop on a background thread so that synchronous callers can submit jobs
+    self._loop = asyncio.new_event_loop()
+    self._thread = threading.Thread(target=self._loop.run_forever, name="ai_docs_engine_scheduler", daemon=True)
+    self._thread.start()
+
+    # Create queue, rate limiters and workers on the event loop
+    asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+
+  async def _start(self) -> None:
+    self._queue = asyncio.Queue(maxsize=self._config.max_queued_requests)
+    self._request_bucket = TokenBucket(self._config.requests_per_minute)
+    self._token_bucket = TokenBucket(self._config.tokens_per_minute)
+    self._cooldown_until = 0.0
+    self._concurrency = ConcurrencyController(
+      initial_limit=self._config.initial_requests_in_flight,
+      min_limit=1,
+      max_limit=self._config.max_requests_in_flight,
+      adaptive=self._config.adaptive_concurrency,
+    )
+    self._workers = [
+      asyncio.create_task(self._worker())
+      for _ in range(self._config.max_requests_in_flight)
+    ]
+
+
+  @property
+  def concurrency(self) -> ConcurrencyController:
+    return self._concurrency
+
+
+  def __enter__(self) -> "RequestScheduler":
+    return self
+
+
+  def __exit__(self, *_) -> None:
+    self.shutdown()
+
+
+  def shutdown(
+    self,
+    cleanup: Optional[Callable[[], Awaitable[None]]] = None,
+  ) -> None:
+    """
+    Waits for queued jobs to finish, then stops the workers and the event
+    loop. `cleanup` is awaited on the event loop in between, e.g. to close
+    connection pools which are bound to it.
+    """
+    if self._loop.is_closed():
+      return
+
+    asyncio.run_coroutine_threadsafe(self._stop(cleanup), self._loop).result()
+    self._loop.call_soon_threadsafe(self._loop.stop)
+    self._thread.join()
+    self._loop.close()
+
+
+  async def _stop(self, cleanup: Optional[Callable[[], Awaitable[None]]]) -> None:
+    await self._queue.join()
+    for worker in self._workers:
+      worker.cancel()
+    await asyncio.gather(*self._workers, return_exceptions=True)
+    if cleanup is not None:
+      await cleanup()
+
+
+  def submit(
+    self,
+    func: Callable[[], Awaitable[Any]],
+    estimated_tokens: int,
+    description: str = "request",
+  ) -> concurrent.futures.Future:
+    """
+    Queues `func` to be called and awaited on the event loop once the rate
+    limits allow it, resolving the returned future with its result. Blocks the
+    calling thread while the queue is full, which applies backpressure to
+    whoever is producing requests.
+    """
+    job = _Job(func=func, estimated_tokens=estimated_tokens, description=description)
+    asyncio.run_coroutine_threadsafe(self._queue.put(job), self._loop).result()
+    return job.future
+
+
+  async def _wait_for_cooldown(self) -> None:
+    # After a rate limit error, every worker backs off together instead of hammering the provider
+    while (remaining := self._cooldown_until - time.monotonic()) > 0:
+      await asyncio.sleep(remaining)
+
+
+  async def _run_job(self, job: _Job) -> Any:
+    attempt = 0
+    while True:
+      await self._wait_for_cooldown()
+      await self._request_bucket.acquire(1)
+      await self._token_bucket.acquire(job.estimated_tokens)
+      started_at = await self._concurrency.acquire()
+
+      try:
+        result = await job.func()
+        await self._concurrency.release(started_at, OUTCOME_SUCCESS)
+        metrics.observe("request_seconds", time.monotonic() - started_at, outcome=OUTCOME_SUCCESS)
+        return result
+
+      except Exception as exception:
+        outcome = OUTCOME_OVERLOAD if is_overload_error(exception) else OUTCOME_ERROR
+        await self._concurrency.release(started_at, outcome)
+        metrics.observe("request_seconds", time.monotonic() - started_at, outcome=outcome)
+
+        # Give up on errors which are not transient, or once we're out of retries
+        if not is_retryable_error(exception) or attempt >= self._config.max_retries:
+          raise
+
+        # Back off before retrying
+        delay = compute_backoff_delay(
+          attempt=attempt,
+          base_delay=self._config.retry_base_delay,
+          max_delay=self._config.retry_max_delay,
+          retry_after=getattr(exception, "retry_after", None),
+        )
+        if is_rate_limit_error(exception):
+          self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+
+        attempt += 1
+        metrics.increment("retries", reason=get_error_status_code(exception) or type(exception).__name__)
+        logger.warning(
+          f"Retrying {job.description} in {delay:.2f} seconds "
+          f"(attempt {attempt}/{self._config.max_retries}, error: {exception})"
+        )
+        await asyncio.sleep(delay)
+
+
+  async def _worker(self) -> None:
+    while True:
+      job = await self._queue.get()
+      try:
+        if job.future.set_running_or_notify_cancel():
+          try:
+            job.future.set_result(await self._run_job(job))
+          except Exception as exception:
+            job.future.set_exception(exception)
+      finally:
+        self._queue.task_done()
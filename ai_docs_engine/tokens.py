@@ -0,0 +1,102 @@
+from typing import Dict, List
+import functools
+import threading
+import json
+
+try:
+  import tiktoken
+except ImportError:
+  tiktoken = None
+
+
+# Fallback ratio used when `tiktoken` (or its encoding files) are unavailable; deliberately pessimistic
+CHARS_PER_TOKEN_FALLBACK = 3
+
+# Per-message overheads for chat models, see: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_PER_REPLY = 3
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model: str):
+  if tiktoken is None:
+    return None
+
+  try:
+    return tiktoken.encoding_for_model(model)
+  except KeyError:
+    return tiktoken.get_encoding("cl100k_base")
+  except Exception:
+    # Encoding files could not be loaded, e.g. when running offline for the first time
+    return None
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+  assert isinstance(text, str), "Expected text to be a string"
+
+  encoding = _get_encoding(model)
+  if encoding is None:
+    return -(-len(text) // CHARS_PER_TOKEN_FALLBACK)
+
+  return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(
+  messages: List[Dict[str, str]],
+  functions: List[dict],
+  model: str = "gpt-3.5-turbo",
+) -> int:
+  """
+  Estimates the number of prompt tokens used by a chat completion request,
+  including the agent function schemas it is sent with.
+  """
+  num_tokens = TOKENS_PER_REPLY
+
+  for message in messages:
+    num_tokens += TOKENS_PER_MESSAGE
+    for (key, value) in message.items():
+      num_tokens += count_tokens(value, model)
+      if key == "name":
+        num_tokens += TOKENS_PER_NAME
+
+  # Function schemas are injected into the prompt in a compact form, so their JSON is a close upper bound
+  for function in functions:
+    num_tokens += count_tokens(json.dumps(function, separators=(",", ":")), model)
+
+  return num_tokens
+
+
+class TokenUsage:
+  """Thread-safe tally of prompt and completion tokens per model."""
+
+  def __init__(self) -> None:
+    self._lock = threading.Lock()
+    self._usage: Dict[str, Dict[str, int]] = {}
+
+
+  def reset(self) -> None:
+    with self._lock:
+      self._usage.clear()
+
+
+  def record(
+    self,
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+  ) -> None:
+    with self._lock:
+      usage = self._usage.setdefault(model, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0})
+      usage["requests"] += 1
+      usage["prompt_tokens"] += prompt_tokens
+      usage["completion_tokens"] += completion_tokens
+
+
+  def snapshot(self) -> Dict[str, Dict[str, int]]:
+    with self._lock:
+      return {model: dict(usage) for (model, usage) in self._usage.items()}
+
+
+# Token usage of the current run
+token_usage = TokenUsage()
@@ -1,6 +1,9 @@
 from pydantic import BaseModel
 from typing import Any
+import threading
+import tempfile
 import time
+import os
 
 from ai_docs_engine.logger import logger, col
 
@@ -38,3 +41,56 @@ def capitalize_first_letter(string: str) -> str:
 
   # Capitalize first letter
   return string[0].upper() + string[1:]
+
+
+def get_default_cache_dir() -> str:
+  # Follow the XDG base directory spec, so the cache does not depend on the current working directory
+  cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+  return os.path.join(cache_home, "ai_docs_engine")
+
+
+_environment_lock = threading.Lock()
+_environment_loaded = False
+
+
+def load_environment() -> None:
+  """
+  Loads environment variables from a `.env` file (without overriding those
+  which are already set), once per process, on first use rather than when
+  the package is imported.
+  """
+  global _environment_loaded
+  with _environment_lock:
+    if _environment_loaded:
+      return
+    import dotenv
+    dotenv.load_dotenv()
+    _environment_loaded = True
+
+
+def write_file_atomically(path: str, content: str) -> None:
+  """
+  Writes `content` to a temporary file next to `path`, then renames it over
+  `path`, so that readers (or an interrupted run) never see a partial file.
+  """
+  assert isinstance(path, str), "Expected path to be a string"
+  assert isinstance(content, str), "Expected content to be a string"
+
+  directory = os.path.dirname(os.path.abspath(path))
+  (fd, temp_path) = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+  try:
+    with os.fdopen(fd, "w") as file:
+      file.write(content)
+      file.flush()
+      os.fsync(file.fileno())
+
+    # Keep the permissions of the file being replaced
+    if os.path.exists(path):
+      os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+
+    os.replace(temp_path, path)
+
+  except BaseException:
+    if os.path.exists(temp_path):
+      os.remove(temp_path)
+    raise
@@ -0,0 +1,275 @@
+##
+## File watchers for watch mode (see `ai_docs_engine.engine.watch_docstrings`), which report the paths of source files
+## as they are written, created, moved or deleted. On Linux, inotify is used through `ctypes` without any dependency,
+## watching every directory that discovery would descend into; elsewhere, or when inotify is unavailable (e.g. the
+## limit on watches is reached), the source files are polled for changes to their modification time and size instead.
+##
+
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+import ctypes.util
+import ctypes
+import struct
+import select
+import errno
+import time
+import os
+
+from ai_docs_engine.discovery import SourceFileMatcher
+from ai_docs_engine.logger import logger
+
+
+# Ways of watching for changes
+WATCH_METHOD_AUTO = "auto"
+WATCH_METHOD_INOTIFY = "inotify"
+WATCH_METHOD_POLL = "poll"
+WATCH_METHODS = (WATCH_METHOD_AUTO, WATCH_METHOD_INOTIFY, WATCH_METHOD_POLL)
+
+# Flags of inotify, see `man 7 inotify`
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+IN_ISDIR       = 0x40000000
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+
+# Only finished writes are reported, so that a file is never read halfway through being written; editors which save by
+# writing a temporary file and renaming it over the original are covered by `IN_MOVED_TO`
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+# Layout of the fixed-size part of each inotify event, which is followed by a name of `length` bytes
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class BaseFileWatcher:
+  """Reports the paths of files which changed since the previous call."""
+
+  # Seconds between the checks for changes, i.e. changes any closer together may be noticed at once
+  resolution = 0.0
+
+
+  def read_changes(self, timeout: float) -> Optional[Set[str]]:
+    """
+    Waits up to `timeout` seconds for changes, and returns the absolute
+    paths of the files which changed, including deleted ones, or `None` if
+    changes were lost and every source file must be checked again.
+    """
+    raise NotImplementedError()
+
+
+  def close(self) -> None:
+    pass
+
+
+  def __enter__(self) -> "BaseFileWatcher":
+    return self
+
+
+  def __exit__(self, *_) -> None:
+    self.close()
+
+
+class InotifyFileWatcher(BaseFileWatcher):
+  """
+  Watches every directory that discovery would descend into with inotify,
+  and adds watches for directories as they are created.
+
+  Raises:
+    OSError: If inotify is unavailable, or the limit on watches is reached
+  """
+
+  def __init__(
+    self,
+    matcher: SourceFileMatcher,
+  ) -> None:
+    assert isinstance(matcher, SourceFileMatcher), "Expected matcher to be a `SourceFileMatcher`"
+
+    libc_name = ctypes.util.find_library("c")
+    if libc_name is None:
+      raise OSError("Could not find the C library for inotify")
+    self._libc = ctypes.CDLL(libc_name, use_errno=True)
+    if not hasattr(self._libc, "inotify_init1"):
+      raise OSError("The C library does not support inotify")
+
+    self._matcher = matcher
+    self._directories: Dict[int, str] = {}
+    self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if self._fd < 0:
+      self._raise_errno("inotify_init1")
+
+    try:
+      for (root, _) in matcher.roots:
+        # Rules naming a single file are watched through the directory it is in
+        if os.path.isdir(root):
+          self._watch_tree(root)
+        elif os.path.isdir(os.path.dirname(root)):
+          self._watch_directory(os.path.dirname(root))
+    except BaseException:
+      self.close()
+      raise
+
+
+  def _raise_errno(self, function_name: str) -> None:
+    error = ctypes.get_errno()
+    raise OSError(error, f"{function_name} failed: {os.strerror(error)}")
+
+
+  def _watch_directory(self, directory: str) -> None:
+    wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), INOTIFY_MASK)
+    if wd < 0:
+      # Directories which vanished in the meantime are fine, while running out of watches is not
+      if ctypes.get_errno() in (errno.ENOENT, errno.ENOTDIR):
+        return
+      self._raise_errno("inotify_add_watch")
+    self._directories[wd] = directory
+
+
+  def _watch_tree(self, root: str) -> Set[str]:
+    # Watch the directory and every directory under it that discovery would descend into, and return the files in them
+    file_paths = set()
+    stack = [root]
+    while stack:
+      directory = stack.pop()
+      self._watch_directory(directory)
+      try:
+        with os.scandir(directory) as iterator:
+          for entry in iterator:
+            if entry.is_dir(follow_symlinks=False):
+              if self._matcher.could_contain_source_files(entry.path):
+                stack.append(entry.path)
+            else:
+              file_paths.add(entry.path)
+      except OSError:
+        continue
+    return file_paths
+
+
+  def read_changes(self, timeout: float) -> Optional[Set[str]]:
+    (readable, _, _) = select.select([self._fd], [], [], max(0.0, timeout))
+    if not readable:
+      return set()
+
+    changed_paths = set()
+    lost_changes = False
+    while True:
+      try:
+        data = os.read(self._fd, 2**16)
+      except BlockingIOError:
+        break
+
+      offset = 0
+      while offset < len(data):
+        (wd, mask, _, length) = INOTIFY_EVENT.unpack_from(data, offset)
+        name = os.fsdecode(data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b"\0"))
+        offset += INOTIFY_EVENT.size + length
+
+        if mask & IN_Q_OVERFLOW:
+          lost_changes = True
+          continue
+        if mask & IN_IGNORED:
+          self._directories.pop(wd, None)
+          continue
+        directory = self._directories.get(wd)
+        if directory is None or not name:
+          continue
+
+        # New directories are watched too, and files which were moved in along with them count as changed
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+          if mask & (IN_CREATE | IN_MOVED_TO) and self._matcher.could_contain_source_files(path):
+            changed_paths.update(self._watch_tree(path))
+          continue
+        changed_paths.add(path)
+
+    return None if lost_changes else changed_paths
+
+
+  def close(self) -> None:
+    if self._fd >= 0:
+      os.close(self._fd)
+      self._fd = -1
+
+
+class PollingFileWatcher(BaseFileWatcher):
+  """
+  Lists the source files every `interval` seconds, and compares their
+  modification times and sizes against the previous listing.
+  """
+
+  def __init__(
+    self,
+    list_file_paths: Callable[[], Iterable[str]],
+    interval: float = 1.0,
+  ) -> None:
+    assert callable(list_file_paths), "Expected list_file_paths to be callable"
+    assert interval > 0, "Expected interval to be positive"
+
+    self._list_file_paths = list_file_paths
+    self._interval = interval
+    self.resolution = interval
+    self._snapshot = self._take_snapshot()
+    self._next_poll_at = time.monotonic() + interval
+
+
+  def _take_snapshot(self) -> Dict[str, Tuple[int, int]]:
+    snapshot = {}
+    for file_path in self._list_file_paths():
+      abs_path = os.path.abspath(file_path)
+      try:
+        stat = os.stat(abs_path)
+      except OSError:
+        continue
+      snapshot[abs_path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+  def read_changes(self, timeout: float) -> Optional[Set[str]]:
+    # Only poll once the interval is up, however often this is called
+    wait = self._next_poll_at - time.monotonic()
+    if wait > timeout:
+      time.sleep(max(0.0, timeout))
+      return set()
+    time.sleep(max(0.0, wait))
+    self._next_poll_at = time.monotonic() + self._interval
+
+    (previous_snapshot, self._snapshot) = (self._snapshot, self._take_snapshot())
+    return {
+      path
+      for path in previous_snapshot.keys() | self._snapshot.keys()
+      if previous_snapshot.get(path) != self._snapshot.get(path)
+    }
+
+
+def create_file_watcher(
+  matcher: SourceFileMatcher,
+  list_file_paths: Callable[[], Iterable[str]],
+  method: str = WATCH_METHOD_AUTO,
+  poll_interval: float = 1.0,
+) -> BaseFileWatcher:
+  """
+  Creates a file watcher for the source files matched by `matcher`, which
+  are listed by `list_file_paths` for polling. With `WATCH_METHOD_AUTO`,
+  inotify is used where it is available, and polling otherwise.
+  """
+  assert method in WATCH_METHODS, f"Unsupported watch method: {method}"
+
+  if method != WATCH_METHOD_POLL:
+    try:
+      watcher = InotifyFileWatcher(matcher)
+      logger.info("Watching for changes with inotify")
+      return watcher
+    except (OSError, AttributeError) as exception:
+      if method == WATCH_METHOD_INOTIFY:
+        raise
+      logger.warning(f"Falling back to polling for changes every {poll_interval:g} seconds, as inotify is unavailable ({exception = })")
+
+  watcher = PollingFileWatcher(list_file_paths, interval=poll_interval)
+  if method == WATCH_METHOD_POLL:
+    logger.info(f"Polling for changes every {poll_interval:g} seconds")
+  return watcher
@@ -0,0 +1,135 @@
+##
+## Synthetic corpus generator for benchmarks. Generates a tree of Python modules with a mix of small and large
+## functions, classes with methods, nested classes and (optionally) huge classes, none of which are documented.
+##
+## Usage:
+##   python benchmarks/corpus.py /tmp/corpus --files 100 --definitions 20
+##
+
+from typing import List
+import argparse
+import random
+import shutil
+import os
+
+
+def _function(name: str, indent: str, num_statements: int, rng: random.Random, method: bool = False) -> List[str]:
+  parameters = ["self"] if method else []
+  parameters += [f"arg_{index}" for index in range(rng.randint(0, 4))]
+
+  lines = [f"{indent}def {name}({', '.join(parameters)}):"]
+  lines.append(f"{indent}  total = 0")
+  for index in range(num_statements):
+    # Mix in nested blocks, so that compaction has something to elide
+    if index % 7 == 3:
+      lines.append(f"{indent}  for item in range({index}):")
+      lines.append(f"{indent}    if item % 2:")
+      lines.append(f"{indent}      total += item * {index}")
+    else:
+      lines.append(f"{indent}  total += {rng.randint(1, 100)}  # step {index}")
+  lines.append(f"{indent}  return total")
+  return lines
+
+
+def _class(name: str, indent: str, num_methods: int, rng: random.Random, nested: bool) -> List[str]:
+  lines = [f"{indent}class {name}:"]
+  lines.append(f"{indent}  value: int = {rng.randint(0, 10)}")
+  lines.append("")
+  lines += _function("__init__", indent + "  ", 1, rng, method=True)
+  for index in range(num_methods):
+    lines.append("")
+    lines += _function(f"method_{index}", indent + "  ", rng.choice([1, 2, 3, 8]), rng, method=True)
+
+  if nested:
+    lines.append("")
+    lines += _class(f"{name}Inner", indent + "  ", 2, rng, nested=False)
+  return lines
+
+
+def generate_module(
+  num_definitions: int,
+  rng: random.Random,
+  nested_classes: bool = True,
+  huge_class_methods: int = 0,
+) -> str:
+  """
+  Generates the source code of a module with about `num_definitions`
+  definitions that need a docstring, plus a class with `huge_class_methods`
+  methods if that is positive.
+  """
+  lines = ["import os", ""]
+  remaining = num_definitions
+  index = 0
+  while remaining > 0:
+    lines.append("")
+    if rng.random() < 0.3 and remaining >= 4:
+      num_methods = min(remaining - 1, rng.randint(2, 6))
+      nested = nested_classes and rng.random() < 0.3
+      lines += _class(f"Class{index}", "", num_methods, rng, nested=nested)
+      remaining -= 1 + num_methods + (3 if nested else 0)
+    else:
+      lines += _function(f"function_{index}", "", rng.choice([1, 2, 4, 12, 60]), rng)
+      remaining -= 1
+    lines.append("")
+    index += 1
+
+  if huge_class_methods > 0:
+    lines.append("")
+    lines += _class("HugeClass", "", huge_class_methods, rng, nested=nested_classes)
+
+  return "\n".join(lines) + "\n"
+
+
+def generate_corpus(
+  root: str,
+  num_files: int,
+  num_definitions: int,
+  nested_classes: bool = True,
+  huge_class_methods: int = 0,
+  seed: int = 0,
+) -> List[str]:
+  """
+  Generates `num_files` modules under `root` (replacing anything already
+  there), spread over a few packages, and returns their paths. The same
+  seed always generates the same corpus.
+  """
+  rng = random.Random(seed)
+  shutil.rmtree(root, ignore_errors=True)
+
+  paths = []
+  for file_index in range(num_files):
+    directory = os.path.join(root, f"package_{file_index % 8}")
+    os.makedirs(directory, exist_ok=True)
+
+    path = os.path.join(directory, f"module_{file_index}.py")
+    with open(path, "w") as file:
+      file.write(generate_module(
+        num_definitions=num_definitions,
+        rng=rng,
+        nested_classes=nested_classes,
+        huge_class_methods=huge_class_methods if file_index % 10 == 0 else 0,
+      ))
+    paths.append(path)
+
+  return paths
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Generate a synthetic Python corpus")
+  parser.add_argument("root")
+  parser.add_argument("--files", type=int, default=100)
+  parser.add_argument("--definitions", type=int, default=20, help="Definitions per file")
+  parser.add_argument("--huge-class-methods", type=int, default=0, help="Methods of the huge class in every tenth file")
+  parser.add_argument("--no-nested-classes", action="store_true")
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  paths = generate_corpus(
+    root=args.root,
+    num_files=args.files,
+    num_definitions=args.definitions,
+    nested_classes=not args.no_nested_classes,
+    huge_class_methods=args.huge_class_methods,
+    seed=args.seed,
+  )
+  print(f"Generated {len(paths)} files under `{args.root}`")
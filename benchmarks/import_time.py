@@ -0,0 +1,102 @@
+##
+## Cold-start benchmark for `import ai_docs_engine`, which guards the import-time budget of short invocations such as
+## pre-commit hooks. Each sample times the import in a fresh interpreter, from a directory with a `.env` file. Also
+## checks that the import stays free of heavy dependencies and side effects, i.e. that it imports none of
+## `HEAVY_MODULES`, leaves the root logger alone, loads no `.env` file and creates no files. Exits with status 1 if any
+## check fails.
+##
+## Usage:
+##   python benchmarks/import_time.py
+##   python benchmarks/import_time.py --samples 50 --budget-ms 10
+##
+
+from typing import List
+import statistics
+import subprocess
+import argparse
+import logging
+import tempfile
+import json
+import sys
+import os
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules which must not be imported by `import ai_docs_engine` alone
+HEAVY_MODULES = ["libcst", "pydantic", "openai", "aiohttp", "diskcache", "dotenv", "tiktoken", "urllib.request"]
+
+# Statement run in each sample, which reports what the import left behind as JSON
+IMPORT_STATEMENT = """
+import logging, json, os, sys, time
+start = time.perf_counter()
+import ai_docs_engine
+seconds = time.perf_counter() - start
+print(json.dumps({
+  "seconds": seconds,
+  "heavy_modules": [name for name in %r if name in sys.modules],
+  "root_log_level": logging.getLogger().level,
+  "env_loaded": "AI_DOCS_ENGINE_IMPORT_TIME_CANARY" in os.environ,
+}))
+"""
+
+
+def _run_sample(statement: str, cwd: str) -> dict:
+  # Run in a fresh interpreter, so that nothing is imported yet
+  env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [ROOT_DIR, os.environ.get("PYTHONPATH")]))}
+  env.pop("AI_DOCS_ENGINE_IMPORT_TIME_CANARY", None)
+  output = subprocess.run([sys.executable, "-c", statement], cwd=cwd, env=env, capture_output=True, text=True, check=True).stdout
+  return json.loads(output.strip().splitlines()[-1])
+
+
+def _measure(samples: int, cwd: str) -> List[dict]:
+  return [_run_sample(IMPORT_STATEMENT % HEAVY_MODULES, cwd) for _ in range(samples)]
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Cold-start benchmark for `import ai_docs_engine`")
+  parser.add_argument("--samples", type=int, default=20, help="Number of fresh interpreters to import the package in")
+  parser.add_argument("--budget-ms", type=float, default=25.0, help="Maximum median import time in milliseconds")
+  args = parser.parse_args()
+
+  # Import from a directory with a `.env` file, so that loading it at import time would be noticed
+  with tempfile.TemporaryDirectory() as cwd:
+    with open(os.path.join(cwd, ".env"), "w") as file:
+      file.write("AI_DOCS_ENGINE_IMPORT_TIME_CANARY=1\n")
+    results = _measure(args.samples, cwd)
+    stray_paths = sorted(set(os.listdir(cwd)) - {".env"})
+
+  import_ms = [result["seconds"] * 1000 for result in results]
+  median_ms = statistics.median(import_ms)
+  heavy_modules = sorted({name for result in results for name in result["heavy_modules"]})
+  root_log_levels = sorted({result["root_log_level"] for result in results})
+  env_loaded = any(result["env_loaded"] for result in results)
+
+  print(f"{'samples':<24} {args.samples:>10}")
+  print(f"{'median_ms':<24} {median_ms:>10.2f}")
+  print(f"{'min_ms':<24} {min(import_ms):>10.2f}")
+  print(f"{'max_ms':<24} {max(import_ms):>10.2f}")
+  print(f"{'budget_ms':<24} {args.budget_ms:>10.2f}")
+
+  # Collect every failed check, so that all of them are reported at once
+  failures = []
+  if median_ms > args.budget_ms:
+    failures.append(f"Median import time of {median_ms:.2f} ms is over the budget of {args.budget_ms:.2f} ms")
+  if heavy_modules:
+    failures.append(f"Importing the package imported heavy modules: {', '.join(heavy_modules)}")
+  if root_log_levels != [logging.WARNING]:
+    failures.append(f"Importing the package changed the level of the root logger to {root_log_levels}")
+  if env_loaded:
+    failures.append("Importing the package loaded the `.env` file")
+  if stray_paths:
+    failures.append(f"Importing the package created files in the working directory: {', '.join(stray_paths)}")
+
+  for failure in failures:
+    print(f"FAIL: {failure}")
+  if failures:
+    sys.exit(1)
+  print("OK")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,256 @@
+##
+## Local stand-in for OpenAI's chat completions endpoint, for benchmarks and offline experiments. Responses are
+## deterministic function calls derived from the request, while latency is drawn from a configurable distribution
+## and rate limits (429s) are injected at random, or whenever too many requests are in flight.
+##
+## Usage:
+##   python benchmarks/mock_openai_server.py --port 8000 --latency lognormal:0.5,0.4 --rate-limit-probability 0.02
+##
+
+from typing import List, Optional
+import threading
+import argparse
+import asyncio
+import hashlib
+import random
+import json
+import math
+import re
+
+from aiohttp import web
+
+
+class LatencyDistribution:
+  """
+  Distribution of response latencies in seconds, parsed from a spec such as
+  `fixed:0.2`, `uniform:0.1,0.5`, `exponential:0.3` (i.e. its mean) or
+  `lognormal:0.5,0.4` (i.e. its median and sigma).
+  """
+
+  def __init__(self, spec: str, seed: Optional[int] = None) -> None:
+    (self.kind, _, params) = spec.partition(":")
+    self.params = [float(param) for param in params.split(",") if param]
+    self._random = random.Random(seed)
+
+    expected_params = {"fixed": 1, "uniform": 2, "exponential": 1, "lognormal": 2}
+    if expected_params.get(self.kind) != len(self.params):
+      raise ValueError(f"Invalid latency distribution: {spec}")
+
+
+  def sample(self) -> float:
+    if self.kind == "fixed":
+      return self.params[0]
+    if self.kind == "uniform":
+      return self._random.uniform(*self.params)
+    if self.kind == "exponential":
+      return self._random.expovariate(1 / self.params[0])
+    return self._random.lognormvariate(math.log(self.params[0]), self.params[1])
+
+
+def _stable_choice(text: str, options: List[str]) -> str:
+  # Pick an option based on a hash of the text, so that identical requests get identical responses
+  return options[int(hashlib.sha256(text.encode()).hexdigest(), 16) % len(options)]
+
+
+def _get_definition_name(definition: str) -> str:
+  match = re.search(r"(?:def|class)\s+(\w+)", definition)
+  return match.group(1) if match else "definition"
+
+
+def _get_parameter_names(definition: str) -> List[str]:
+  match = re.search(r"def\s+\w+\s*\(([^)]*)\)", definition)
+  if not match:
+    return []
+
+  names = []
+  for parameter in match.group(1).split(","):
+    name = parameter.split(":")[0].split("=")[0].strip().lstrip("*")
+    if name and name not in ("self", "cls", "/"):
+      names.append(name)
+  return names
+
+
+def _describe(definition: str, definition_type: str) -> dict:
+  name = _get_definition_name(definition)
+  verb = _stable_choice(definition, ["Computes", "Returns", "Builds", "Handles", "Updates"])
+  if definition_type == "class":
+    return {"description": f"Represents {name}."}
+  return {
+    "description": f"{verb} the result of {name}.",
+    "parameters": [
+      {"name": parameter, "description": f"The {parameter} to use.", "assumed_type": "Any"}
+      for parameter in _get_parameter_names(definition)
+    ],
+    "return_values": [{"name": "result", "description": f"The result of {name}.", "assumed_type": "Any"}],
+    "exceptions": [],
+  }
+
+
+def build_function_call_arguments(body: dict) -> dict:
+  """Builds deterministic arguments for the function call the request asks for."""
+  function_name = body["function_call"]["name"]
+  content = body["messages"][-1]["content"]
+
+  # Batched requests head each definition with `ID: `...` (type)`
+  if function_name.endswith("_definitions"):
+    docstrings = []
+    for section in re.split(r"(?m)^(?=ID: `)", content):
+      match = re.match(r"ID: `([^`]+)` \((\w+)\)\n", section)
+      if match:
+        docstrings.append({"definition_id": match.group(1), **_describe(section[match.end():], match.group(2))})
+    return {"docstrings": docstrings}
+
+  # Parts of oversized functions are summarized in one sentence
+  if function_name.endswith("_chunk_summary"):
+    return {"summary": _describe(content, "function")["description"]}
+
+  return _describe(content, "class" if function_name.endswith("_class") else "function")
+
+
+def _estimate_tokens(text: str) -> int:
+  return max(1, len(text) // 4)
+
+
+class MockOpenAIServer:
+  """
+  Mock chat completions server, which runs on its own thread and event loop.
+
+  Args:
+    latency: The latency distribution of responses, see `LatencyDistribution`
+    rate_limit_probability: The probability of answering a request with a 429
+    max_concurrency: The number of requests in flight above which requests are answered with a 429, if any
+    retry_after: The `Retry-After` header of 429s, in seconds
+    latency_per_token: Extra latency per prompt token, in seconds, so that larger requests take longer
+    seed: The seed for latencies and injected rate limits
+  """
+
+  def __init__(
+    self,
+    latency: str = "fixed:0.05",
+    rate_limit_probability: float = 0.0,
+    max_concurrency: Optional[int] = None,
+    retry_after: float = 0.5,
+    latency_per_token: float = 0.0,
+    seed: Optional[int] = 0,
+  ) -> None:
+    self._latency = LatencyDistribution(latency, seed=seed)
+    self._rate_limit_probability = rate_limit_probability
+    self._max_concurrency = max_concurrency
+    self._retry_after = retry_after
+    self._latency_per_token = latency_per_token
+    self._random = random.Random(seed)
+
+    self._in_flight = 0
+    self.stats = {"requests": 0, "rate_limited": 0, "prompt_tokens": 0, "completion_tokens": 0, "peak_in_flight": 0}
+
+    self._loop: Optional[asyncio.AbstractEventLoop] = None
+    self._runner: Optional[web.AppRunner] = None
+    self.url: Optional[str] = None
+
+
+  def reset_stats(self) -> None:
+    self.stats = {key: 0 for key in self.stats}
+
+
+  def make_app(self) -> web.Application:
+    app = web.Application(client_max_size=2**26)
+    app.router.add_post("/v1/chat/completions", self._handle_chat_completion)
+    app.router.add_post("/chat/completions", self._handle_chat_completion)
+    return app
+
+
+  async def _handle_chat_completion(self, request: web.Request) -> web.Response:
+    body = await request.json()
+    self.stats["requests"] += 1
+
+    # Inject rate limits, either at random or because too many requests are in flight
+    over_capacity = self._max_concurrency is not None and self._in_flight >= self._max_concurrency
+    if over_capacity or self._random.random() < self._rate_limit_probability:
+      self.stats["rate_limited"] += 1
+      return web.json_response(
+        {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+        status=429,
+        headers={"Retry-After": str(self._retry_after)},
+      )
+
+    self._in_flight += 1
+    self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self._in_flight)
+    prompt_tokens = _estimate_tokens(json.dumps(body["messages"]) + json.dumps(body.get("functions", [])))
+    try:
+      await asyncio.sleep(self._latency.sample() + self._latency_per_token * prompt_tokens)
+    finally:
+      self._in_flight -= 1
+
+    arguments = json.dumps(build_function_call_arguments(body))
+    completion_tokens = _estimate_tokens(arguments)
+    self.stats["prompt_tokens"] += prompt_tokens
+    self.stats["completion_tokens"] += completion_tokens
+
+    return web.json_response({
+      "id": f"chatcmpl-mock-{self.stats['requests']}",
+      "object": "chat.completion",
+      "model": body.get("model"),
+      "choices": [{
+        "index": 0,
+        "message": {"role": "assistant", "content": None, "function_call": {"name": body["function_call"]["name"], "arguments": arguments}},
+        "finish_reason": "stop",
+      }],
+      "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+    })
+
+
+  def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+    """Starts serving on a background thread, and returns the base URL of the API (i.e. ending in `/v1`)."""
+    self._loop = asyncio.new_event_loop()
+    threading.Thread(target=self._loop.run_forever, name="mock_openai_server", daemon=True).start()
+
+    async def start_site() -> int:
+      self._runner = web.AppRunner(self.make_app())
+      await self._runner.setup()
+      site = web.TCPSite(self._runner, host, port)
+      await site.start()
+      return site._server.sockets[0].getsockname()[1]
+
+    bound_port = asyncio.run_coroutine_threadsafe(start_site(), self._loop).result()
+    self.url = f"http://{host}:{bound_port}/v1"
+    return self.url
+
+
+  def stop(self) -> None:
+    if self._loop is None:
+      return
+    asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+    self._loop.call_soon_threadsafe(self._loop.stop)
+    self._loop = None
+
+
+  def __enter__(self) -> "MockOpenAIServer":
+    self.start()
+    return self
+
+
+  def __exit__(self, *_) -> None:
+    self.stop()
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Mock OpenAI chat completions server")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8000)
+  parser.add_argument("--latency", default="fixed:0.05", help="Latency distribution, e.g. `fixed:0.2`, `uniform:0.1,0.5`, `exponential:0.3` or `lognormal:0.5,0.4`")
+  parser.add_argument("--rate-limit-probability", type=float, default=0.0)
+  parser.add_argument("--max-concurrency", type=int, default=None)
+  parser.add_argument("--retry-after", type=float, default=0.5)
+  parser.add_argument("--latency-per-token", type=float, default=0.0, help="Extra latency per prompt token, in seconds")
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  server = MockOpenAIServer(
+    latency=args.latency,
+    rate_limit_probability=args.rate_limit_probability,
+    max_concurrency=args.max_concurrency,
+    retry_after=args.retry_after,
+    latency_per_token=args.latency_per_token,
+    seed=args.seed,
+  )
+  web.run_app(server.make_app(), host=args.host, port=args.port)
@@ -0,0 +1,201 @@
+##
+## End-to-end throughput benchmarks for `generate_docstrings`, against the mock OpenAI server and a synthetic corpus.
+## Reports files/sec, definitions/sec, requests and tokens per definition, and p50/p95 request latency for each
+## scenario, and optionally saves the results as a baseline or compares them against one.
+##
+## Usage:
+##   python benchmarks/run_benchmarks.py --save-baseline main
+##   python benchmarks/run_benchmarks.py --baseline main --scenarios async async_batched
+##
+
+from typing import Callable, Dict, List, Optional, Tuple
+import statistics
+import argparse
+import logging
+import tempfile
+import time
+import json
+import sys
+import os
+
+# Run against the package in this checkout, so that it doesn't need to be installed first
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from mock_openai_server import MockOpenAIServer
+from corpus import generate_corpus
+
+import openai
+
+import ai_docs_engine
+from ai_docs_engine.openai_docstring_agent import OpenAIDocstringBackend, generate_docstring
+from ai_docs_engine.docstring_schema import ClassDocstringData, FunctionDocstringData
+from ai_docs_engine.backend import BaseDocstringBackend, CallableDocstringBackend
+from ai_docs_engine.prescan import count_undocumented_definitions
+from ai_docs_engine.tokens import token_usage
+from ai_docs_engine.logger import logger
+
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+class TimedBackend(BaseDocstringBackend):
+  """Records the latency of every request made through another backend."""
+
+  def __init__(self, backend: BaseDocstringBackend) -> None:
+    self._backend = backend
+    self.latencies: List[float] = []
+
+
+  async def _timed(self, coroutine):
+    start = time.perf_counter()
+    try:
+      return await coroutine
+    finally:
+      self.latencies.append(time.perf_counter() - start)
+
+
+  async def generate(self, **kwargs) -> FunctionDocstringData | ClassDocstringData:
+    return await self._timed(self._backend.generate(**kwargs))
+
+
+  async def generate_many(self, **kwargs) -> Dict[str, FunctionDocstringData | ClassDocstringData]:
+    return await self._timed(self._backend.generate_many(**kwargs))
+
+
+  @property
+  def supports_batching(self) -> bool:
+    return self._backend.supports_batching
+
+
+  def cache_fingerprint(self) -> str:
+    return self._backend.cache_fingerprint()
+
+
+  async def aclose(self) -> None:
+    await self._backend.aclose()
+
+
+# Each scenario maps the mock server's URL to a backend, and to overrides of the common config
+SCENARIOS: Dict[str, Callable[[str], Tuple[BaseDocstringBackend, dict]]] = {
+  "sync":                  lambda url: (CallableDocstringBackend(generate_docstring, max_threads=32), {"adaptive_concurrency": False, "max_requests_in_flight": 32}),
+  "async":                 lambda url: (OpenAIDocstringBackend(api_base=url, api_key="mock", batching=False), {}),
+  "async_batched":         lambda url: (OpenAIDocstringBackend(api_base=url, api_key="mock", batching=True), {}),
+  "async_batched_process": lambda url: (OpenAIDocstringBackend(api_base=url, api_key="mock", batching=True), {"execution_mode": "process"}),
+}
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+  if not values:
+    return 0.0
+  if len(values) == 1:
+    return values[0]
+  return statistics.quantiles(values, n=100, method="inclusive")[int(percentile) - 1]
+
+
+def run_scenario(
+  name: str,
+  server: MockOpenAIServer,
+  corpus_dir: str,
+  corpus_options: dict,
+) -> dict:
+  # Regenerate the corpus, since every run documents it in-place
+  paths = generate_corpus(root=corpus_dir, **corpus_options)
+  num_definitions = 0
+  for path in paths:
+    with open(path) as file:
+      num_definitions += count_undocumented_definitions(file.read(), skip_init_methods=True)
+
+  (backend, overrides) = SCENARIOS[name](server.url)
+  timed_backend = TimedBackend(backend)
+  config = ai_docs_engine.AIDocsEngineConfig(**{
+    "include_rules":          [os.path.join(corpus_dir, "**", "*.py")],
+    "exclude_rules":          [],
+    "inplace":                True,
+    "backend":                timed_backend,
+    "cache_dir":              None,
+    "max_requests_in_flight": 256,
+    "requests_per_minute":    10**7,
+    "tokens_per_minute":      10**10,
+    "retry_base_delay":       0.05,
+    **overrides,
+  })
+
+  server.reset_stats()
+  start = time.perf_counter()
+  ai_docs_engine.generate_docstrings(config)
+  elapsed = time.perf_counter() - start
+
+  usage = token_usage.snapshot().values()
+  total_tokens = sum(model_usage["prompt_tokens"] + model_usage["completion_tokens"] for model_usage in usage)
+  return {
+    "files":                   len(paths),
+    "definitions":             num_definitions,
+    "seconds":                 round(elapsed, 3),
+    "files_per_second":        round(len(paths) / elapsed, 2),
+    "definitions_per_second":  round(num_definitions / elapsed, 2),
+    "requests_per_definition": round(server.stats["requests"] / max(num_definitions, 1), 3),
+    "tokens_per_definition":   round(total_tokens / max(num_definitions, 1), 1),
+    "rate_limited_requests":   server.stats["rate_limited"],
+    "latency_p50":             round(_percentile(timed_backend.latencies, 50), 4),
+    "latency_p95":             round(_percentile(timed_backend.latencies, 95), 4),
+  }
+
+
+def _print_results(results: Dict[str, dict], baseline: Optional[Dict[str, dict]]) -> None:
+  for (name, metrics) in results.items():
+    print(f"\n{name}")
+    for (metric, value) in metrics.items():
+      line = f"  {metric:<24} {value:>12}"
+      previous = (baseline or {}).get(name, {}).get(metric)
+      if isinstance(previous, (int, float)) and previous:
+        line += f"   ({(value - previous) / previous:+.1%} vs. baseline {previous})"
+      print(line)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark `generate_docstrings` against a mock OpenAI server")
+  parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+  parser.add_argument("--files", type=int, default=50)
+  parser.add_argument("--definitions", type=int, default=20, help="Definitions per file")
+  parser.add_argument("--huge-class-methods", type=int, default=40, help="Methods of the huge class in every tenth file")
+  parser.add_argument("--latency", default="lognormal:0.2,0.5", help="Latency distribution of the mock server, see `LatencyDistribution`")
+  parser.add_argument("--rate-limit-probability", type=float, default=0.01)
+  parser.add_argument("--max-concurrency", type=int, default=64, help="Requests in flight above which the mock server answers with 429s")
+  parser.add_argument("--save-baseline", metavar="NAME", help="Save the results as a baseline")
+  parser.add_argument("--baseline", metavar="NAME", help="Compare the results against a saved baseline")
+  args = parser.parse_args()
+
+  logger.setLevel(logging.WARNING)
+
+  baseline = None
+  if args.baseline is not None:
+    with open(os.path.join(BASELINES_DIR, f"{args.baseline}.json")) as file:
+      baseline = json.load(file)["results"]
+
+  corpus_options = {
+    "num_files":          args.files,
+    "num_definitions":    args.definitions,
+    "huge_class_methods": args.huge_class_methods,
+  }
+
+  server = MockOpenAIServer(
+    latency=args.latency,
+    rate_limit_probability=args.rate_limit_probability,
+    max_concurrency=args.max_concurrency,
+    retry_after=0.2,
+  )
+  with server, tempfile.TemporaryDirectory() as corpus_dir:
+    # The synchronous OpenAI functions use the global client settings
+    openai.api_base = server.url
+    openai.api_key = "mock"
+
+    results = {name: run_scenario(name, server, corpus_dir, corpus_options) for name in args.scenarios}
+
+  _print_results(results, baseline)
+
+  if args.save_baseline is not None:
+    os.makedirs(BASELINES_DIR, exist_ok=True)
+    with open(os.path.join(BASELINES_DIR, f"{args.save_baseline}.json"), "w") as file:
+      json.dump({"options": vars(args), "results": results}, file, indent=2)
+    print(f"\nSaved baseline `{args.save_baseline}`")
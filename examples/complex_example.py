@@ -41,6 +41,9 @@ config = ai_docs_engine.AIDocsEngineConfig(
   # Specify function to generate docstrings
   generate_docstring_func=ai_docs_engine.openai_docstring_agent.generate_docstring,
 
+  # Document small definitions in batches, to cut down on requests
+  batch_generate_docstring_func=ai_docs_engine.openai_docstring_agent.generate_docstrings,
+
   # Specify docstring builder
   docstring_builder=ai_docs_engine.docstring_builders.NumpyDocstringBuilder(),
 )
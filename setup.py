@@ -26,10 +26,16 @@ setup(
   # requirements
   python_requires=">=3.6",
   install_requires=[
+    "aiohttp",
+    "diskcache",
     "libcst",
     "openai",
     "pydantic",
   ],
+  extras_require={
+    # exact, offline token counting; falls back to a character-based estimate without it
+    "tokens": ["tiktoken"],
+  },
 
   # testing
   test_suite="tests",
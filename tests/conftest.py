@@ -0,0 +1,110 @@
+from typing import List, Optional, Tuple
+import threading
+import re
+
+import pytest
+
+from ai_docs_engine.docstring_schema import ClassDocstringData, FunctionDocstringData
+from ai_docs_engine.errors import AIDocsEngineTooManyTokensError
+from ai_docs_engine.backend import BaseDocstringBackend
+from ai_docs_engine.config import AIDocsEngineConfig
+from ai_docs_engine.tokens import count_tokens
+
+
+class StubBackend(BaseDocstringBackend):
+  """
+  Backend which documents every definition as "Stub docstring for `name`."
+  without any network access, and records the requests it was sent. Requests
+  over `max_tokens` fail the way they would for a model's context window.
+  """
+
+  def __init__(self, max_tokens: Optional[int] = None) -> None:
+    self.max_tokens = max_tokens
+    self.requests: List[Tuple[str, str]] = []
+    self.chunk_requests: List[str] = []
+    self._lock = threading.Lock()
+
+
+  @staticmethod
+  def document(
+    definition: str,
+    definition_type: str,
+  ) -> FunctionDocstringData | ClassDocstringData:
+    name = re.search(r"(?:def|class) (\w+)", definition).group(1)
+    if definition_type == "class":
+      return ClassDocstringData(description=f"Stub docstring for `{name}`.")
+    return FunctionDocstringData(description=f"Stub docstring for `{name}`.")
+
+
+  async def generate(
+    self,
+    language: str,
+    definition: str,
+    definition_type: str,
+    temperature: float,
+  ) -> FunctionDocstringData | ClassDocstringData:
+    with self._lock:
+      self.requests.append((definition_type, definition))
+    if self.max_tokens is not None and count_tokens(definition) > self.max_tokens:
+      raise AIDocsEngineTooManyTokensError(num_tokens=count_tokens(definition))
+    return self.document(definition, definition_type)
+
+
+  async def summarize_chunk(
+    self,
+    language: str,
+    definition: str,
+    temperature: float,
+  ) -> str:
+    with self._lock:
+      self.chunk_requests.append(definition)
+    return f"Does part {len(self.chunk_requests)}."
+
+
+  def render_request(
+    self,
+    language: str,
+    definition: str,
+    definition_type: str,
+    temperature: float,
+  ) -> dict:
+    return {"method": "POST", "url": "/stub", "body": {"definition": definition, "definition_type": definition_type}}
+
+
+  def parse_response(
+    self,
+    response: dict,
+    language: str,
+    definition: str,
+    definition_type: str,
+  ) -> FunctionDocstringData | ClassDocstringData:
+    return self.document(response["definition"], response["definition_type"])
+
+
+  @property
+  def requested_names(self) -> List[str]:
+    return sorted(re.search(r"(?:def|class) (\w+)", definition).group(1) for (_, definition) in self.requests)
+
+
+@pytest.fixture
+def stub_backend() -> StubBackend:
+  return StubBackend()
+
+
+@pytest.fixture
+def make_config(tmp_path, monkeypatch):
+  # Runs are made from a temporary directory, so that relative rules only ever see the files of the test
+  monkeypatch.chdir(tmp_path)
+
+  def make_config(**kwargs) -> AIDocsEngineConfig:
+    kwargs = {
+      "include_rules":    ["**/*.py"],
+      "exclude_rules":    [],
+      "inplace":          True,
+      "cache_dir":        None,
+      "retry_base_delay": 0.01,
+      **kwargs,
+    }
+    return AIDocsEngineConfig(**kwargs)
+
+  return make_config
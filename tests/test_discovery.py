@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from ai_docs_engine.discovery import SourceFileMatcher, iter_source_file_paths
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+  for path in ["pkg/a.py", "pkg/test_a.py", "pkg/test_keep.py", "pkg/notes.txt", "pkg/.hidden.py", "build/b.py", "build/lib/c.py", "real/d.py"]:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "w").close()
+  return tmp_path
+
+
+def test_include_exclude_and_negation(tree):
+  assert list(iter_source_file_paths(["**/*.py"], [])) == ["build/b.py", "build/lib/c.py", "pkg/a.py", "pkg/test_a.py", "pkg/test_keep.py", "real/d.py"]
+  assert list(iter_source_file_paths(["pkg/*.py"], ["test_*.py"])) == ["pkg/a.py"]
+  assert list(iter_source_file_paths(["pkg/*.py"], ["test_*.py", "!test_keep.py"])) == ["pkg/a.py", "pkg/test_keep.py"]
+  assert list(iter_source_file_paths(["**/*.py"], ["build/"])) == ["pkg/a.py", "pkg/test_a.py", "pkg/test_keep.py", "real/d.py"]
+  assert list(iter_source_file_paths(["**/*.py", "!pkg/test_*.py"], ["lib"])) == ["build/b.py", "pkg/a.py", "real/d.py"]
+  assert list(iter_source_file_paths(["pkg/.hidden.py"], [])) == ["pkg/.hidden.py"]
+
+
+@pytest.mark.parametrize("exclude_rule", ["build/", "build", "build/**"])
+def test_exclude_rules_apply_to_walk_roots(tree, exclude_rule):
+  assert list(iter_source_file_paths(["build/*.py"], [exclude_rule])) == []
+  assert list(iter_source_file_paths(["build/lib/*.py"], [exclude_rule])) == []
+  assert SourceFileMatcher(["build/*.py"], [exclude_rule]).match("build/b.py") is None
+
+
+def test_matcher_agrees_with_walk(tree):
+  matcher = SourceFileMatcher(["**/*.py"], ["test_*.py", "!test_keep.py", "lib/"])
+  walked_paths = list(iter_source_file_paths(["**/*.py"], ["test_*.py", "!test_keep.py", "lib/"]))
+  assert walked_paths == ["build/b.py", "pkg/a.py", "pkg/test_keep.py", "real/d.py"]
+  for path in ["build/b.py", "build/lib/c.py", "pkg/a.py", "pkg/test_a.py", "pkg/test_keep.py", "pkg/.hidden.py", "pkg/notes.txt", "real/d.py"]:
+    assert matcher.match(path) == (path if path in walked_paths else None), f"Expected the matcher to agree with the walk on `{path}`"
+
+
+def test_follows_symlinked_directories_once(tree):
+  os.symlink("../real", "pkg/linked")
+  os.symlink(".", "pkg/loop")
+  assert list(iter_source_file_paths(["pkg/**/*.py"], ["test_*.py"])) == ["pkg/a.py", "pkg/linked/d.py"]
@@ -0,0 +1,131 @@
+import textwrap
+import json
+
+from ai_docs_engine.engine import generate_docstrings
+from ai_docs_engine.metrics import metrics
+from ai_docs_engine.tokens import token_usage
+
+
+ACCOUNT_SOURCE = textwrap.dedent('''
+  class Account:
+    def __init__(self, balance):
+      self._balance = balance
+
+    @property
+    def balance(self):
+      return self._balance
+
+    def deposit(self, amount):
+      if amount <= 0:
+        raise ValueError("amount")
+      self._balance += amount
+      return self._balance
+
+
+  def total(accounts):
+    return sum(account.balance for account in accounts)
+''').lstrip()
+
+
+def _write(tmp_path, name: str, source: str) -> str:
+  path = tmp_path / name
+  path.write_text(source)
+  return str(path)
+
+
+def test_generates_docstrings_with_stub_backend(tmp_path, make_config, stub_backend):
+  path = _write(tmp_path, "account.py", ACCOUNT_SOURCE)
+
+  results = generate_docstrings(make_config(backend=stub_backend))
+
+  assert results == {"account.py": "account.py"}
+  assert stub_backend.requested_names == ["Account", "deposit", "total"]
+  source = open(path).read()
+  for name in ("Account", "deposit", "total"):
+    assert f"Stub docstring for `{name}`." in source, f"Expected a docstring for `{name}`"
+  assert "Returns the balance." in source, "Expected the getter to be documented locally"
+  compile(source, path, "exec")
+
+
+def test_triage_policy_decides_how_trivial_definitions_are_documented(tmp_path, make_config, stub_backend):
+  path = _write(tmp_path, "account.py", ACCOUNT_SOURCE)
+
+  generate_docstrings(make_config(backend=stub_backend, triage_policy={"getter": "skip"}))
+  assert "balance" not in stub_backend.requested_names
+  assert "Returns the balance." not in open(path).read()
+  assert metrics.get_counter("avoided_requests", decision="skip", kind="getter") == 1
+
+  _write(tmp_path, "account.py", ACCOUNT_SOURCE)
+  generate_docstrings(make_config(backend=stub_backend, triage_policy={"getter": "llm"}))
+  assert "balance" in stub_backend.requested_names
+  assert "Stub docstring for `balance`." in open(path).read()
+
+
+def test_manifest_skips_unchanged_files_until_invalidated(tmp_path, make_config, stub_backend):
+  # Files are written elsewhere, so that the sources stay undocumented and only the manifest can skip them
+  _write(tmp_path, "account.py", ACCOUNT_SOURCE)
+  other_path = _write(tmp_path, "other.py", "def double(x):\n  return x * 2\n")
+  config_kwargs = dict(include_rules=["account.py", "other.py"], backend=stub_backend, inplace=False, manifest_path=str(tmp_path / "manifest.json"))
+
+  generate_docstrings(make_config(**config_kwargs))
+  assert stub_backend.requested_names == ["Account", "deposit", "double", "total"]
+
+  # Nothing changed, so nothing is requested again
+  stub_backend.requests.clear()
+  generate_docstrings(make_config(**config_kwargs))
+  assert stub_backend.requests == []
+
+  # Only the definition which was added is requested
+  with open(other_path, "a") as file:
+    file.write("\n\ndef triple(x):\n  return x * 3\n")
+  generate_docstrings(make_config(**config_kwargs))
+  assert stub_backend.requested_names == ["triple"]
+
+  # Settings which change the output invalidate the whole manifest
+  stub_backend.requests.clear()
+  generate_docstrings(make_config(**config_kwargs, triage_policy={"getter": "llm"}))
+  assert stub_backend.requested_names == ["Account", "balance", "deposit", "double", "total", "triple"]
+
+
+def test_bulk_export_import_round_trip(tmp_path, make_config, stub_backend):
+  path = _write(tmp_path, "account.py", ACCOUNT_SOURCE)
+  requests_path = str(tmp_path / "requests.jsonl")
+  results_path = str(tmp_path / "results.jsonl")
+
+  # Exporting doesn't call the backend or touch the source tree
+  assert generate_docstrings(make_config(backend=stub_backend, export_requests_path=requests_path)) == {}
+  assert stub_backend.requests == []
+  assert open(path).read() == ACCOUNT_SOURCE
+
+  # Answer every exported request offline, in the output format of OpenAI's batch API
+  with open(requests_path) as requests_file, open(results_path, "w") as results_file:
+    lines = [json.loads(line) for line in requests_file]
+    for line in lines:
+      results_file.write(json.dumps({"custom_id": line["custom_id"], "response": {"status_code": 200, "body": line["body"]}}) + "\n")
+  assert len(lines) == 3
+
+  generate_docstrings(make_config(backend=stub_backend, import_results_path=results_path))
+  assert stub_backend.requests == []
+  assert metrics.get_counter_total("failed_definitions") == 0
+  assert token_usage.snapshot() == {}
+  source = open(path).read()
+  for name in ("Account", "deposit", "total"):
+    assert f"Stub docstring for `{name}`." in source, f"Expected an imported docstring for `{name}`"
+  assert "Returns the balance." in source, "Expected the getter to be documented locally on import"
+
+
+def test_chunks_functions_too_large_for_any_model(tmp_path, make_config, stub_backend):
+  body = "".join(f"  value_{index} = compute(value_{index - 1}, {index})\n" for index in range(1, 80))
+  path = _write(tmp_path, "large.py", f"def large(value_0):\n{body}  return value_79\n")
+  stub_backend.max_tokens = 400
+
+  generate_docstrings(make_config(backend=stub_backend, chunk_max_tokens=200))
+
+  # Map: every chunk is summarized on its own, then reduce: the docstring is generated from the summaries
+  num_chunks = len(stub_backend.chunk_requests)
+  assert num_chunks > 1
+  assert metrics.get_histogram_sum("definition_chunks") == num_chunks
+  reduced_definition = stub_backend.requests[-1][1]
+  assert f"# Part {num_chunks} of {num_chunks}:" in reduced_definition
+  assert "value_40 = compute" not in reduced_definition
+  assert "Stub docstring for `large`." in open(path).read()
@@ -0,0 +1,35 @@
+import textwrap
+
+import libcst
+import pytest
+
+from ai_docs_engine.local_docstrings import build_local_docstring, classify_trivial_definition
+
+
+def _parse_definition(source: str) -> libcst.FunctionDef | libcst.ClassDef:
+  return libcst.parse_module(textwrap.dedent(source)).body[0]
+
+
+@pytest.mark.parametrize(("source", "kind"), [
+  ("@overload\ndef parse(value: int) -> int: ...\n", "overload"),
+  ("@abc.abstractmethod\ndef run(self):\n  pass\n", "abstract_method"),
+  ("@property\ndef name(self):\n  return self._name\n", "getter"),
+  ("class NotFoundError(LookupError):\n  pass\n", "empty_class"),
+  ("def __len__(self):\n  return len(self._items)\n", "dunder"),
+  ("@abc.abstractmethod\ndef run(self):\n  return self.start()\n", None),
+  ("def __len__(self):\n  self.check()\n  return len(self._items)\n", None),
+  ("def name(self, default):\n  return self._name or default\n", None),
+  ("class Stack(list):\n  def peek(self):\n    return self[-1]\n", None),
+])
+def test_classify_trivial_definition(source, kind):
+  assert classify_trivial_definition(_parse_definition(source)) == kind
+
+
+def test_build_local_docstring():
+  getter = _parse_definition("@property\ndef user_id(self) -> int:\n  return self._user_id\n")
+  docstring_data = build_local_docstring(getter, "getter")
+  assert docstring_data.description == "Returns the user id."
+  assert [return_value.assumed_type for return_value in docstring_data.return_values] == ["int"]
+
+  empty_class = _parse_definition("class NotFoundError(LookupError):\n  pass\n")
+  assert build_local_docstring(empty_class, "empty_class").description == "Specializes `LookupError` without adding any behavior of its own."
@@ -0,0 +1,41 @@
+import json
+
+from ai_docs_engine.metrics import MetricsRegistry
+
+
+def test_snapshot_merge_round_trip():
+  source = MetricsRegistry()
+  source.increment("cache_lookups", result="hit")
+  source.increment("cache_lookups", 2, result="miss")
+  source.set_gauge("makespan_seconds", 1.5, kind="actual")
+  source.set_gauge("file_bytes", 10, file_path="/src/a,b=c.py")
+  source.observe("stage_seconds", 0.02, stage="parse")
+  source.increment("discovered_files")
+
+  target = MetricsRegistry()
+  target.merge(source.snapshot())
+  target.merge(source.snapshot())
+
+  assert target.get_counter("cache_lookups", result="hit") == 2
+  assert target.get_counter("cache_lookups", result="miss") == 4
+  assert target.get_counter("discovered_files") == 2
+  assert target.get_histogram_sum("stage_seconds", stage="parse") == 0.04
+  assert target.snapshot()["gauges"] == source.snapshot()["gauges"]
+
+  # Label values with separators must survive the export too
+  assert 'file_path="/src/a,b=c.py"' in target.to_prometheus()
+
+
+def test_snapshot_entries_are_structured(tmp_path):
+  registry = MetricsRegistry()
+  registry.increment("tokens", 120, model="gpt-4", kind="prompt")
+  registry.observe("request_seconds", 0.2, outcome="success")
+
+  path = tmp_path / "metrics.json"
+  registry.write_json(str(path))
+  snapshot = json.loads(path.read_text())
+
+  assert snapshot["counters"] == [{"name": "tokens", "labels": {"kind": "prompt", "model": "gpt-4"}, "value": 120}]
+  assert snapshot["gauges"] == []
+  [histogram] = snapshot["histograms"]
+  assert (histogram["name"], histogram["labels"], histogram["count"], histogram["sum"]) == ("request_seconds", {"outcome": "success"}, 1, 0.2)
@@ -0,0 +1,99 @@
+import socket
+import time
+
+import pytest
+
+from ai_docs_engine.openai_docstring_agent import OpenAIDocstringBackend
+from ai_docs_engine.backend import BaseDocstringBackend
+from ai_docs_engine.scheduler import RequestScheduler, compute_backoff_delay
+from ai_docs_engine.errors import AIDocsEngineError, AIDocsEngineRetryableError
+from ai_docs_engine.config import AIDocsEngineConfig
+
+
+def _make_config(**kwargs) -> AIDocsEngineConfig:
+  # Jobs are submitted to the scheduler directly, so the backend is never called unless a test uses it
+  kwargs = {"backend": BaseDocstringBackend(), **kwargs}
+  return AIDocsEngineConfig(include_rules=[], exclude_rules=[], cache_dir=None, **kwargs)
+
+
+def _fail_first(errors: list, result: str = "done"):
+  # Returns a job which raises the given errors on its first calls, then succeeds, along with the list of its call times
+  calls = []
+
+  async def job() -> str:
+    calls.append(time.monotonic())
+    if len(calls) <= len(errors):
+      raise errors[len(calls) - 1]
+    return result
+
+  return (job, calls)
+
+
+def test_compute_backoff_delay_honors_retry_after():
+  for attempt in range(5):
+    delay = compute_backoff_delay(attempt=attempt, base_delay=1.0, max_delay=4.0)
+    assert 0 <= delay <= min(4.0, 2 ** attempt)
+  assert compute_backoff_delay(attempt=0, base_delay=0.01, max_delay=0.01, retry_after=5.0) == 5.0
+
+
+def test_retries_transient_errors_after_retry_after():
+  (job, calls) = _fail_first([
+    AIDocsEngineRetryableError("Service unavailable", status_code=503),
+    AIDocsEngineRetryableError("Too many requests", status_code=429, retry_after=0.3),
+  ])
+  with RequestScheduler(_make_config(retry_max_delay=0.01)) as scheduler:
+    assert scheduler.submit(job, estimated_tokens=1).result(timeout=10) == "done"
+
+  assert len(calls) == 3
+  assert calls[2] - calls[1] >= 0.3, "Expected the retry to wait for as long as `Retry-After` asked"
+
+
+def test_gives_up_on_errors_which_are_not_transient_or_out_of_retries():
+  (job, calls) = _fail_first([AIDocsEngineError("Invalid request")])
+  with RequestScheduler(_make_config()) as scheduler:
+    with pytest.raises(AIDocsEngineError, match="Invalid request"):
+      scheduler.submit(job, estimated_tokens=1).result(timeout=10)
+  assert len(calls) == 1
+
+  (job, calls) = _fail_first([AIDocsEngineRetryableError("Bad gateway", status_code=502)] * 3)
+  with RequestScheduler(_make_config(max_retries=2, retry_max_delay=0.01)) as scheduler:
+    with pytest.raises(AIDocsEngineRetryableError, match="Bad gateway"):
+      scheduler.submit(job, estimated_tokens=1).result(timeout=10)
+  assert len(calls) == 3
+
+
+def test_rate_limit_cuts_concurrency_limit():
+  (job, _) = _fail_first([AIDocsEngineRetryableError("Too many requests", status_code=429)])
+  config = _make_config(initial_requests_in_flight=8, max_requests_in_flight=8, max_retries=0)
+  with RequestScheduler(config) as scheduler:
+    with pytest.raises(AIDocsEngineRetryableError):
+      scheduler.submit(job, estimated_tokens=1).result(timeout=10)
+    assert scheduler.concurrency.limit == 4, "Expected a rate limited request to halve the concurrency limit"
+
+  # Errors which don't signal overload leave the limit alone
+  (job, _) = _fail_first([AIDocsEngineRetryableError("Bad gateway", status_code=502)])
+  with RequestScheduler(config) as scheduler:
+    with pytest.raises(AIDocsEngineRetryableError):
+      scheduler.submit(job, estimated_tokens=1).result(timeout=10)
+    assert scheduler.concurrency.limit == 8
+
+
+def test_backend_timeout_cuts_concurrency_limit():
+  # A server which accepts connections but never answers, so that every request times out
+  with socket.socket() as server:
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    backend = OpenAIDocstringBackend(api_base=f"http://127.0.0.1:{server.getsockname()[1]}/v1", api_key="test", timeout=0.1)
+    config = _make_config(backend=backend, initial_requests_in_flight=8, max_requests_in_flight=8, max_retries=0)
+
+    scheduler = RequestScheduler(config)
+    try:
+      future = scheduler.submit(
+        func=lambda: backend.generate(language="python", definition="def f(x):\n  return x\n", definition_type="function", temperature=0.0),
+        estimated_tokens=1,
+      )
+      with pytest.raises(AIDocsEngineRetryableError):
+        future.result(timeout=10)
+      assert scheduler.concurrency.limit == 4, "Expected a timed out request to halve the concurrency limit"
+    finally:
+      scheduler.shutdown(cleanup=backend.aclose)